@@ -1,11 +1,19 @@
 from django.contrib import admin
-from .models import Paciente, Dentista, Servicio, SlotAgenda, Reserva
+from .models import Paciente, Dentista, Servicio, SlotAgenda, Reserva, SobrecupoDia, PlantillaHorario, ExcepcionAgenda
+from .models import HorizonteAgenda, SlotAgendaArchivo, ReservaArchivo
+from .busqueda import buscar_pacientes
 
 @admin.register(Paciente)
 class PacienteAdmin(admin.ModelAdmin):
-    list_display = ('nombre', 'apellido', 'email', 'telefono', 'fecha_registro')
+    list_display = ('nombre', 'apellido', 'rut', 'email', 'telefono', 'fecha_registro')
     search_fields = ('nombre', 'apellido', 'email')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Mismo índice que /agenda/api/pacientes/?q= en vez de icontains sobre toda la tabla
+        if not search_term:
+            return queryset, False
+        return queryset.filter(pk__in=buscar_pacientes(search_term).values('pk')), False
+
 @admin.register(Dentista)
 class DentistaAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'apellido', 'especialidad', 'email')
@@ -18,7 +26,7 @@ class ServicioAdmin(admin.ModelAdmin):
 
 @admin.register(SlotAgenda)
 class SlotAgendaAdmin(admin.ModelAdmin):
-    list_display = ('dentista', 'fecha', 'hora', 'capacidad')
+    list_display = ('dentista', 'fecha', 'hora', 'capacidad', 'reservas_normales', 'reservas_sobrecupo')
     list_filter = ('dentista', 'fecha')
     list_editable = ('capacidad',)
 
@@ -27,3 +35,53 @@ class ReservaAdmin(admin.ModelAdmin):
     list_display = ('paciente', 'slot', 'servicio', 'creado_en', 'sobrecupo')
     list_filter = ('sobrecupo', 'slot__dentista')
     list_editable = ('sobrecupo',)
+
+    def save_model(self, request, obj, form, change):
+        # Las ediciones manuales (slot o sobrecupo) no pasan por la admisión: recalcular contadores
+        slot_anterior = None
+        if change and 'slot' in form.changed_data:
+            slot_anterior = Reserva.objects.get(pk=obj.pk).slot
+        super().save_model(request, obj, form, change)
+        obj.slot.recalcular_ocupacion()
+        if slot_anterior is not None:
+            slot_anterior.recalcular_ocupacion()
+
+@admin.register(SobrecupoDia)
+class SobrecupoDiaAdmin(admin.ModelAdmin):
+    list_display = ('dentista', 'fecha', 'sobrecupos_usados')
+    list_filter = ('dentista', 'fecha')
+    readonly_fields = ('sobrecupos_usados',)
+
+@admin.register(PlantillaHorario)
+class PlantillaHorarioAdmin(admin.ModelAdmin):
+    list_display = ('dentista', 'dia_semana', 'desde', 'hasta', 'capacidad', 'max_overbook', 'vigente_desde', 'vigente_hasta')
+    list_filter = ('dentista', 'dia_semana')
+
+@admin.register(ExcepcionAgenda)
+class ExcepcionAgendaAdmin(admin.ModelAdmin):
+    list_display = ('dentista', 'fecha_desde', 'fecha_hasta', 'desde', 'hasta', 'motivo')
+    list_filter = ('dentista',)
+
+@admin.register(HorizonteAgenda)
+class HorizonteAgendaAdmin(admin.ModelAdmin):
+    list_display = ('dentista', 'generado_hasta', 'actualizado')
+
+
+class SoloLecturaAdmin(admin.ModelAdmin):
+    """El archivo solo se llena con `manage.py archive_agenda`."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(SlotAgendaArchivo)
+class SlotAgendaArchivoAdmin(SoloLecturaAdmin):
+    list_display = ('dentista', 'fecha', 'hora', 'capacidad', 'reservas_normales', 'reservas_sobrecupo')
+    list_filter = ('dentista',)
+
+@admin.register(ReservaArchivo)
+class ReservaArchivoAdmin(SoloLecturaAdmin):
+    list_display = ('paciente', 'dentista', 'fecha', 'hora', 'servicio', 'sobrecupo')
+    list_filter = ('sobrecupo', 'dentista')
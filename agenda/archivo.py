@@ -0,0 +1,126 @@
+"""Archivo histórico: mueve los slots y reservas pasados a `SlotAgendaArchivo` / `ReservaArchivo`.
+
+Las tablas calientes (`SlotAgenda`, `Reserva` y la intermedia de continuaciones) quedan con
+los datos recientes y futuros, así que sus índices se mantienen chicos. El historial se
+consulta en `GET /agenda/historial/reservas/`.
+
+El trabajo se divide en lotes de dentista-día: las reservas de varios bloques solo enlazan
+slots del mismo dentista y día, así que un lote siempre mueve sus reservas completas. Cada
+lote se copia y se borra en una transacción propia, con los slots bloqueados mientras tanto.
+Los sellos de revisión de los días archivados se borran con ellos: la tabla de revisiones
+no crece con el historial.
+"""
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .cache import get_cache
+from .models import Reserva, ReservaArchivo, SlotAgenda, SlotAgendaArchivo, SobrecupoDia
+from .revisiones import incrementar_dias
+
+# Dentista-días por transacción (aprox. 20 slots cada uno)
+ARCHIVO_CHUNK_SIZE = 100
+
+# Claves por sentencia DELETE (bajo el límite de parámetros de SQLite)
+BORRADO_LOTE = 500
+
+CAMPOS_SLOT = (
+    'id', 'dentista_id', 'servicio_id', 'fecha', 'hora', 'capacidad', 'max_overbook', 'creador',
+    'reservas_normales', 'reservas_sobrecupo',
+)
+CAMPOS_RESERVA = ('id', 'slot_id', 'paciente_id', 'servicio_id', 'creado_en', 'sobrecupo')
+
+
+def pendientes(antes):
+    """(slots, reservas) anteriores a `antes` que aún están en las tablas calientes."""
+    return (
+        SlotAgenda.objects.filter(fecha__lt=antes).count(),
+        Reserva.objects.filter(slot__fecha__lt=antes).count(),
+    )
+
+
+def archivar(antes, chunk_size=ARCHIVO_CHUNK_SIZE, progreso=None):
+    """Mueve al archivo los slots con fecha anterior a `antes`, con sus reservas y continuaciones.
+
+    Recorre los dentista-días de a `chunk_size` (keyset sobre (fecha, dentista)) y llama a
+    `progreso(totales)` después de cada lote. Devuelve los totales: `dias`, `slots`, `reservas`.
+    """
+    dias = (
+        SlotAgenda.objects.filter(fecha__lt=antes)
+        .values_list('fecha', 'dentista_id').distinct().order_by('fecha', 'dentista_id')
+    )
+    totales = {'dias': 0, 'slots': 0, 'reservas': 0}
+    condicion = Q()
+    while True:
+        lote = list(dias.filter(condicion)[:chunk_size])
+        if not lote:
+            break
+        slots, reservas = _archivar_lote(lote)
+        totales['dias'] += len(lote)
+        totales['slots'] += slots
+        totales['reservas'] += reservas
+        if progreso:
+            progreso(totales)
+        fecha, dentista_id = lote[-1]
+        condicion = Q(fecha__gt=fecha) | Q(fecha=fecha, dentista_id__gt=dentista_id)
+    return totales
+
+
+def _archivar_lote(lote):
+    claves = set(lote)
+    Continuacion = Reserva.slots_continuacion.through
+    ContinuacionArchivo = ReservaArchivo.slots_continuacion.through
+    with transaction.atomic():
+        # Bloquear los slots: una reserva concurrente espera y luego ya no los encuentra
+        slots = [
+            s for s in SlotAgenda.objects.select_for_update().filter(
+                fecha__range=(lote[0][0], lote[-1][0]), dentista_id__in={d for _, d in lote},
+            ).values(*CAMPOS_SLOT)
+            if (s['fecha'], s['dentista_id']) in claves
+        ]
+        por_id = {s['id']: s for s in slots}
+        reservas = list(Reserva.objects.filter(slot_id__in=list(por_id)).values(*CAMPOS_RESERVA))
+        continuaciones = list(
+            Continuacion.objects.filter(reserva_id__in=[r['id'] for r in reservas])
+            .values_list('reserva_id', 'slotagenda_id')
+        )
+
+        SlotAgendaArchivo.objects.bulk_create([SlotAgendaArchivo(**s) for s in slots], ignore_conflicts=True)
+        ReservaArchivo.objects.bulk_create([
+            ReservaArchivo(
+                dentista_id=por_id[r['slot_id']]['dentista_id'], fecha=por_id[r['slot_id']]['fecha'],
+                hora=por_id[r['slot_id']]['hora'], **r,
+            )
+            for r in reservas
+        ], ignore_conflicts=True)
+        ContinuacionArchivo.objects.bulk_create([
+            ContinuacionArchivo(reservaarchivo_id=reserva_id, slotagendaarchivo_id=slot_id)
+            for reserva_id, slot_id in continuaciones
+        ], ignore_conflicts=True)
+
+        # Borrado directo (sin señales por fila ni liberar_cupo: los slots se van con sus reservas)
+        reserva_ids = [r['id'] for r in reservas]
+        _borrar(Continuacion, 'reserva_id', reserva_ids)
+        _borrar(Reserva, 'id', reserva_ids)
+        _borrar(SobrecupoDia, 'id', [
+            pk for pk, dentista_id, fecha in SobrecupoDia.objects.filter(
+                fecha__range=(lote[0][0], lote[-1][0]), dentista_id__in={d for _, d in lote},
+            ).values_list('pk', 'dentista_id', 'fecha')
+            if (fecha, dentista_id) in claves
+        ])
+        _borrar(SlotAgenda, 'id', list(por_id))
+
+        dias = [(dentista_id, fecha) for fecha, dentista_id in lote]
+        # Las filas de revisión se conservan: con versiones reiniciadas un ETag viejo podría volver a coincidir
+        incrementar_dias(dias)
+        get_cache().invalidar_dias(dias)
+    return len(slots), len(reservas)
+
+
+def _borrar(modelo, columna, valores):
+    """DELETE explícito de las filas de `modelo` con `columna` en `valores`, de a `BORRADO_LOTE` claves."""
+    tabla = connection.ops.quote_name(modelo._meta.db_table)
+    columna = connection.ops.quote_name(columna)
+    with connection.cursor() as cursor:
+        for i in range(0, len(valores), BORRADO_LOTE):
+            lote = valores[i:i + BORRADO_LOTE]
+            cursor.execute(f'DELETE FROM {tabla} WHERE {columna} IN ({", ".join(["%s"] * len(lote))})', lote)
@@ -0,0 +1,129 @@
+"""Variantes async de los endpoints de lectura, sobre el ORM async de Django.
+
+Son vistas Django nativas (DRF no tiene vistas async): bajo un servidor ASGI no ocupan
+un hilo mientras esperan a la base de datos. Devuelven el mismo JSON, con el mismo
+`ETag`/304, que sus versiones síncronas:
+
+- ``/agenda/async/slots_por_fecha/`` ↔ ``/agenda/slots_por_fecha/``
+- ``/agenda/async/disponibilidad/`` ↔ ``/agenda/disponibilidad/``
+- ``/agenda/async/dentistas/`` ↔ ``/agenda/api/dentistas/``
+- ``/agenda/async/servicios/`` ↔ ``/agenda/api/servicios/``
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from . import revisiones
+from .cache import get_cache
+from .disponibilidad import consulta_disponibilidad, construir_matriz, mezclar_filas
+from .models import Dentista, Servicio, SlotAgenda
+from .plantillas import Plantillas
+from .serializers import fila_slot, proyectar_slots
+from .views import (
+    consulta_slots_dia, filtrar_slots, mezclar_listado, parametros_dia, parametros_disponibilidad, virtuales,
+)
+
+
+def solo_get(vista):
+    """`require_GET` para vistas async (en Django 4.2 los decoradores de `django.views` son síncronos)."""
+    @functools.wraps(vista)
+    async def envoltura(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        return await vista(request, *args, **kwargs)
+    return envoltura
+
+
+def _error(detalle):
+    return JsonResponse({'detail': detalle}, status=400)
+
+
+async def _slots(qs):
+    return [fila_slot(f) async for f in proyectar_slots(qs)]
+
+
+@solo_get
+async def slots_por_fecha(request):
+    """Query params: fecha=YYYY-MM-DD, dentista_id=1 (como `views.slots_por_fecha`)."""
+    try:
+        fecha, dentista_id = parametros_dia(request.GET)
+    except ValueError as e:
+        return _error(str(e))
+    if not fecha:
+        qs = filtrar_slots(SlotAgenda.objects.sin_excepcion(), request.GET)
+        return JsonResponse(await _slots(qs.order_by('hora', 'id')), safe=False)
+
+    async def cargar():
+        bloques = await sync_to_async(lambda: list(virtuales(fecha, fecha, dentista_id)))()
+        return list(mezclar_listado(await _slots(consulta_slots_dia(fecha, dentista_id)), bloques))
+
+    estado = await revisiones.aestado_dia(fecha, dentista_id)
+
+    async def generar():
+        return JsonResponse(await get_cache().aget_or_set('slots', dentista_id, fecha, cargar, sello=estado[0]),
+                            safe=False)
+
+    return await revisiones.arespuesta_condicional(request, estado, generar)
+
+
+@solo_get
+async def disponibilidad(request):
+    """Matriz de disponibilidad (mismos parámetros y respuesta que `views.disponibilidad`)."""
+    try:
+        desde, hasta, region, dentistas = parametros_disponibilidad(request.GET)
+    except ValueError as e:
+        return _error(str(e))
+    filas = [fila async for fila in consulta_disponibilidad(desde, hasta, region, dentistas)]
+    virtuales = await sync_to_async(
+        lambda: list(Plantillas(desde, hasta, dentista_ids=dentistas, region_id=region).filas())
+    )()
+    return JsonResponse(construir_matriz(desde, hasta, mezclar_filas(filas, virtuales)))
+
+
+@solo_get
+async def dentistas(request):
+    """Listado de dentistas (forma de `DentistaSerializer`); filtro opcional ?region=<id>."""
+    try:
+        region = request.GET.get('region')
+        region = int(region) if region is not None else None
+    except ValueError:
+        return _error('region debe ser un ID numérico.')
+
+    async def generar():
+        qs = Dentista.objects.all()
+        if region is not None:
+            qs = qs.filter(region=region)
+        filas = qs.values(
+            'id', 'nombre', 'apellido', 'especialidad', 'email', 'telefono', 'max_overbook_day',
+            'region_id', 'region__nombre', 'region__codigo',
+        )
+        return JsonResponse([
+            {
+                'id': f['id'],
+                'nombre': f['nombre'],
+                'apellido': f['apellido'],
+                'especialidad': f['especialidad'],
+                'email': f['email'],
+                'telefono': f['telefono'],
+                'region': {
+                    'id': f['region_id'], 'nombre': f['region__nombre'], 'codigo': f['region__codigo'],
+                } if f['region_id'] else None,
+                'max_overbook_day': f['max_overbook_day'],
+            }
+            async for f in filas
+        ], safe=False)
+
+    estado = await revisiones.aestado([revisiones.DENTISTAS, revisiones.REGIONES])
+    return await revisiones.arespuesta_condicional(request, estado, generar)
+
+
+@solo_get
+async def servicios(request):
+    """Listado de servicios (forma de `ServicioSerializer`; el precio como texto decimal)."""
+    async def generar():
+        filas = Servicio.objects.values('id', 'nombre', 'duracion_min', 'precio')
+        return JsonResponse([{**f, 'precio': str(f['precio'])} async for f in filas], safe=False)
+
+    estado = await revisiones.aestado([revisiones.SERVICIOS])
+    return await revisiones.arespuesta_condicional(request, estado, generar)
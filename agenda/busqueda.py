@@ -0,0 +1,101 @@
+"""Búsqueda de pacientes por RUT, nombre, apellido o email (`GET /agenda/api/pacientes/?q=`).
+
+- Si `q` parece un RUT (dígitos, puntos, guion y dígito verificador) se busca por prefijo
+  del RUT normalizado con una condición de rango sobre el índice único de
+  `Paciente.rut_normalizado`.
+- Si no, en SQLite se consulta la tabla FTS5 ``agenda_paciente_fts`` (prefijos de cada
+  palabra de `q`, sin tildes), sincronizada por las señales de `Paciente`. Sin FTS5 (u
+  otro motor) se usa un respaldo `istartswith` sobre nombre, apellido y email.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+from .models import Paciente
+
+FTS_TABLA = 'agenda_paciente_fts'
+
+# Máximo de pacientes devueltos por búsqueda
+BUSQUEDA_MAX = 50
+
+_PATRON_RUT = re.compile(r'\d[\d.]*-?[\dkK]?')
+
+_fts_por_base = {}
+
+
+def fts_disponible(using='default'):
+    """True si la base de datos `using` tiene la tabla FTS5 de pacientes (se consulta una vez por base)."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    clave = (using, str(connection.settings_dict['NAME']))
+    if clave not in _fts_por_base:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLA])
+            _fts_por_base[clave] = cursor.fetchone() is not None
+    return _fts_por_base[clave]
+
+
+def indexar_pacientes(pacientes, using='default'):
+    """Inserta o reemplaza las filas FTS de `pacientes` (también para altas con `bulk_create`)."""
+    if not fts_disponible(using):
+        return
+    filas = [(p.pk, p.nombre, p.apellido, p.email) for p in pacientes]
+    if not filas:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLA} WHERE rowid = %s', [(fila[0],) for fila in filas])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLA} (rowid, nombre, apellido, email) VALUES (%s, %s, %s, %s)', filas,
+        )
+
+
+def desindexar_paciente(pk, using='default'):
+    if fts_disponible(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLA} WHERE rowid = %s', [pk])
+
+
+def prefijo_rut(q):
+    """Prefijo normalizado de un RUT parcial ('12.345' → '12345'), o None si `q` no parece un RUT."""
+    q = q.strip()
+    if not _PATRON_RUT.fullmatch(q):
+        return None
+    return q.replace('.', '').replace('-', '').upper().lstrip('0') or None
+
+
+def _ids_por_rut(prefijo, limite):
+    # Rango [prefijo, prefijo siguiente) en vez de LIKE: usa el índice único en cualquier motor
+    siguiente = prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+    return list(
+        Paciente.objects.filter(rut_normalizado__gte=prefijo, rut_normalizado__lt=siguiente)
+        .order_by('rut_normalizado').values_list('pk', flat=True)[:limite]
+    )
+
+
+def _ids_por_fts(palabras, limite, using='default'):
+    consulta = ' '.join(f'"{palabra}"*' for palabra in palabras)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLA} WHERE {FTS_TABLA} MATCH %s ORDER BY rank LIMIT %s', [consulta, limite],
+        )
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def buscar_pacientes(q, limite=BUSQUEDA_MAX):
+    """Queryset con hasta `limite` pacientes que coinciden con `q` (vacío si `q` no tiene palabras)."""
+    prefijo = prefijo_rut(q)
+    if prefijo:
+        return Paciente.objects.filter(pk__in=_ids_por_rut(prefijo, limite))
+
+    palabras = re.findall(r'\w+', q)
+    if not palabras:
+        return Paciente.objects.none()
+    if fts_disponible():
+        return Paciente.objects.filter(pk__in=_ids_por_fts(palabras, limite))
+
+    qs = Paciente.objects.all()
+    for palabra in palabras:
+        qs = qs.filter(Q(nombre__istartswith=palabra) | Q(apellido__istartswith=palabra) | Q(email__istartswith=palabra))
+    return Paciente.objects.filter(pk__in=list(qs.values_list('pk', flat=True)[:limite]))
@@ -0,0 +1,249 @@
+"""Caché de disponibilidad por (dentista, fecha).
+
+Guarda la vista de un día (slots con su ocupación, reservas del día) bajo claves
+``(espacio, dentista_id, fecha)``; ``dentista_id=None`` es la vista del día para todos
+los dentistas. Las entradas se invalidan con precisión cuando cambia una reserva o un
+slot de ese dentista y día (señales `post_save`/`post_delete` en `agenda.signals` y
+`generate_slots_bulk`), tanto en el momento como al confirmar la transacción.
+
+Cada entrada guarda además el sello de revisión (`agenda.revisiones`) con que se
+calculó: `get_or_set(..., sello=...)` solo la devuelve si coincide con el sello vigente.
+Así una carga que termina después de una invalidación concurrente no sirve datos viejos
+(su sello ya no es el vigente), ni los sirve otro proceso cuya copia local no se invalidó.
+
+Backends (`settings.AGENDA_CACHE['BACKEND']`):
+
+- ``'locmem'`` (por defecto): LRU en memoria del proceso, acotada por `MAX_ENTRIES`,
+  con expiración `TIMEOUT` (segundos).
+- ``'django'``: el framework de caché de Django (`ALIAS`, `TIMEOUT`); sin Redis ni
+  Memcached configurados es su LocMemCache local.
+- ``'dummy'``: desactiva la caché.
+
+`estadisticas()` expone aciertos, fallos, desalojos e invalidaciones.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+ESPACIOS = ('slots', 'reservas')
+
+_NO_ENCONTRADO = object()
+
+
+class LocMemBackend:
+    """LRU acotada en memoria del proceso; las entradas expiran a los `timeout` segundos."""
+
+    def __init__(self, max_entries=2048, timeout=300, **kwargs):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.desalojos = 0
+
+    def get(self, clave):
+        with self._lock:
+            expira, valor = self._datos.get(clave, (None, _NO_ENCONTRADO))
+            if valor is _NO_ENCONTRADO:
+                return valor
+            if expira is not None and expira <= time.monotonic():
+                del self._datos[clave]
+                return _NO_ENCONTRADO
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor):
+        expira = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            self._datos[clave] = (expira, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entries:
+                self._datos.popitem(last=False)
+                self.desalojos += 1
+
+    def delete_many(self, claves):
+        with self._lock:
+            for clave in claves:
+                self._datos.pop(clave, None)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class DjangoCacheBackend:
+    """Adaptador al framework de caché de Django (los desalojos no son observables).
+
+    Las claves llevan el prefijo ``agenda:`` y la versión guardada en ``agenda:version``:
+    `clear()` la incrementa y deja huérfanas solo las entradas de la agenda, sin vaciar el
+    resto del alias (sesiones, otras cachés). Otros procesos toman la versión nueva al
+    crear su backend; mientras tanto los sellos siguen descartando sus entradas viejas.
+    """
+
+    CLAVE_VERSION = 'agenda:version'
+
+    def __init__(self, alias='default', timeout=300, **kwargs):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.desalojos = 0
+        self.version = self.cache.get_or_set(self.CLAVE_VERSION, 1, None)
+
+    def _clave(self, clave):
+        espacio, dentista_id, fecha = clave
+        return (f"agenda:{self.version}:{espacio}:{dentista_id if dentista_id is not None else '*'}:"
+                f"{fecha.isoformat()}")
+
+    def get(self, clave):
+        return self.cache.get(self._clave(clave), _NO_ENCONTRADO)
+
+    def set(self, clave, valor):
+        self.cache.set(self._clave(clave), valor, self.timeout)
+
+    def delete_many(self, claves):
+        self.cache.delete_many([self._clave(c) for c in claves])
+
+    def clear(self):
+        try:
+            self.version = self.cache.incr(self.CLAVE_VERSION)
+        except ValueError:
+            # La clave de versión expiró o fue desalojada
+            self.version += 1
+            self.cache.set(self.CLAVE_VERSION, self.version, None)
+
+
+class DummyBackend:
+    desalojos = 0
+
+    def __init__(self, **kwargs):
+        pass
+
+    def get(self, clave):
+        return _NO_ENCONTRADO
+
+    def set(self, clave, valor):
+        pass
+
+    def delete_many(self, claves):
+        pass
+
+    def clear(self):
+        pass
+
+
+BACKENDS = {
+    'locmem': LocMemBackend,
+    'django': DjangoCacheBackend,
+    'dummy': DummyBackend,
+}
+
+
+class AgendaCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def _vigente(self, entrada, sello):
+        if entrada is not _NO_ENCONTRADO and entrada[0] == sello:
+            self.aciertos += 1
+            return entrada[1]
+        self.fallos += 1
+        return _NO_ENCONTRADO
+
+    def get_or_set(self, espacio, dentista_id, fecha, cargar, sello=None):
+        """Devuelve la vista cacheada de (dentista, fecha) o la calcula con `cargar()`.
+
+        `sello` es el sello de revisión leído antes de cargar; una entrada guardada con
+        otro sello cuenta como fallo y se reemplaza.
+        """
+        clave = (espacio, dentista_id, fecha)
+        valor = self._vigente(self.backend.get(clave), sello)
+        if valor is _NO_ENCONTRADO:
+            valor = cargar()
+            self.backend.set(clave, (sello, valor))
+        return valor
+
+    async def aget_or_set(self, espacio, dentista_id, fecha, acargar, sello=None):
+        """Variante async de `get_or_set`: `acargar()` es una corrutina."""
+        clave = (espacio, dentista_id, fecha)
+        valor = self._vigente(await self._abackend('get', clave), sello)
+        if valor is _NO_ENCONTRADO:
+            valor = await acargar()
+            await self._abackend('set', clave, (sello, valor))
+        return valor
+
+    async def _abackend(self, metodo, *args):
+        # La LRU en memoria se usa directamente; los demás backends pueden ir por red y se
+        # llaman desde un hilo para no bloquear el event loop
+        funcion = getattr(self.backend, metodo)
+        if isinstance(self.backend, LocMemBackend):
+            return funcion(*args)
+        return await sync_to_async(funcion)(*args)
+
+    def _claves_dia(self, dentista_id, fecha):
+        return [(espacio, d, fecha) for espacio in ESPACIOS for d in (dentista_id, None)]
+
+    def invalidar_dias(self, pares):
+        """Invalida las vistas de cada (dentista_id, fecha), ahora y al confirmar la transacción.
+
+        La invalidación diferida cubre a un lector que cachee el estado anterior mientras
+        la transacción de escritura sigue abierta.
+        """
+        claves = [clave for dentista_id, fecha in pares for clave in self._claves_dia(dentista_id, fecha)]
+        if not claves:
+            return
+        self.invalidaciones += len(claves)
+        self.backend.delete_many(claves)
+        transaction.on_commit(lambda: self.backend.delete_many(claves))
+
+    def invalidar_dia(self, dentista_id, fecha):
+        self.invalidar_dias([(dentista_id, fecha)])
+
+    def clear(self):
+        self.backend.clear()
+
+    def estadisticas(self):
+        datos = {
+            'backend': type(self.backend).__name__,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'desalojos': self.backend.desalojos,
+            'invalidaciones': self.invalidaciones,
+        }
+        if hasattr(self.backend, '__len__'):
+            datos['entradas'] = len(self.backend)
+        return datos
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = getattr(settings, 'AGENDA_CACHE', {})
+                backend = BACKENDS[config.get('BACKEND', 'locmem')](
+                    max_entries=config.get('MAX_ENTRIES', 2048),
+                    alias=config.get('ALIAS', 'default'),
+                    timeout=config.get('TIMEOUT', 300),
+                )
+                _cache = AgendaCache(backend)
+    return _cache
+
+
+def reset_cache():
+    """Descarta la caché actual (se recrea con la configuración vigente en el próximo uso)."""
+    global _cache
+    with _cache_lock:
+        _cache = None
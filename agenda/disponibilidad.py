@@ -0,0 +1,252 @@
+"""Cálculo de disponibilidad de la agenda.
+
+Matriz de disponibilidad (`GET /agenda/disponibilidad/`): por dentista y día, un bitmap
+con el estado de cada bloque de 30 minutos del horario permitido (08:00-18:00), 2 bits
+por bloque:
+
+- 0 ``sin_slot``: no hay slot en ese bloque (o lo anula una `ExcepcionAgenda`)
+- 1 ``libre``: queda capacidad normal
+- 2 ``lleno``: sin capacidad ni sobrecupos admisibles
+- 3 ``sobrecupo``: lleno, pero admite sobrecupo (slot y límite diario del dentista)
+
+El bloque i ocupa los bits 2i y 2i+1 del entero, que se codifica en hexadecimal con
+ancho fijo. Todo se calcula con una consulta sobre `SlotAgenda` más la de las plantillas
+semanales (`plantillas.Plantillas`), cuyos bloques sin slot materializado entran como
+filas virtuales libres.
+
+Huecos para un servicio (`GET /agenda/huecos/`): sobre la misma consulta, una ventana
+deslizante por dentista y día encuentra cada hora de inicio con tantos slots
+consecutivos admisibles como bloques dura el servicio.
+
+Próxima hora disponible (`GET /agenda/proxima-disponible/`): la misma ventana sobre un
+flujo ordenado por dentista, paginado por (fecha, hora), y una mezcla de los flujos que
+se detiene en cuanto tiene los k inicios más tempranos.
+"""
+import datetime
+import heapq
+import itertools
+
+from django.db.models import F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import SlotAgenda, SobrecupoDia, SLOT_HORA_MIN, SLOT_HORA_MAX
+from .plantillas import Plantillas
+
+SIN_SLOT, LIBRE, LLENO, SOBRECUPO = 0, 1, 2, 3
+ESTADOS = ('sin_slot', 'libre', 'lleno', 'sobrecupo')
+BITS_POR_BLOQUE = 2
+
+
+def _bloques():
+    bloques = []
+    actual = datetime.datetime.combine(datetime.date.min, SLOT_HORA_MIN)
+    fin = datetime.datetime.combine(datetime.date.min, SLOT_HORA_MAX)
+    while actual <= fin:
+        bloques.append(actual.time())
+        actual += datetime.timedelta(minutes=30)
+    return bloques
+
+
+BLOQUES = _bloques()
+INDICE_BLOQUE = {hora: i for i, hora in enumerate(BLOQUES)}
+ANCHO_HEX = (len(BLOQUES) * BITS_POR_BLOQUE + 3) // 4
+
+
+def estado_slot(capacidad, max_overbook, normales, sobrecupos, max_overbook_day, usados_dia):
+    if normales < capacidad:
+        return LIBRE
+    if sobrecupos < max_overbook and usados_dia < max_overbook_day:
+        return SOBRECUPO
+    return LLENO
+
+
+def codificar_fila(estados_por_bloque):
+    """{indice_bloque: estado} → hex de ancho fijo."""
+    valor = 0
+    for indice, estado in estados_por_bloque.items():
+        valor |= estado << (indice * BITS_POR_BLOQUE)
+    return format(valor, f'0{ANCHO_HEX}x')
+
+
+def decodificar_fila(hexadecimal):
+    """Hex de una fila → lista con el estado de cada bloque (inversa de `codificar_fila`)."""
+    valor = int(hexadecimal, 16)
+    mascara = (1 << BITS_POR_BLOQUE) - 1
+    return [(valor >> (i * BITS_POR_BLOQUE)) & mascara for i in range(len(BLOQUES))]
+
+
+def slots_con_ocupacion(queryset):
+    """Anota cada slot con los sobrecupos ya usados por su dentista ese día (libro `SobrecupoDia`)."""
+    usados = SobrecupoDia.objects.filter(
+        dentista_id=OuterRef('dentista_id'), fecha=OuterRef('fecha'),
+    ).values('sobrecupos_usados')[:1]
+    return queryset.annotate(
+        usados_dia=Coalesce(Subquery(usados, output_field=IntegerField()), Value(0)),
+    )
+
+
+# Columnas de las filas de disponibilidad (ver `consulta_disponibilidad`)
+COLUMNAS = (
+    'dentista_id', 'fecha', 'hora', 'capacidad', 'max_overbook',
+    'reservas_normales', 'reservas_sobrecupo', 'dentista__max_overbook_day', 'usados_dia',
+)
+
+
+def consulta_disponibilidad(desde, hasta, region_id=None, dentista_ids=None):
+    """Única consulta de la matriz: tuplas (dentista, fecha, hora, ocupación...) ordenadas, sin los slots exceptuados."""
+    qs = SlotAgenda.objects.sin_excepcion().filter(fecha__range=(desde, hasta))
+    if region_id is not None:
+        qs = qs.filter(dentista__region_id=region_id)
+    if dentista_ids:
+        qs = qs.filter(dentista_id__in=dentista_ids)
+    return slots_con_ocupacion(qs).order_by('dentista_id', 'fecha', 'hora').values_list(*COLUMNAS)
+
+
+def mezclar_filas(filas, virtuales):
+    """Filas de `SlotAgenda` y filas virtuales de plantilla, ambas ordenadas, en un solo flujo ordenado."""
+    return heapq.merge(filas, virtuales, key=lambda f: f[:3])
+
+
+def filas_disponibilidad(desde, hasta, region_id=None, dentista_ids=None):
+    """`consulta_disponibilidad` más los bloques de plantilla aún no materializados."""
+    virtuales = Plantillas(desde, hasta, dentista_ids=dentista_ids, region_id=region_id).filas()
+    return mezclar_filas(consulta_disponibilidad(desde, hasta, region_id, dentista_ids), virtuales)
+
+
+def matriz_disponibilidad(desde, hasta, region_id=None, dentista_ids=None):
+    """Matriz columnar de disponibilidad dentista × día × bloque para el rango [desde, hasta]."""
+    return construir_matriz(desde, hasta, filas_disponibilidad(desde, hasta, region_id, dentista_ids))
+
+
+def construir_matriz(desde, hasta, filas):
+    """Arma la respuesta de la matriz a partir de las filas de `consulta_disponibilidad`."""
+    fechas = []
+    dia = desde
+    while dia <= hasta:
+        fechas.append(dia)
+        dia += datetime.timedelta(days=1)
+    columna = {fecha: i for i, fecha in enumerate(fechas)}
+
+    por_dentista = {}
+    for dentista_id, fecha, hora, capacidad, max_overbook, normales, sobrecupos, max_dia, usados in filas:
+        indice = INDICE_BLOQUE.get(hora)
+        if indice is None:
+            continue
+        dias = por_dentista.setdefault(dentista_id, [{} for _ in fechas])
+        dias[columna[fecha]][indice] = estado_slot(capacidad, max_overbook, normales, sobrecupos, max_dia, usados)
+
+    dentistas = sorted(por_dentista)
+    return {
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'bloques': [hora.strftime('%H:%M') for hora in BLOQUES],
+        'estados': list(ESTADOS),
+        'bits_por_bloque': BITS_POR_BLOQUE,
+        'fechas': [fecha.isoformat() for fecha in fechas],
+        'dentistas': dentistas,
+        'matriz': [[codificar_fila(dia) for dia in por_dentista[d]] for d in dentistas],
+    }
+
+
+def inicios_tramo(filas, bloques, sobrecupo=False):
+    """Genera (fecha, hora, dentista_id, es_sobrecupo) por cada inicio de un tramo de `bloques` slots admisibles.
+
+    `filas` (con las columnas de `COLUMNAS`) deben venir ordenadas por dentista, fecha y hora;
+    los inicios salen en ese mismo orden y `filas` se consume de a una, así que puede ser un
+    flujo perezoso. Un recorrido por dentista-día lleva el largo de la racha de slots contiguos
+    (30 minutos de diferencia) con capacidad normal y el de la racha que admite sobrecupo; cada
+    slot en que una racha alcanza `bloques` cierra un tramo que empieza `bloques - 1` slots
+    antes. Como en la admisión, un tramo es normal si todos sus slots tienen capacidad normal y
+    de sobrecupo si todos admiten uno y al dentista le quedan sobrecupos ese día.
+    """
+    paso = datetime.timedelta(minutes=30)
+    for (dentista_id, fecha), grupo in itertools.groupby(filas, key=lambda f: (f[0], f[1])):
+        horas = []
+        racha_libre = racha_sobrecupo = 0
+        anterior = None
+        for _, _, hora, capacidad, max_overbook, normales, sobrecupos, max_dia, usados in grupo:
+            actual = datetime.datetime.combine(fecha, hora)
+            if anterior is None or actual - anterior != paso:
+                racha_libre = racha_sobrecupo = 0
+            anterior = actual
+            horas.append(hora)
+            racha_libre = racha_libre + 1 if normales < capacidad else 0
+            racha_sobrecupo = racha_sobrecupo + 1 if sobrecupos < max_overbook and usados < max_dia else 0
+            if racha_libre >= bloques:
+                yield fecha, horas[-bloques], dentista_id, False
+            elif sobrecupo and racha_sobrecupo >= bloques:
+                yield fecha, horas[-bloques], dentista_id, True
+
+
+def huecos_consecutivos(filas, bloques, sobrecupo=False):
+    """Inicios de `inicios_tramo` agrupados por dentista y día (respuesta de `GET /agenda/huecos/`)."""
+    huecos = []
+    inicios = inicios_tramo(filas, bloques, sobrecupo)
+    for (dentista_id, fecha), grupo in itertools.groupby(inicios, key=lambda i: (i[2], i[0])):
+        grupo = list(grupo)
+        hueco = {
+            'dentista': dentista_id,
+            'fecha': fecha.isoformat(),
+            'horas': [hora.strftime('%H:%M') for _, hora, _, es_sobrecupo in grupo if not es_sobrecupo],
+        }
+        if sobrecupo:
+            hueco['sobrecupo'] = [hora.strftime('%H:%M') for _, hora, _, es_sobrecupo in grupo if es_sobrecupo]
+        huecos.append(hueco)
+    return huecos
+
+
+def primeros_huecos(bloques, desde, hasta, region_id=None, dentista_ids=None, sobrecupo=False):
+    """Huecos de `bloques` slots consecutivos en [desde, hasta] (un recorrido sobre `filas_disponibilidad`)."""
+    return huecos_consecutivos(filas_disponibilidad(desde, hasta, region_id, dentista_ids), bloques, sobrecupo)
+
+
+# Filas por página de cada flujo de `proximas_disponibles` (aprox. dos días de un dentista)
+PROXIMA_LOTE = 48
+
+
+def consulta_dentista(dentista_id, hasta, sobrecupo=False):
+    """Slots con cupo de un dentista hasta `hasta`, ordenados por (fecha, hora) (índice único del slot)."""
+    qs = SlotAgenda.objects.sin_excepcion().filter(dentista_id=dentista_id, fecha__lte=hasta)
+    qs = qs.con_cupo() if sobrecupo else qs.filter(reservas_normales__lt=F('capacidad'))
+    return slots_con_ocupacion(qs).order_by('fecha', 'hora').values_list(*COLUMNAS)
+
+
+def filas_dentista(dentista_id, desde, hasta, hora_minima=None, sobrecupo=False, lote=PROXIMA_LOTE):
+    """Flujo perezoso de filas de disponibilidad de un dentista desde (desde, hora_minima) hasta `hasta`.
+
+    Solo trae slots con cupo (normal, o también sobrecupo si `sobrecupo`), por páginas de
+    `lote` filas con keyset sobre (fecha, hora): la siguiente página se consulta solo si el
+    consumidor llega al final de la anterior.
+    """
+    qs = consulta_dentista(dentista_id, hasta, sobrecupo)
+    condicion = Q(fecha__gt=desde) | Q(fecha=desde, hora__gte=hora_minima or datetime.time.min)
+    while True:
+        pagina = list(qs.filter(condicion)[:lote])
+        yield from pagina
+        if len(pagina) < lote:
+            return
+        _, fecha, hora = pagina[-1][:3]
+        condicion = Q(fecha__gt=fecha) | Q(fecha=fecha, hora__gt=hora)
+
+
+def proximas_disponibles(dentista_ids, bloques, desde, hasta, k, hora_minima=None, sobrecupo=False):
+    """Los `k` inicios admisibles más tempranos, (fecha, hora, dentista_id, es_sobrecupo), entre `dentista_ids`.
+
+    Cada dentista aporta un flujo de `inicios_tramo` ya ordenado por (fecha, hora);
+    `heapq.merge` los combina y se corta en el k-ésimo, así que cada flujo solo consulta
+    las páginas que llegan a competir por los primeros puestos. Los bloques de plantilla
+    sin materializar de cada dentista se intercalan en su flujo.
+    """
+    plantillas = Plantillas(desde, hasta, dentista_ids=dentista_ids)
+    flujos = [
+        inicios_tramo(
+            heapq.merge(
+                filas_dentista(dentista_id, desde, hasta, hora_minima, sobrecupo),
+                plantillas.flujo(dentista_id, desde, hora_minima),
+                key=lambda f: f[1:3],
+            ),
+            bloques, sobrecupo,
+        )
+        for dentista_id in dentista_ids
+    ]
+    return list(itertools.islice(heapq.merge(*flujos), k))
@@ -0,0 +1,143 @@
+"""Exportación en streaming de reservas y slots para reportes.
+
+Usada por `GET /agenda/export/<recurso>.<formato>` y por el comando `export_agenda`.
+Recorre una proyección plana `values_list()` con `iterator(chunk_size=...)` y emite una
+línea por fila (CSV o JSONL), así que la memoria no crece con el número de filas.
+"""
+import csv
+import datetime
+import itertools
+import json
+
+from asgiref.sync import sync_to_async
+
+from .models import Reserva, SlotAgenda
+
+EXPORT_CHUNK_SIZE = 2000
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# recurso → (modelo, prefijo de los campos del slot, [(columna, lookup)])
+RECURSOS = {
+    'reservas': (Reserva, 'slot__', [
+        ('id', 'id'),
+        ('fecha', 'slot__fecha'),
+        ('hora', 'slot__hora'),
+        ('slot_id', 'slot_id'),
+        ('dentista_id', 'slot__dentista_id'),
+        ('dentista_nombre', 'slot__dentista__nombre'),
+        ('dentista_apellido', 'slot__dentista__apellido'),
+        ('region', 'slot__dentista__region__codigo'),
+        ('paciente_id', 'paciente_id'),
+        ('paciente_rut', 'paciente__rut'),
+        ('paciente_nombre', 'paciente__nombre'),
+        ('paciente_apellido', 'paciente__apellido'),
+        ('servicio', 'servicio__nombre'),
+        ('sobrecupo', 'sobrecupo'),
+        ('creado_en', 'creado_en'),
+    ]),
+    'slots': (SlotAgenda, '', [
+        ('id', 'id'),
+        ('fecha', 'fecha'),
+        ('hora', 'hora'),
+        ('dentista_id', 'dentista_id'),
+        ('dentista_nombre', 'dentista__nombre'),
+        ('dentista_apellido', 'dentista__apellido'),
+        ('region', 'dentista__region__codigo'),
+        ('servicio', 'servicio__nombre'),
+        ('capacidad', 'capacidad'),
+        ('max_overbook', 'max_overbook'),
+        ('reservas_normales', 'reservas_normales'),
+        ('reservas_sobrecupo', 'reservas_sobrecupo'),
+    ]),
+}
+
+
+def columnas(recurso):
+    return [columna for columna, _ in RECURSOS[recurso][2]]
+
+
+def queryset_exportacion(recurso, desde=None, hasta=None, region_id=None):
+    """Proyección plana (tuplas en el orden de `columnas(recurso)`) ordenada por fecha, hora e id."""
+    modelo, slot, campos = RECURSOS[recurso]
+    qs = modelo.objects.all()
+    if desde:
+        qs = qs.filter(**{f'{slot}fecha__gte': desde})
+    if hasta:
+        qs = qs.filter(**{f'{slot}fecha__lte': hasta})
+    if region_id is not None:
+        qs = qs.filter(**{f'{slot}dentista__region_id': region_id})
+    return qs.order_by(f'{slot}fecha', f'{slot}hora', 'id').values_list(*[lookup for _, lookup in campos])
+
+
+def _valor(valor):
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return valor.isoformat()
+    return valor
+
+
+class _Eco:
+    """Destino de `csv.writer` que devuelve la línea en vez de escribirla."""
+
+    def write(self, valor):
+        return valor
+
+
+def _formato(recurso, formato):
+    """(encabezado o None, función fila → línea) de `formato`."""
+    nombres = columnas(recurso)
+    if formato == 'csv':
+        escritor = csv.writer(_Eco(), lineterminator='\n')
+        return escritor.writerow(nombres), lambda fila: escritor.writerow([_valor(v) for v in fila])
+    if formato == 'jsonl':
+        return None, lambda fila: json.dumps(dict(zip(nombres, map(_valor, fila))), ensure_ascii=False, default=str) + '\n'
+    raise ValueError(f'Formato no soportado: {formato}')
+
+
+def lineas(recurso, formato, filas):
+    """Genera el encabezado (CSV) y una línea por fila."""
+    encabezado, linea = _formato(recurso, formato)
+    if encabezado is not None:
+        yield encabezado
+    for fila in filas:
+        yield linea(fila)
+
+
+async def alineas(recurso, formato, filas):
+    """Variante async de `lineas` sobre un iterador async de filas."""
+    encabezado, linea = _formato(recurso, formato)
+    if encabezado is not None:
+        yield encabezado
+    async for fila in filas:
+        yield linea(fila)
+
+
+def exportar(recurso, formato, desde=None, hasta=None, region_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Iterador de líneas de la exportación; la consulta se recorre por bloques de `chunk_size` filas."""
+    filas = queryset_exportacion(recurso, desde, hasta, region_id).iterator(chunk_size=chunk_size)
+    return lineas(recurso, formato, filas)
+
+
+async def _por_bloques(filas, chunk_size):
+    # `aiterator()` de Django 4.2 ejecuta la consulta de un `values_list()` en el contexto async
+    # (SynchronousOnlyOperation): se avanza el iterador síncrono de a un bloque por hilo
+    siguiente = sync_to_async(lambda: list(itertools.islice(filas, chunk_size)))
+    while True:
+        bloque = await siguiente()
+        if not bloque:
+            return
+        for fila in bloque:
+            yield fila
+
+
+def aexportar(recurso, formato, desde=None, hasta=None, region_id=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Iterador async de `exportar` para ASGI: la consulta se lee de a `chunk_size` filas.
+
+    Bajo ASGI, Django 4.2 consume un iterador síncrono de `StreamingHttpResponse` entero
+    con `sync_to_async(list)` antes de enviar el primer byte; uno async se envía por bloques.
+    """
+    filas = queryset_exportacion(recurso, desde, hasta, region_id).iterator(chunk_size=chunk_size)
+    return alineas(recurso, formato, _por_bloques(filas, chunk_size))
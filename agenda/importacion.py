@@ -0,0 +1,164 @@
+"""Importación masiva de pacientes desde CSV o JSONL.
+
+Usada por el comando `import_pacientes` y por `POST /agenda/api/pacientes/import/`.
+El archivo se lee en streaming y se procesa por lotes de `chunk_size` filas: cada lote
+valida y normaliza los RUT, consulta una sola vez qué RUT ya existen y crea el resto con
+`bulk_create`. Las filas rechazadas se entregan a `rechazar(linea, motivo, fila)`.
+
+Columnas: ``rut``, ``nombre``, ``apellido`` (obligatorias), ``telefono`` y ``email``.
+"""
+import codecs
+import csv
+import itertools
+import json
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from .busqueda import indexar_pacientes
+from .models import Paciente, normalizar_rut, formatear_rut
+
+FORMATOS = ('csv', 'jsonl')
+IMPORT_CHUNK_SIZE = 1000
+
+COLUMNAS = ('rut', 'nombre', 'apellido', 'telefono', 'email')
+OBLIGATORIAS = ('rut', 'nombre', 'apellido')
+
+
+def detectar_formato(nombre_archivo):
+    """'pacientes.csv' → 'csv', 'pacientes.jsonl'/'.ndjson' → 'jsonl' (None si no se reconoce)."""
+    nombre = (nombre_archivo or '').lower()
+    if nombre.endswith('.csv'):
+        return 'csv'
+    if nombre.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def es_utf8(binario, tamano_bloque=1 << 16):
+    """Recorre un archivo binario por bloques y dice si es UTF-8 válido; lo deja rebobinado.
+
+    Se llama antes de importar: un error de codificación a mitad del archivo aparecería
+    con lotes anteriores ya confirmados.
+    """
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for bloque in iter(lambda: binario.read(tamano_bloque), b''):
+            decodificador.decode(bloque)
+        decodificador.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    finally:
+        binario.seek(0)
+    return True
+
+
+def leer_filas(texto, formato):
+    """Itera (número de línea, fila) de un stream de texto; la fila es un dict o un str con el error de lectura."""
+    if formato == 'csv':
+        lector = csv.DictReader(texto)
+        for fila in lector:
+            yield lector.line_num, fila
+    elif formato == 'jsonl':
+        for numero, linea in enumerate(texto, start=1):
+            if not linea.strip():
+                continue
+            try:
+                fila = json.loads(linea)
+            except ValueError:
+                yield numero, 'JSON inválido'
+                continue
+            yield numero, fila if isinstance(fila, dict) else 'Se esperaba un objeto JSON'
+    else:
+        raise ValueError(f'Formato no soportado: {formato}')
+
+
+def validar_fila(fila):
+    """Devuelve (`Paciente` sin guardar, None) o (None, motivo del rechazo)."""
+    datos = {columna: str(fila.get(columna) or '').strip() for columna in COLUMNAS}
+    faltantes = [columna for columna in OBLIGATORIAS if not datos[columna]]
+    if faltantes:
+        return None, f"Faltan columnas obligatorias: {', '.join(faltantes)}"
+    try:
+        normalizado = normalizar_rut(datos['rut'])
+    except ValueError as e:
+        return None, str(e)
+    for columna in ('nombre', 'apellido', 'telefono', 'email'):
+        maximo = Paciente._meta.get_field(columna).max_length
+        if len(datos[columna]) > maximo:
+            return None, f'{columna} supera {maximo} caracteres'
+    if datos['email']:
+        try:
+            validate_email(datos['email'])
+        except ValidationError:
+            return None, 'Email inválido'
+    datos['rut'] = formatear_rut(normalizado)
+    return Paciente(rut_normalizado=normalizado, **datos), None
+
+
+def _crear_lote(pacientes):
+    """bulk_create de los pacientes cuyo RUT aún no existe; devuelve (creados, existentes)."""
+    for intento in range(2):
+        existentes = set(
+            Paciente.objects.filter(rut_normalizado__in=[p.rut_normalizado for p in pacientes])
+            .values_list('rut_normalizado', flat=True)
+        )
+        nuevos = [p for p in pacientes if p.rut_normalizado not in existentes]
+        try:
+            with transaction.atomic():
+                Paciente.objects.bulk_create(nuevos)
+                indexar_pacientes(nuevos)
+            return nuevos, len(existentes)
+        except IntegrityError:
+            # Otro proceso insertó alguno de estos RUT entre la consulta y el insert: se reintenta una vez
+            if intento:
+                raise
+
+
+def importar_pacientes(filas, chunk_size=IMPORT_CHUNK_SIZE, rechazar=None, dry_run=False):
+    """Importa las filas de `leer_filas` por lotes. Devuelve los contadores y el throughput.
+
+    Con `dry_run` solo valida y cuenta los RUT que ya existen, sin crear pacientes.
+    """
+    rechazar = rechazar or (lambda linea, motivo, fila: None)
+    resultado = {'filas': 0, 'creados': 0, 'existentes': 0, 'rechazados': 0}
+    vistos = set()
+    t0 = time.perf_counter()
+
+    filas = iter(filas)
+    while True:
+        lote = list(itertools.islice(filas, chunk_size))
+        if not lote:
+            break
+        resultado['filas'] += len(lote)
+        pacientes = []
+        for linea, fila in lote:
+            if isinstance(fila, str):
+                paciente, motivo = None, fila
+            else:
+                paciente, motivo = validar_fila(fila)
+            if paciente is not None and paciente.rut_normalizado in vistos:
+                paciente, motivo = None, 'RUT repetido en el archivo'
+            if paciente is None:
+                resultado['rechazados'] += 1
+                rechazar(linea, motivo, fila)
+                continue
+            vistos.add(paciente.rut_normalizado)
+            pacientes.append(paciente)
+
+        if not pacientes:
+            continue
+        if dry_run:
+            resultado['existentes'] += Paciente.objects.filter(
+                rut_normalizado__in=[p.rut_normalizado for p in pacientes]).count()
+            continue
+        creados, existentes = _crear_lote(pacientes)
+        resultado['creados'] += len(creados)
+        resultado['existentes'] += existentes
+
+    segundos = time.perf_counter() - t0
+    resultado['segundos'] = round(segundos, 3)
+    resultado['filas_por_segundo'] = round(resultado['filas'] / segundos, 1) if segundos > 0 else 0.0
+    return resultado
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from agenda.archivo import ARCHIVO_CHUNK_SIZE, archivar, pendientes
+import datetime
+import time
+
+
+class Command(BaseCommand):
+    help = ('Mueve los slots y reservas anteriores a una fecha a las tablas de archivo, por lotes. '
+            'Uso: archive_agenda [--antes YYYY-MM-DD | --dias N] [--chunk N] [--dry-run]')
+
+    def add_arguments(self, parser):
+        corte = parser.add_mutually_exclusive_group()
+        corte.add_argument('--antes', type=str, help='Archivar lo anterior a YYYY-MM-DD')
+        corte.add_argument('--dias', type=int, default=getattr(settings, 'AGENDA_ARCHIVO_DIAS', 365),
+                           help='Archivar lo anterior a hoy menos N días')
+        parser.add_argument('--chunk', type=int, default=ARCHIVO_CHUNK_SIZE,
+                            help='Dentista-días movidos por transacción')
+        parser.add_argument('--dry-run', action='store_true', help='Solo contar lo que se archivaría')
+
+    def handle(self, *args, **options):
+        if options['antes']:
+            try:
+                antes = datetime.datetime.strptime(options['antes'], '%Y-%m-%d').date()
+            except Exception:
+                raise CommandError('Formato de fecha inválido. Use YYYY-MM-DD')
+        else:
+            if options['dias'] < 0:
+                raise CommandError('dias no puede ser negativo')
+            antes = timezone.localdate() - datetime.timedelta(days=options['dias'])
+        if antes > timezone.localdate():
+            raise CommandError('Solo se archivan días pasados')
+        if options['chunk'] <= 0:
+            raise CommandError('chunk debe ser mayor que 0')
+
+        if options['dry_run']:
+            slots, reservas = pendientes(antes)
+            self.stdout.write(self.style.WARNING(
+                f'{slots} slots y {reservas} reservas anteriores a {antes} (sin cambios)'
+            ))
+            return
+
+        t0 = time.perf_counter()
+
+        def progreso(totales):
+            self.stdout.write(f"  {totales['dias']} dentista-días, {totales['slots']} slots, "
+                              f"{totales['reservas']} reservas")
+
+        totales = archivar(antes, chunk_size=options['chunk'], progreso=progreso)
+        segundos = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(
+            f"Se archivaron {totales['slots']} slots y {totales['reservas']} reservas anteriores a {antes} "
+            f"en {segundos:.2f}s"
+        ))
@@ -0,0 +1,136 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from agenda.models import Reserva, Dentista, Paciente, SobrecupoDia
+from agenda.disponibilidad import PROXIMA_LOTE, consulta_dentista, consulta_disponibilidad
+from agenda.pagination import SlotKeysetPagination
+from agenda.plantillas import consulta_excepciones, consulta_materializados, consulta_plantillas, consulta_sobrecupos
+from agenda.reservas import horas_tramo, reclamo_optimista, slots_bloqueados
+from agenda.revisiones import consulta_dia
+from agenda.serializers import proyectar_slots
+from agenda.views import LISTADO_VENTANA_DIAS, HistorialReservasList, SlotsDisponiblesList, consulta_slots_dia
+from agenda.views import filtrar_slots
+from agenda.viewsets import DentistaViewSet, ServicioViewSet, PacienteViewSet, RegionViewSet, ReservaViewSet
+
+# Marcadores de recorrido completo de tabla en la salida de EXPLAIN
+SEQ_SCAN_MARKERS = {
+    'sqlite': lambda linea: 'SCAN ' in linea and 'USING' not in linea,
+    'postgresql': lambda linea: 'Seq Scan' in linea,
+}
+
+
+def _request(params):
+    return Request(APIRequestFactory().get('/', params))
+
+
+def _viewset_queryset(viewset_class, params=None):
+    view = viewset_class()
+    view.request = _request(params or {})
+    view.action = 'list'
+    view.format_kwarg = None
+    return view.get_queryset()
+
+
+def hot_querysets(dentista_id, fecha):
+    """(nombre, queryset) de cada consulta que ejecutan `agenda/views.py` y `agenda/viewsets.py`.
+
+    Los querysets se obtienen de las propias vistas o de las funciones que ellas llaman
+    (`consulta_slots_dia`, `consulta_disponibilidad`, las cargas de `Plantillas`) para que el
+    plan corresponda a la consulta real.
+    """
+    semana = fecha + datetime.timedelta(days=6)
+    ventana = fecha + datetime.timedelta(days=LISTADO_VENTANA_DIAS - 1)
+
+    def slots_disponibles(params):
+        view = SlotsDisponiblesList()
+        view.request = _request(params)
+        view.format_kwarg = None
+        qs = filtrar_slots(view.get_queryset(), view.request.query_params)
+        return proyectar_slots(SlotKeysetPagination().paginate_queryset(qs, view.request))
+
+    def historial(params):
+        view = HistorialReservasList()
+        view.request = _request(params)
+        view.format_kwarg = None
+        return SlotKeysetPagination().paginate_queryset(view.get_queryset(), view.request)
+
+    cursor = SlotKeysetPagination().encode_cursor(fecha, '12:00:00', 0)
+    return [
+        ('slots (fecha >= hoy)', slots_disponibles({})),
+        ('slots página N (cursor)', slots_disponibles({'cursor': cursor})),
+        ('slots ?disponibles=1', slots_disponibles({'disponibles': '1'})),
+        ('slots_por_fecha (fecha)', proyectar_slots(consulta_slots_dia(fecha))),
+        ('slots_por_fecha (fecha + dentista)', proyectar_slots(consulta_slots_dia(fecha, dentista_id))),
+        ('disponibilidad (semana)', consulta_disponibilidad(fecha, semana)),
+        ('disponibilidad (semana + región)', consulta_disponibilidad(fecha, semana, region_id=1)),
+        ('disponibilidad (semana + dentista)', consulta_disponibilidad(fecha, semana, dentista_ids=[dentista_id])),
+        ('plantillas vigentes', consulta_plantillas(fecha, semana)),
+        ('plantillas vigentes (dentista)', consulta_plantillas(fecha, semana, dentista_ids=[dentista_id])),
+        ('excepciones del rango', consulta_excepciones(fecha, semana, [dentista_id])),
+        ('plantillas: slots materializados', consulta_materializados([dentista_id], fecha, ventana)),
+        ('plantillas: libro de sobrecupos', consulta_sobrecupos([dentista_id], fecha, ventana)),
+        ('próxima disponible (página de un dentista)', consulta_dentista(
+            dentista_id, fecha + datetime.timedelta(days=90)).filter(
+            Q(fecha__gt=fecha) | Q(fecha=fecha, hora__gte='12:00'))[:PROXIMA_LOTE]),
+        ('sello de revisión del día', consulta_dia(dentista_id, fecha)),
+        ('sello de revisión del día (todos)', consulta_dia(None, fecha)),
+        ('reservas (listado)', _viewset_queryset(ReservaViewSet)),
+        ('reservas (dentista + fecha)', _viewset_queryset(
+            ReservaViewSet, {'dentista': dentista_id, 'fecha': fecha.isoformat()})),
+        ('dentistas (región)', _viewset_queryset(DentistaViewSet, {'region': 1})),
+        ('servicios', _viewset_queryset(ServicioViewSet)),
+        ('pacientes', _viewset_queryset(PacienteViewSet)),
+        ('regiones', _viewset_queryset(RegionViewSet)),
+        ('pacientes ?q= (prefijo de RUT)', Paciente.objects.filter(
+            rut_normalizado__gte='12345', rut_normalizado__lt='12346').values_list('pk', flat=True)),
+        ('historial de reservas (paciente)', historial({'paciente': 1})),
+        ('admisión: reserva existente', Reserva.objects.filter(slot_id=1, paciente_id=1)),
+        ('admisión: reclamo optimista', reclamo_optimista(1)),
+        ('admisión: bloqueo del slot', slots_bloqueados().filter(pk=1)),
+        ('admisión: bloqueo del tramo', slots_bloqueados().filter(
+            dentista_id=dentista_id, fecha=fecha, hora__in=horas_tramo(datetime.time(12, 0), 2)).order_by('hora')),
+        ('admisión: libro de sobrecupos', SobrecupoDia.objects.filter(dentista_id=dentista_id, fecha=fecha)),
+        ('recuento de sobrecupos del día', Reserva.objects.filter(
+            slot__dentista_id=dentista_id, slot__fecha=fecha, sobrecupo=True)),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Imprime el plan (EXPLAIN) de cada consulta caliente de las vistas de agenda contra la base '
+            'de datos actual y marca los recorridos completos de tabla. Uso: explain_hot_queries [--analyze]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true', help='EXPLAIN ANALYZE (solo PostgreSQL)')
+        parser.add_argument('--dentista', type=int, help='ID de dentista para los filtros (por defecto el primero)')
+        parser.add_argument('--fecha', type=str, help='Fecha YYYY-MM-DD para los filtros (por defecto hoy)')
+
+    def handle(self, *args, **options):
+        dentista_id = options['dentista'] or Dentista.objects.values_list('pk', flat=True).first() or 1
+        fecha = timezone.localdate()
+        if options['fecha']:
+            fecha = datetime.datetime.strptime(options['fecha'], '%Y-%m-%d').date()
+
+        explain_opts = {}
+        if options['analyze'] and connection.vendor == 'postgresql':
+            explain_opts = {'analyze': True}
+        es_seq_scan = SEQ_SCAN_MARKERS.get(connection.vendor, lambda linea: False)
+
+        completos = 0
+        # Los bloqueos de la admisión (select_for_update) solo se compilan dentro de una transacción
+        with transaction.atomic():
+            for nombre, qs in hot_querysets(dentista_id, fecha):
+                plan = qs.explain(**explain_opts)
+                seq = [linea for linea in plan.splitlines() if es_seq_scan(linea)]
+                if seq:
+                    completos += 1
+                estilo = self.style.WARNING if seq else self.style.SUCCESS
+                self.stdout.write(estilo(f'== {nombre}{" [RECORRIDO COMPLETO]" if seq else ""}'))
+                self.stdout.write(plan)
+                self.stdout.write('')
+
+        self.stdout.write(f'{completos} consultas con recorrido completo de tabla ({connection.vendor})')
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from agenda.export import EXPORT_CHUNK_SIZE, FORMATOS, RECURSOS, exportar
+from agenda.models import Region
+import datetime
+import time
+
+
+class Command(BaseCommand):
+    help = ('Exporta reservas o slots en CSV o JSONL, en streaming y con memoria constante. '
+            'Uso: export_agenda reservas|slots [--formato csv|jsonl] [--desde YYYY-MM-DD] [--hasta YYYY-MM-DD] '
+            '[--region <codigo>] [--salida <archivo>] [--chunk N]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('recurso', choices=sorted(RECURSOS), help='Qué exportar')
+        parser.add_argument('--formato', choices=sorted(FORMATOS), default='csv', help='Formato de salida')
+        parser.add_argument('--desde', type=str, help='Fecha inicial YYYY-MM-DD (inclusive)')
+        parser.add_argument('--hasta', type=str, help='Fecha final YYYY-MM-DD (inclusive)')
+        parser.add_argument('--region', type=str, help='Código de la región')
+        parser.add_argument('--salida', type=str, help='Archivo de salida (por defecto la salida estándar)')
+        parser.add_argument('--chunk', type=int, default=EXPORT_CHUNK_SIZE, help='Filas por bloque de lectura')
+
+    def handle(self, *args, **options):
+        fechas = {}
+        for opcion in ('desde', 'hasta'):
+            try:
+                fechas[opcion] = (datetime.datetime.strptime(options[opcion], '%Y-%m-%d').date()
+                                  if options[opcion] else None)
+            except ValueError:
+                raise CommandError('Formato de fecha inválido. Use YYYY-MM-DD')
+        region_id = None
+        if options['region']:
+            region_id = Region.objects.filter(codigo=options['region']).values_list('pk', flat=True).first()
+            if region_id is None:
+                raise CommandError(f"No existe la región {options['region']}")
+
+        lineas = exportar(options['recurso'], options['formato'], desde=fechas['desde'], hasta=fechas['hasta'],
+                          region_id=region_id, chunk_size=options['chunk'])
+        if not options['salida']:
+            for linea in lineas:
+                self.stdout.write(linea, ending='')
+            return
+
+        t0 = time.perf_counter()
+        total = 0
+        with open(options['salida'], 'w', encoding='utf-8', newline='') as salida:
+            for linea in lineas:
+                salida.write(linea)
+                total += 1
+        segundos = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(f"{total} líneas escritas en {options['salida']} ({segundos:.2f}s)"))
@@ -1,18 +1,31 @@
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand, CommandError
-from agenda.models import Dentista
-from agenda.slots_generator import generate_slots_for_day, generate_slots_range
+from django.db import connection
+from agenda.models import Dentista, Region
+from agenda.slots_generator import (
+    generate_slots_for_day, generate_slots_range, generate_slots_parallel, partition_slots_work, validar_horario,
+)
 import datetime
+import time
 
 
 class Command(BaseCommand):
-    help = 'Genera slots para dentistas. Uso: generate_slots --dentista <id> --fecha YYYY-MM-DD [--dias N] [--desde HH:MM] [--hasta HH:MM]'
+    help = ('Genera slots para dentistas. Uso: generate_slots (--dentista <id> | --all | --region <codigo>) '
+            '--fecha YYYY-MM-DD [--dias N] [--desde HH:MM] [--hasta HH:MM] [--workers N] [--ventana N]')
 
     def add_arguments(self, parser):
-        parser.add_argument('--dentista', type=int, required=True, help='ID del dentista')
+        objetivo = parser.add_mutually_exclusive_group(required=True)
+        objetivo.add_argument('--dentista', type=int, help='ID del dentista')
+        objetivo.add_argument('--all', action='store_true', help='Generar para todos los dentistas')
+        objetivo.add_argument('--region', type=str, help='Código de la región cuyos dentistas se generan')
         parser.add_argument('--fecha', type=str, required=True, help='Fecha inicial YYYY-MM-DD')
         parser.add_argument('--dias', type=int, default=1, help='Número de días a generar (inclusive)')
         parser.add_argument('--desde', type=str, default='08:00', help='Hora desde HH:MM')
         parser.add_argument('--hasta', type=str, default='16:00', help='Hora hasta HH:MM')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Procesos en paralelo para --all/--region (cada uno con su conexión)')
+        parser.add_argument('--ventana', type=int, default=30,
+                            help='Días por partición para --all/--region')
 
     def handle(self, *args, **options):
         dentista_id = options['dentista']
@@ -21,11 +34,6 @@ class Command(BaseCommand):
         desde = options['desde']
         hasta = options['hasta']
 
-        try:
-            dentista = Dentista.objects.get(pk=dentista_id)
-        except Dentista.DoesNotExist:
-            raise CommandError('Dentista no encontrado')
-
         try:
             fecha_obj = datetime.datetime.strptime(fecha, '%Y-%m-%d').date()
         except Exception:
@@ -34,10 +42,72 @@ class Command(BaseCommand):
         if dias <= 0:
             raise CommandError('dias debe ser mayor que 0')
 
-        if dias == 1:
-            created = generate_slots_for_day(dentista, fecha_obj, desde=desde, hasta=hasta)
-        else:
-            end_date = fecha_obj + datetime.timedelta(days=dias - 1)
-            created = generate_slots_range(dentista, fecha_obj, end_date, desde=desde, hasta=hasta)
+        if dentista_id is None:
+            return self._handle_multi(fecha_obj, options)
+
+        try:
+            dentista = Dentista.objects.get(pk=dentista_id)
+        except Dentista.DoesNotExist:
+            raise CommandError('Dentista no encontrado')
+
+        try:
+            if dias == 1:
+                resultado = generate_slots_for_day(dentista, fecha_obj, desde=desde, hasta=hasta)
+            else:
+                end_date = fecha_obj + datetime.timedelta(days=dias - 1)
+                resultado = generate_slots_range(dentista, fecha_obj, end_date, desde=desde, hasta=hasta)
+        except (ValueError, ValidationError) as e:
+            raise CommandError(f'Horario inválido: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Se crearon {resultado['created']} slots ({resultado['skipped']} ya existían) para el dentista {dentista}"
+        ))
+
+    def _handle_multi(self, fecha_obj, options):
+        desde = options['desde']
+        hasta = options['hasta']
+        workers = options['workers']
+        end_date = fecha_obj + datetime.timedelta(days=options['dias'] - 1)
+
+        # Validar el horario antes de repartir trabajo entre procesos
+        try:
+            validar_horario(desde, hasta)
+        except (ValueError, ValidationError) as e:
+            raise CommandError(f'Horario inválido: {e}')
+
+        dentistas = Dentista.objects.all()
+        if options['region']:
+            try:
+                region = Region.objects.get(codigo=options['region'])
+            except Region.DoesNotExist:
+                raise CommandError('Región no encontrada')
+            dentistas = dentistas.filter(region=region)
+        dentista_ids = list(dentistas.values_list('pk', flat=True))
+        if not dentista_ids:
+            raise CommandError('No hay dentistas para generar slots')
+
+        try:
+            particiones = partition_slots_work(dentista_ids, fecha_obj, end_date, window_days=options['ventana'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if workers > 1 and connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Una base SQLite en memoria no es visible desde otros procesos
+            workers = 1
 
-        self.stdout.write(self.style.SUCCESS(f'Se crearon/validaron {created} slots para el dentista {dentista}'))
+        self.stdout.write(f'{len(particiones)} particiones para {len(dentista_ids)} dentistas con {workers} worker(s)')
+        t0 = time.perf_counter()
+        created = skipped = 0
+        for r in generate_slots_parallel(particiones, workers=workers, desde=desde, hasta=hasta):
+            created += r['created']
+            skipped += r['skipped']
+            self.stdout.write(
+                f"  dentista {r['dentista']} {r['desde']}..{r['hasta']}: "
+                f"{r['created']} creados, {r['skipped']} existentes en {r['segundos']:.3f}s "
+                f"({r['slots_por_segundo']:.0f} slots/s)"
+            )
+        segundos = time.perf_counter() - t0
+        throughput = (created + skipped) / segundos if segundos else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f'Se crearon {created} slots ({skipped} ya existían) en {segundos:.2f}s ({throughput:.0f} slots/s)'
+        ))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from agenda.importacion import FORMATOS, IMPORT_CHUNK_SIZE, detectar_formato, es_utf8, importar_pacientes, leer_filas
+import io
+import json
+
+
+class Command(BaseCommand):
+    help = ('Importa pacientes desde un CSV o JSONL (columnas rut, nombre, apellido, telefono, email) en lotes, '
+            'sin cargar el archivo en memoria. Las filas rechazadas se escriben en un archivo JSONL aparte. '
+            'Uso: import_pacientes <archivo> [--formato csv|jsonl] [--chunk N] [--rechazos <archivo>] [--dry-run]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', type=str, help='Ruta del archivo CSV o JSONL')
+        parser.add_argument('--formato', choices=FORMATOS, help='Formato (por defecto según la extensión)')
+        parser.add_argument('--chunk', type=int, default=IMPORT_CHUNK_SIZE, help='Filas por lote')
+        parser.add_argument('--rechazos', type=str,
+                            help='Archivo JSONL de filas rechazadas (por defecto <archivo>.rechazos.jsonl)')
+        parser.add_argument('--dry-run', action='store_true', help='Solo validar, sin crear pacientes')
+
+    def handle(self, *args, **options):
+        archivo = options['archivo']
+        formato = options['formato'] or detectar_formato(archivo)
+        if formato is None:
+            raise CommandError('No se pudo deducir el formato por la extensión; use --formato csv|jsonl')
+        if options['chunk'] <= 0:
+            raise CommandError('--chunk debe ser mayor que 0')
+        ruta_rechazos = options['rechazos'] or f'{archivo}.rechazos.jsonl'
+
+        try:
+            binario = open(archivo, 'rb')
+        except OSError as e:
+            raise CommandError(f'No se pudo abrir {archivo}: {e}')
+        if not es_utf8(binario):
+            binario.close()
+            raise CommandError(f'{archivo} no está codificado en UTF-8; no se importó ninguna fila')
+        texto = io.TextIOWrapper(binario, encoding='utf-8-sig', newline='')
+
+        with texto, open(ruta_rechazos, 'w', encoding='utf-8') as rechazos:
+            def rechazar(linea, motivo, fila):
+                rechazos.write(json.dumps({'linea': linea, 'motivo': motivo, 'fila': fila}, ensure_ascii=False) + '\n')
+
+            resultado = importar_pacientes(
+                leer_filas(texto, formato), chunk_size=options['chunk'], rechazar=rechazar, dry_run=options['dry_run'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['filas']} filas en {resultado['segundos']:.2f}s ({resultado['filas_por_segundo']:.0f} filas/s): "
+            f"{resultado['creados']} creados, {resultado['existentes']} ya existían, {resultado['rechazados']} rechazados"
+            + (' (dry-run, sin cambios)' if options['dry_run'] else '')
+        ))
+        if resultado['rechazados']:
+            self.stdout.write(self.style.WARNING(f'Filas rechazadas en {ruta_rechazos}'))
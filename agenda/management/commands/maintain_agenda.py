@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from agenda.mantenimiento import PODA_CHUNK_SIZE, extender_horizonte, podar_slots_vacios
+import datetime
+import time
+
+
+class Command(BaseCommand):
+    help = ('Mantiene el horizonte móvil de slots generados y poda los slots pasados vacíos (para cron). '
+            'Uso: maintain_agenda [--dias N] [--retener N] [--desde HH:MM] [--hasta HH:MM] [--max-overbook N] '
+            '[--chunk N] [--sin-generar] [--sin-podar] [--reiniciar] [--dry-run]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=getattr(settings, 'AGENDA_HORIZONTE_DIAS', 60),
+                            help='Días hacia adelante (desde hoy) que deben tener slots')
+        parser.add_argument('--retener', type=int, default=getattr(settings, 'AGENDA_RETENCION_DIAS', 7),
+                            help='Días pasados cuyos slots vacíos se conservan')
+        parser.add_argument('--desde', type=str, default='08:00', help='Hora desde HH:MM de los slots generados')
+        parser.add_argument('--hasta', type=str, default='16:00', help='Hora hasta HH:MM de los slots generados')
+        parser.add_argument('--max-overbook', type=int, default=0, help='Sobrecupos por slot generado')
+        parser.add_argument('--chunk', type=int, default=PODA_CHUNK_SIZE, help='Slots borrados por transacción')
+        parser.add_argument('--sin-generar', action='store_true', help='No extender el horizonte')
+        parser.add_argument('--sin-podar', action='store_true', help='No borrar slots pasados')
+        parser.add_argument('--reiniciar', action='store_true',
+                            help='Ignorar las marcas y revisar el horizonte completo')
+        parser.add_argument('--dry-run', action='store_true', help='Solo contar los slots que se podarían')
+
+    def handle(self, *args, **options):
+        if options['dias'] <= 0:
+            raise CommandError('dias debe ser mayor que 0')
+        if options['retener'] < 0 or options['chunk'] <= 0:
+            raise CommandError('retener no puede ser negativo y chunk debe ser mayor que 0')
+        hoy = timezone.localdate()
+
+        if not options['sin_generar'] and not options['dry_run']:
+            t0 = time.perf_counter()
+            try:
+                grupos = extender_horizonte(
+                    options['dias'], hoy=hoy, desde=options['desde'], hasta=options['hasta'],
+                    max_overbook_default=options['max_overbook'], reiniciar=options['reiniciar'],
+                )
+            except (ValueError, ValidationError) as e:
+                raise CommandError(f'Horario inválido: {e}')
+            for g in grupos:
+                self.stdout.write(
+                    f"  {g['dentistas']} dentista(s) {g['desde']}..{g['hasta']}: "
+                    f"{g['created']} creados, {g['skipped']} existentes"
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f"Horizonte hasta {hoy + datetime.timedelta(days=options['dias'] - 1)}: "
+                f"{sum(g['created'] for g in grupos)} slots creados en {time.perf_counter() - t0:.2f}s"
+            ))
+
+        if not options['sin_podar']:
+            antes = hoy - datetime.timedelta(days=options['retener'])
+            t0 = time.perf_counter()
+            borrados = podar_slots_vacios(antes, chunk_size=options['chunk'], dry_run=options['dry_run'])
+            if options['dry_run']:
+                self.stdout.write(self.style.WARNING(f'{borrados} slots vacíos anteriores a {antes} (sin cambios)'))
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{borrados} slots vacíos anteriores a {antes} borrados en {time.perf_counter() - t0:.2f}s'
+                ))
@@ -0,0 +1,97 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F
+from agenda.revisiones import GLOBAL, incrementar
+from agenda.models import SlotAgenda, SobrecupoDia, Reserva
+import datetime
+
+
+class Command(BaseCommand):
+    help = ('Verifica y repara los contadores de ocupación de los slots (reservas_normales / reservas_sobrecupo) '
+            'y el libro diario de sobrecupos (SobrecupoDia). '
+            'Uso: recount_slots [--desde YYYY-MM-DD] [--dry-run] [--chunk N]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=str, help='Solo slots con fecha >= YYYY-MM-DD')
+        parser.add_argument('--dry-run', action='store_true', help='Solo informar diferencias, sin corregir')
+        parser.add_argument('--chunk', type=int, default=1000, help='Slots por lote')
+
+    def handle(self, *args, **options):
+        qs = SlotAgenda.objects.all()
+        desde = None
+        if options['desde']:
+            try:
+                desde = datetime.datetime.strptime(options['desde'], '%Y-%m-%d').date()
+            except Exception:
+                raise CommandError('Formato de fecha inválido. Use YYYY-MM-DD')
+            qs = qs.filter(fecha__gte=desde)
+
+        # Cuenta también las reservas de varios bloques en sus slots de continuación
+        qs = qs.con_ocupacion_real().exclude(
+            reservas_normales=F('real_normales'),
+            reservas_sobrecupo=F('real_sobrecupo'),
+        ).order_by('pk')
+
+        inconsistentes = 0
+        reparados = 0
+        chunk = options['chunk']
+        ultimo = 0
+        while True:
+            lote = list(qs.filter(pk__gt=ultimo)[:chunk])
+            if not lote:
+                break
+            ultimo = lote[-1].pk
+            for slot in lote:
+                self.stdout.write(
+                    f'  slot {slot.pk}: normales {slot.reservas_normales} -> {slot.real_normales}, '
+                    f'sobrecupo {slot.reservas_sobrecupo} -> {slot.real_sobrecupo}'
+                )
+                slot.reservas_normales = slot.real_normales
+                slot.reservas_sobrecupo = slot.real_sobrecupo
+            inconsistentes += len(lote)
+            if not options['dry_run']:
+                with transaction.atomic():
+                    SlotAgenda.objects.bulk_update(lote, ['reservas_normales', 'reservas_sobrecupo'])
+                reparados += len(lote)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{inconsistentes} slots con contadores inconsistentes (sin cambios)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{reparados} slots reparados'))
+
+        self._recount_sobrecupos_dia(desde, options['dry_run'])
+        if reparados:
+            # bulk_update no emite señales: el sello global nuevo descarta las vistas cacheadas
+            incrementar([GLOBAL])
+
+    def _recount_sobrecupos_dia(self, desde, dry_run):
+        """Compara el libro `SobrecupoDia` con las reservas con sobrecupo de cada dentista y día."""
+        reservas = Reserva.objects.filter(sobrecupo=True)
+        libro = SobrecupoDia.objects.all()
+        if desde:
+            reservas = reservas.filter(slot__fecha__gte=desde)
+            libro = libro.filter(fecha__gte=desde)
+        reales = {
+            (fila['slot__dentista_id'], fila['slot__fecha']): fila['total']
+            for fila in reservas.values('slot__dentista_id', 'slot__fecha').annotate(total=Count('id')).order_by()
+        }
+        registrados = {(f['dentista_id'], f['fecha']): f['sobrecupos_usados']
+                       for f in libro.values('dentista_id', 'fecha', 'sobrecupos_usados')}
+
+        diferencias = {
+            clave: reales.get(clave, 0)
+            for clave in set(reales) | set(registrados)
+            if reales.get(clave, 0) != registrados.get(clave, 0)
+        }
+        for (dentista_id, fecha), usados in sorted(diferencias.items()):
+            self.stdout.write(
+                f'  sobrecupos dentista {dentista_id} {fecha}: {registrados.get((dentista_id, fecha), 0)} -> {usados}'
+            )
+            if not dry_run:
+                SobrecupoDia.objects.update_or_create(
+                    dentista_id=dentista_id, fecha=fecha, defaults={'sobrecupos_usados': usados}
+                )
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'{len(diferencias)} días con sobrecupos inconsistentes (sin cambios)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{len(diferencias)} días de sobrecupos reparados'))
@@ -1,14 +1,20 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from agenda.models import Dentista, Servicio, Paciente
-from agenda.slots_generator import generate_slots_range
+from agenda.models import Dentista, Region, Servicio, digito_verificador_rut, formatear_rut
+from agenda.importacion import importar_pacientes
+from agenda.slots_generator import generate_slots_bulk, generate_slots_parallel, partition_slots_work
 import datetime
 
 
+# Cuerpo base de los RUT de los pacientes de ejemplo
+RUT_SEMILLA = 5000000
+
+
 class Command(BaseCommand):
-    help = 'Siembra datos de ejemplo: dentistas, servicios y pacientes. Opcionalmente genera slots para N días.'
+    help = 'Siembra datos de ejemplo: regiones, dentistas, servicios y pacientes. Opcionalmente genera slots para N días.'
 
     def add_arguments(self, parser):
+        parser.add_argument('--regiones', type=int, default=0, help='Número de regiones a crear (los dentistas se reparten entre ellas)')
         parser.add_argument('--dentistas', type=int, default=2, help='Número de dentistas a crear')
         parser.add_argument('--servicios', type=int, default=3, help='Número de servicios a crear')
         parser.add_argument('--pacientes', type=int, default=10, help='Número de pacientes a crear')
@@ -16,8 +22,12 @@ class Command(BaseCommand):
         parser.add_argument('--desde', type=str, default='08:00', help='Hora desde para generar slots')
         parser.add_argument('--hasta', type=str, default='16:00', help='Hora hasta para generar slots')
         parser.add_argument('--capacidad', type=int, default=1, help='Capacidad por slot (default 1)')
+        parser.add_argument('--max-overbook', type=int, default=0, help='Sobrecupos permitidos por slot generado (default 0)')
+        parser.add_argument('--max-overbook-dia', type=int, default=2, help='Sobrecupos por día de cada dentista creado (default 2)')
+        parser.add_argument('--workers', type=int, default=1, help='Procesos en paralelo para generar slots')
 
     def handle(self, *args, **options):
+        nr = options.get('regiones')
         nd = options.get('dentistas')
         ns = options.get('servicios')
         npat = options.get('pacientes')
@@ -25,18 +35,32 @@ class Command(BaseCommand):
         desde = options.get('desde')
         hasta = options.get('hasta')
         capacidad = options.get('capacidad')
+        max_overbook = options.get('max_overbook')
+        max_overbook_dia = options.get('max_overbook_dia')
+        workers = options.get('workers')
 
-        created = {'dentistas': 0, 'servicios': 0, 'pacientes': 0, 'slots': 0}
+        created = {'regiones': 0, 'dentistas': 0, 'servicios': 0, 'pacientes': 0, 'slots': 0}
 
         with transaction.atomic():
-            # Dentistas
+            # Regiones
+            regiones = []
+            for i in range(1, nr + 1):
+                region, r_created = Region.objects.get_or_create(codigo=f'R{i}', defaults={'nombre': f'Región {i}'})
+                regiones.append(region)
+                if r_created:
+                    created['regiones'] += 1
+
+            # Dentistas (repartidos entre las regiones, si se crearon)
             for i in range(1, nd + 1):
                 nombre = f'Dentista{i}'
                 apellido = f'Ejemplo {i}'
                 dentista, d_created = Dentista.objects.get_or_create(
                     nombre=nombre,
                     apellido=apellido,
-                    defaults={'max_overbook_day': 2}
+                    defaults={
+                        'max_overbook_day': max_overbook_dia,
+                        'region': regiones[(i - 1) % len(regiones)] if regiones else None,
+                    }
                 )
                 if d_created:
                     created['dentistas'] += 1
@@ -54,33 +78,41 @@ class Command(BaseCommand):
                 if s_created:
                     created['servicios'] += 1
 
-            # Pacientes
-            for i in range(1, npat + 1):
-                nombre = f'Paciente{i}'
-                apellido = f'Ejemplo {i}'
-                paciente, p_created = Paciente.objects.get_or_create(
-                    nombre=nombre,
-                    apellido=apellido,
-                    defaults={'telefono': f'+000000000{i:02d}', 'email': f'paciente{i}@example.com'}
-                )
-                if p_created:
-                    created['pacientes'] += 1
+            # Pacientes (RUT determinista por índice: volver a sembrar no los duplica)
+            filas = (
+                (i, {
+                    'rut': formatear_rut(f'{RUT_SEMILLA + i}{digito_verificador_rut(str(RUT_SEMILLA + i))}'),
+                    'nombre': f'Paciente{i}',
+                    'apellido': f'Ejemplo {i}',
+                    'telefono': f'+000000000{i:02d}',
+                    'email': f'paciente{i}@example.com',
+                })
+                for i in range(1, npat + 1)
+            )
+            created['pacientes'] = importar_pacientes(filas)['creados']
 
         # Generar slots si se solicita
         if gen_days and gen_days > 0:
             start_date = datetime.date.today()
             end_date = start_date + datetime.timedelta(days=gen_days - 1)
-            total_slots = 0
-            dentists = Dentista.objects.all()
-            for d in dentists:
-                total_slots += generate_slots_range(d, start_date, end_date, desde=desde, hasta=hasta, capacidad_default=capacidad)
-            created['slots'] = total_slots
+            dentist_ids = list(Dentista.objects.values_list('pk', flat=True))
+            if workers > 1:
+                particiones = partition_slots_work(dentist_ids, start_date, end_date)
+                resultados = generate_slots_parallel(particiones, workers=workers, desde=desde, hasta=hasta,
+                                                     capacidad_default=capacidad, max_overbook_default=max_overbook)
+                created['slots'] = sum(r['created'] for r in resultados)
+            else:
+                resultado = generate_slots_bulk(dentist_ids, start_date, end_date, desde=desde, hasta=hasta,
+                                                capacidad_default=capacidad, max_overbook_default=max_overbook)
+                created['slots'] = resultado['created']
 
         # Resumen
         self.stdout.write(self.style.SUCCESS('Seed completed:'))
+        if created['regiones']:
+            self.stdout.write(f"  Regiones creadas: {created['regiones']}")
         self.stdout.write(f"  Dentistas creados: {created['dentistas']}")
         self.stdout.write(f"  Servicios creados: {created['servicios']}")
         self.stdout.write(f"  Pacientes creados: {created['pacientes']}")
         if created['slots']:
-            self.stdout.write(f"  Slots creados/validados: {created['slots']}")
+            self.stdout.write(f"  Slots creados: {created['slots']}")
         self.stdout.write(self.style.SUCCESS('Seed finished.'))
@@ -0,0 +1,131 @@
+"""Mantenimiento periódico de la agenda (`manage.py maintain_agenda`, pensado para cron).
+
+- Horizonte móvil: los dentistas sin plantilla horaria tienen slots generados hasta
+  `hoy + dias - 1`. La marca `HorizonteAgenda.generado_hasta` de cada dentista hace que
+  cada corrida genere solo los días nuevos desde la anterior, no el horizonte completo.
+  Los dentistas con plantilla no se pregeneran: sus slots se materializan al reservar
+  (ver `agenda.plantillas`).
+- Poda: los slots pasados sin reservas (ni como inicio ni como continuación de un tramo)
+  se borran por lotes de claves primarias, cada lote en su propia transacción corta.
+"""
+import datetime
+import itertools
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import get_cache
+from .models import Dentista, HorizonteAgenda, Reserva, SlotAgenda
+from .revisiones import incrementar_dias
+from .slots_generator import BULK_CHUNK_SIZE, generate_slots_bulk
+
+# Slots por transacción al podar
+PODA_CHUNK_SIZE = 500
+
+
+def extender_horizonte(dias, hoy=None, desde='08:00', hasta='16:00', capacidad_default=1,
+                       max_overbook_default=0, reiniciar=False):
+    """Genera los slots de los días aún no cubiertos hasta `hoy + dias - 1` y avanza las marcas.
+
+    Los dentistas se agrupan por el primer día que les falta (normalmente todos comparten
+    la marca), y cada grupo se genera con un solo `generate_slots_bulk`. Con `reiniciar` se
+    ignoran las marcas y se recorre el horizonte completo (la generación es idempotente).
+    Devuelve una lista de dicts por grupo con `dentistas`, `desde`, `hasta`, `created` y `skipped`.
+    """
+    hoy = hoy or timezone.localdate()
+    objetivo = hoy + datetime.timedelta(days=dias - 1)
+    dentista_ids = list(Dentista.objects.filter(plantillas__isnull=True).values_list('pk', flat=True))
+    marcas = {} if reiniciar else dict(
+        HorizonteAgenda.objects.filter(dentista_id__in=dentista_ids).values_list('dentista_id', 'generado_hasta')
+    )
+
+    def primer_dia(dentista_id):
+        marca = marcas.get(dentista_id)
+        return max(hoy, marca + datetime.timedelta(days=1)) if marca else hoy
+
+    pendientes = sorted((primer_dia(d), d) for d in dentista_ids)
+    resultados = []
+    for inicio, grupo in itertools.groupby(pendientes, key=lambda p: p[0]):
+        if inicio > objetivo:
+            continue
+        ids = [dentista_id for _, dentista_id in grupo]
+        resultado = generate_slots_bulk(ids, inicio, objetivo, desde=desde, hasta=hasta,
+                                        capacidad_default=capacidad_default, chunk_size=BULK_CHUNK_SIZE,
+                                        max_overbook_default=max_overbook_default)
+        _marcar(ids, objetivo)
+        resultados.append({'dentistas': len(ids), 'desde': inicio, 'hasta': objetivo, **resultado})
+    return resultados
+
+
+def _marcar(dentista_ids, generado_hasta):
+    with transaction.atomic():
+        existentes = set(
+            HorizonteAgenda.objects.filter(dentista_id__in=dentista_ids).values_list('dentista_id', flat=True)
+        )
+        HorizonteAgenda.objects.filter(dentista_id__in=existentes).update(
+            generado_hasta=generado_hasta, actualizado=timezone.now(),
+        )
+        HorizonteAgenda.objects.bulk_create([
+            HorizonteAgenda(dentista_id=dentista_id, generado_hasta=generado_hasta)
+            for dentista_id in dentista_ids if dentista_id not in existentes
+        ], ignore_conflicts=True)
+
+
+def slots_vacios(antes):
+    """Slots anteriores a `antes` sin reservas que los ocupen (como inicio ni como continuación).
+
+    `_borrar_vacios` repite estas condiciones en su DELETE.
+    """
+    return SlotAgenda.objects.filter(
+        fecha__lt=antes, reservas_normales=0, reservas_sobrecupo=0,
+        reservas__isnull=True, continuaciones__isnull=True,
+    )
+
+
+def podar_slots_vacios(antes, chunk_size=PODA_CHUNK_SIZE, dry_run=False):
+    """Borra por lotes los slots vacíos anteriores a `antes`. Devuelve el número de slots borrados.
+
+    Cada lote se recorre por clave primaria y se borra en su propia transacción, volviendo a
+    exigir que no tenga reservas dentro del DELETE, así que los bloqueos duran un lote y una
+    reserva que llegue entre la lectura y el borrado protege su slot. El borrado es un DELETE
+    explícito (`_borrar_vacios`, sin señales por fila): los sellos y la caché de los días
+    tocados se invalidan por lote, como en `generate_slots_bulk`.
+    """
+    candidatos = slots_vacios(antes).order_by('pk').values_list('pk', 'dentista_id', 'fecha')
+    borrados = 0
+    ultimo = 0
+    while True:
+        lote = list(candidatos.filter(pk__gt=ultimo)[:chunk_size])
+        if not lote:
+            break
+        ultimo = lote[-1][0]
+        if dry_run:
+            borrados += len(lote)
+            continue
+        dias = sorted({(dentista_id, fecha) for _, dentista_id, fecha in lote})
+        with transaction.atomic():
+            borrados += _borrar_vacios([pk for pk, _, _ in lote])
+            incrementar_dias(dias)
+            get_cache().invalidar_dias(dias)
+    return borrados
+
+
+def _borrar_vacios(pks):
+    """DELETE de los slots `pks` que sigan vacíos (condiciones de `slots_vacios`). Devuelve las filas borradas.
+
+    Reservas y continuaciones son las únicas tablas que referencian a `SlotAgenda`, así que un
+    slot vacío se borra sin cascada y sin pasar por el `Collector` (ni señales por fila).
+    """
+    qn = connection.ops.quote_name
+    slot = qn(SlotAgenda._meta.db_table)
+    continuacion = Reserva.slots_continuacion.through
+    marcadores = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {slot} WHERE {slot}.id IN ({marcadores})'
+            f' AND {slot}.reservas_normales = 0 AND {slot}.reservas_sobrecupo = 0'
+            f' AND NOT EXISTS (SELECT 1 FROM {qn(Reserva._meta.db_table)} r WHERE r.slot_id = {slot}.id)'
+            f' AND NOT EXISTS (SELECT 1 FROM {qn(continuacion._meta.db_table)} c WHERE c.slotagenda_id = {slot}.id)',
+            pks,
+        )
+        return cursor.rowcount
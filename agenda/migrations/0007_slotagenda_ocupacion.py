@@ -0,0 +1,37 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+def poblar_ocupacion(apps, schema_editor):
+    SlotAgenda = apps.get_model('agenda', 'SlotAgenda')
+    Reserva = apps.get_model('agenda', 'Reserva')
+    conteos = (
+        Reserva.objects.values('slot_id', 'sobrecupo')
+        .annotate(total=models.Count('id'))
+        .order_by()
+    )
+    for fila in conteos:
+        campo = 'reservas_sobrecupo' if fila['sobrecupo'] else 'reservas_normales'
+        SlotAgenda.objects.filter(pk=fila['slot_id']).update(**{campo: fila['total']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0006_paciente_rut'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slotagenda',
+            name='reservas_normales',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='slotagenda',
+            name='reservas_sobrecupo',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(poblar_ocupacion, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def poblar_sobrecupos(apps, schema_editor):
+    Reserva = apps.get_model('agenda', 'Reserva')
+    SobrecupoDia = apps.get_model('agenda', 'SobrecupoDia')
+    conteos = (
+        Reserva.objects.filter(sobrecupo=True)
+        .values('slot__dentista_id', 'slot__fecha')
+        .annotate(total=models.Count('id'))
+        .order_by()
+    )
+    SobrecupoDia.objects.bulk_create([
+        SobrecupoDia(dentista_id=fila['slot__dentista_id'], fecha=fila['slot__fecha'], sobrecupos_usados=fila['total'])
+        for fila in conteos
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0007_slotagenda_ocupacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SobrecupoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('sobrecupos_usados', models.PositiveIntegerField(default=0)),
+                ('dentista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sobrecupos_dia', to='agenda.dentista')),
+            ],
+            options={
+                'unique_together': {('dentista', 'fecha')},
+            },
+        ),
+        migrations.RunPython(poblar_sobrecupos, migrations.RunPython.noop),
+    ]
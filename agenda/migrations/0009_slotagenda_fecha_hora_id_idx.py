@@ -0,0 +1,17 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0008_sobrecupodia'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='slotagenda',
+            index=models.Index(fields=['fecha', 'hora', 'id'], name='slot_fecha_hora_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0009_slotagenda_fecha_hora_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(fields=['apellido', 'nombre'], name='paciente_apellido_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('sobrecupo', True)), fields=['slot'], name='reserva_sobrecupo_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='slotagenda',
+            index=models.Index(condition=models.Q(('reservas_normales__lt', models.F('capacidad')), ('reservas_sobrecupo__lt', models.F('max_overbook')), _connector='OR'), fields=['fecha', 'hora', 'id'], name='slot_con_cupo_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0010_indices_consultas_calientes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevisionRecurso',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recurso', models.CharField(max_length=64, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
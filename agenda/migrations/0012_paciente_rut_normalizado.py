@@ -0,0 +1,88 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:29
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+# Copias de `agenda.models.digito_verificador_rut` / `normalizar_rut` al momento de la migración:
+# la migración no debe cambiar si esas funciones cambian después.
+def digito_verificador_rut(cuerpo):
+    suma, factor = 0, 2
+    for digito in reversed(cuerpo):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def normalizar_rut(rut):
+    limpio = (rut or '').replace('.', '').replace('-', '').replace(' ', '').upper()
+    cuerpo, dv = limpio[:-1], limpio[-1:]
+    if not cuerpo.isdigit() or len(cuerpo) > 8 or not dv or dv not in '0123456789K':
+        raise ValueError('RUT con formato inválido')
+    cuerpo = cuerpo.lstrip('0')
+    if not cuerpo or digito_verificador_rut(cuerpo) != dv:
+        raise ValueError('Dígito verificador del RUT inválido')
+    return cuerpo + dv
+
+
+def poblar_rut_normalizado(apps, schema_editor):
+    Paciente = apps.get_model('agenda', 'Paciente')
+    vistos = set()
+    actualizados = []
+    for paciente in Paciente.objects.order_by('pk').only('pk', 'rut').iterator(chunk_size=2000):
+        try:
+            normalizado = normalizar_rut(paciente.rut)
+        except ValueError:
+            continue
+        # Ante RUT duplicados conserva el paciente más antiguo; el resto queda sin normalizar
+        if normalizado in vistos:
+            continue
+        vistos.add(normalizado)
+        paciente.rut_normalizado = normalizado
+        actualizados.append(paciente)
+    Paciente.objects.bulk_update(actualizados, ['rut_normalizado'], batch_size=2000)
+
+
+def crear_indice_fts(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS agenda_paciente_fts USING fts5("
+            "nombre, apellido, email, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        # SQLite compilado sin FTS5: la búsqueda usa el respaldo por prefijo
+        return
+    schema_editor.execute(
+        "INSERT INTO agenda_paciente_fts (rowid, nombre, apellido, email) "
+        "SELECT id, nombre, apellido, email FROM agenda_paciente"
+    )
+
+
+def eliminar_indice_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS agenda_paciente_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0011_revisionrecurso'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paciente',
+            name='rut_normalizado',
+            field=models.CharField(blank=True, editable=False, max_length=9, null=True),
+        ),
+        migrations.RunPython(poblar_rut_normalizado, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='paciente',
+            name='rut_normalizado',
+            field=models.CharField(blank=True, editable=False, max_length=9, null=True, unique=True),
+        ),
+        migrations.RunPython(crear_indice_fts, eliminar_indice_fts),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0012_paciente_rut_normalizado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reserva',
+            name='slots_continuacion',
+            field=models.ManyToManyField(blank=True, related_name='continuaciones', to='agenda.slotagenda'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0013_reserva_slots_continuacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlantillaHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')])),
+                ('desde', models.TimeField()),
+                ('hasta', models.TimeField()),
+                ('capacidad', models.PositiveIntegerField(default=1)),
+                ('max_overbook', models.PositiveIntegerField(default=0)),
+                ('vigente_desde', models.DateField(blank=True, null=True)),
+                ('vigente_hasta', models.DateField(blank=True, null=True)),
+                ('dentista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plantillas', to='agenda.dentista')),
+            ],
+            options={
+                'ordering': ('dentista', 'dia_semana', 'desde'),
+            },
+        ),
+        migrations.CreateModel(
+            name='ExcepcionAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_desde', models.DateField()),
+                ('fecha_hasta', models.DateField()),
+                ('desde', models.TimeField(blank=True, null=True)),
+                ('hasta', models.TimeField(blank=True, null=True)),
+                ('motivo', models.CharField(blank=True, max_length=150)),
+                ('dentista', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='excepciones', to='agenda.dentista')),
+            ],
+            options={
+                'ordering': ('fecha_desde',),
+                'indexes': [models.Index(fields=['fecha_hasta', 'fecha_desde'], name='excepcion_fechas_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0014_plantillas_horario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HorizonteAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generado_hasta', models.DateField()),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('dentista', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='horizonte', to='agenda.dentista')),
+            ],
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.25 on 2026-10-18 01:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agenda', '0015_horizonte_agenda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotAgendaArchivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fecha', models.DateField()),
+                ('hora', models.TimeField()),
+                ('capacidad', models.PositiveIntegerField()),
+                ('max_overbook', models.PositiveIntegerField()),
+                ('creador', models.CharField(blank=True, max_length=100)),
+                ('reservas_normales', models.PositiveIntegerField()),
+                ('reservas_sobrecupo', models.PositiveIntegerField()),
+                ('archivado_en', models.DateTimeField(auto_now_add=True)),
+                ('dentista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots_archivados', to='agenda.dentista')),
+                ('servicio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='agenda.servicio')),
+            ],
+            options={
+                'ordering': ('fecha', 'hora'),
+            },
+        ),
+        migrations.CreateModel(
+            name='ReservaArchivo',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('fecha', models.DateField()),
+                ('hora', models.TimeField()),
+                ('creado_en', models.DateTimeField()),
+                ('sobrecupo', models.BooleanField(default=False)),
+                ('archivado_en', models.DateTimeField(auto_now_add=True)),
+                ('dentista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_archivadas', to='agenda.dentista')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_archivadas', to='agenda.paciente')),
+                ('servicio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='agenda.servicio')),
+                ('slot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='agenda.slotagendaarchivo')),
+                ('slots_continuacion', models.ManyToManyField(blank=True, related_name='continuaciones', to='agenda.slotagendaarchivo')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='slotagendaarchivo',
+            index=models.Index(fields=['dentista', 'fecha', 'hora'], name='slot_archivo_dentista_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservaarchivo',
+            index=models.Index(fields=['fecha', 'hora', 'id'], name='reserva_archivo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservaarchivo',
+            index=models.Index(fields=['paciente', 'fecha'], name='reserva_archivo_paciente_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservaarchivo',
+            index=models.Index(fields=['dentista', 'fecha'], name='reserva_archivo_dentista_idx'),
+        ),
+    ]
@@ -1,7 +1,55 @@
+import datetime
+
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
 
 
+# Horario permitido para los slots (bloques de 30 minutos)
+SLOT_HORA_MIN = datetime.time(8, 0)
+SLOT_HORA_MAX = datetime.time(18, 0)  # Extendido hasta las 18:00 para mayor flexibilidad
+SLOT_MINUTOS = (0, 30)
+
+
+def validar_hora_slot(hora):
+    """Valida que `hora` esté dentro del horario permitido y en bloques de 30 minutos."""
+    if hora < SLOT_HORA_MIN or hora > SLOT_HORA_MAX:
+        raise ValidationError({'hora': 'La hora debe estar entre 08:00 y 18:00.'})
+
+    if hora.minute not in SLOT_MINUTOS:
+        raise ValidationError({'hora': 'La hora debe estar en bloques de 30 minutos (mm = 00 o 30).'})
+
+
+def digito_verificador_rut(cuerpo):
+    """Dígito verificador (módulo 11) del cuerpo numérico de un RUT: '0'-'9' o 'K'."""
+    suma, factor = 0, 2
+    for digito in reversed(cuerpo):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def normalizar_rut(rut):
+    """'12.345.678-5' → '123456785' (sin puntos ni guion, 'K' en mayúscula).
+
+    Lanza ValueError si el formato o el dígito verificador no son válidos.
+    """
+    limpio = (rut or '').replace('.', '').replace('-', '').replace(' ', '').upper()
+    cuerpo, dv = limpio[:-1], limpio[-1:]
+    if not cuerpo.isdigit() or len(cuerpo) > 8 or not dv or dv not in '0123456789K':
+        raise ValueError('RUT con formato inválido')
+    cuerpo = cuerpo.lstrip('0')
+    if not cuerpo or digito_verificador_rut(cuerpo) != dv:
+        raise ValueError('Dígito verificador del RUT inválido')
+    return cuerpo + dv
+
+
+def formatear_rut(normalizado):
+    """'123456785' → '12345678-5'."""
+    return f'{normalizado[:-1]}-{normalizado[-1]}'
+
+
 class Region(models.Model):
     """Regiones donde la clínica tiene presencia"""
     nombre = models.CharField(max_length=100)
@@ -17,6 +65,8 @@ class Region(models.Model):
 class Paciente(models.Model):
   
     rut = models.CharField(max_length=12, null=False, blank=False) 
+    # RUT sin puntos ni guion (ver `normalizar_rut`); NULL si `rut` no es un RUT válido
+    rut_normalizado = models.CharField(max_length=9, unique=True, null=True, blank=True, editable=False)
     nombre = models.CharField(max_length=100)
     apellido = models.CharField(max_length=100)
     telefono = models.CharField(max_length=20, blank=True)
@@ -25,10 +75,42 @@ class Paciente(models.Model):
 
     class Meta:
         ordering = ['apellido', 'nombre']
+        indexes = [
+            # Listado ordenado de pacientes sin ordenar en memoria
+            models.Index(fields=['apellido', 'nombre'], name='paciente_apellido_nombre_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nombre} {self.apellido}"
 
+    def clean(self):
+        """Valida el dígito verificador y deja el RUT como '12345678-5' (admin y formularios)."""
+        super().clean()
+        try:
+            self.rut_normalizado = normalizar_rut(self.rut)
+        except ValueError as e:
+            raise ValidationError({'rut': str(e)})
+        self.rut = formatear_rut(self.rut_normalizado)
+
+    def validate_unique(self, exclude=None):
+        # `rut_normalizado` no es editable y los formularios lo excluyen: su unicidad se
+        # comprueba aquí y se informa en `rut`, en vez de un IntegrityError al guardar
+        exclude = set(exclude or ())
+        super().validate_unique(exclude=exclude | {'rut_normalizado'})
+        if 'rut' in exclude or not self.rut_normalizado:
+            return
+        existentes = Paciente.objects.filter(rut_normalizado=self.rut_normalizado).exclude(pk=self.pk)
+        if existentes.exists():
+            raise ValidationError({'rut': 'Ya existe un paciente con este RUT.'})
+
+    def save(self, *args, **kwargs):
+        # Sin pasar por `clean()` (cargas masivas, datos antiguos) un RUT inválido queda sin normalizar
+        try:
+            self.rut_normalizado = normalizar_rut(self.rut)
+        except ValueError:
+            self.rut_normalizado = None
+        super().save(*args, **kwargs)
+
 
 class Dentista(models.Model):
    
@@ -57,6 +139,39 @@ class Servicio(models.Model):
         return self.nombre
 
 
+class SlotAgendaQuerySet(models.QuerySet):
+    def con_cupo(self):
+        """Slots con capacidad normal o sobrecupo disponible, según los contadores de ocupación."""
+        return self.filter(
+            models.Q(reservas_normales__lt=models.F('capacidad'))
+            | models.Q(reservas_sobrecupo__lt=models.F('max_overbook'))
+        )
+
+    def sin_excepcion(self):
+        """Slots que ninguna `ExcepcionAgenda` anula (ver `excepcion_vigente`)."""
+        return self.filter(~excepcion_vigente())
+
+    def con_ocupacion_real(self):
+        """Anota `real_normales` / `real_sobrecupo`: reservas que ocupan cada slot, como inicio o como continuación."""
+        def contar(relacion, sobrecupo):
+            return models.Count(relacion, filter=models.Q(**{f'{relacion}__sobrecupo': sobrecupo}), distinct=True)
+        return self.annotate(
+            real_normales=contar('reservas', False) + contar('continuaciones', False),
+            real_sobrecupo=contar('reservas', True) + contar('continuaciones', True),
+        )
+
+
+def excepcion_vigente():
+    """`Exists` de una `ExcepcionAgenda` (del dentista o de toda la clínica) que cubre el slot de la consulta externa."""
+    return models.Exists(
+        ExcepcionAgenda.objects.filter(
+            models.Q(dentista__isnull=True) | models.Q(dentista_id=models.OuterRef('dentista_id')),
+            models.Q(desde__isnull=True) | models.Q(desde__lte=models.OuterRef('hora'), hasta__gte=models.OuterRef('hora')),
+            fecha_desde__lte=models.OuterRef('fecha'), fecha_hasta__gte=models.OuterRef('fecha'),
+        )
+    )
+
+
 class SlotAgenda(models.Model):
     """Slot de una duración estándar (30 min). 
 
@@ -71,26 +186,38 @@ class SlotAgenda(models.Model):
     capacidad = models.PositiveIntegerField(default=1, help_text='Cuántos pacientes caben en este slot')
     max_overbook = models.PositiveIntegerField(default=0, help_text='Cuántos sobrecupos adicionales se permiten en este slot')
     creador = models.CharField(max_length=100, blank=True)
+    # Contadores desnormalizados de ocupación (se mantienen al crear/eliminar reservas;
+    # `manage.py recount_slots` los verifica y repara)
+    reservas_normales = models.PositiveIntegerField(default=0, editable=False)
+    reservas_sobrecupo = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = SlotAgendaQuerySet.as_manager()
 
     class Meta:
         unique_together = ('dentista', 'fecha', 'hora')
         ordering = ('fecha', 'hora')
+        indexes = [
+            # Paginación por cursor de los listados: ORDER BY fecha, hora, id; también
+            # cubre fecha >= hoy y fecha = X (sin dentista) ordenado por hora
+            models.Index(fields=['fecha', 'hora', 'id'], name='slot_fecha_hora_id_idx'),
+            # Listados "solo con cupo" (?disponibles=1): índice parcial sobre los slots con
+            # capacidad restante, según los contadores de ocupación
+            models.Index(
+                fields=['fecha', 'hora', 'id'],
+                name='slot_con_cupo_idx',
+                condition=(
+                    models.Q(reservas_normales__lt=models.F('capacidad'))
+                    | models.Q(reservas_sobrecupo__lt=models.F('max_overbook'))
+                ),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.dentista} - {self.fecha} {self.hora}"
 
     def clean(self):
-        # Validaciones: 08:00-16:00 y bloques de 30 minutos
-        from django.core.exceptions import ValidationError
-        import datetime
-
-        min_hora = datetime.time(8, 0)
-        max_hora = datetime.time(18, 0)  # Extendido hasta las 18:00 para mayor flexibilidad
-        if self.hora < min_hora or self.hora > max_hora:
-            raise ValidationError({'hora': 'La hora debe estar entre 08:00 y 18:00.'})
-
-        if self.hora.minute not in (0, 30):
-            raise ValidationError({'hora': 'La hora debe estar en bloques de 30 minutos (mm = 00 o 30).'})
+        # Validaciones: 08:00-18:00 y bloques de 30 minutos
+        validar_hora_slot(self.hora)
 
         qs = SlotAgenda.objects.filter(dentista=self.dentista, fecha=self.fecha, hora=self.hora)
         if self.pk:
@@ -102,10 +229,56 @@ class SlotAgenda(models.Model):
         self.full_clean()
         return super().save(*args, **kwargs)
 
+    @property
+    def tiene_cupo(self):
+        return self.reservas_normales < self.capacidad or self.reservas_sobrecupo < self.max_overbook
+
+    def recalcular_ocupacion(self):
+        """Recalcula los contadores de ocupación desde las reservas del slot."""
+        self.reservas_normales, self.reservas_sobrecupo = (
+            SlotAgenda.objects.filter(pk=self.pk).con_ocupacion_real().values_list('real_normales', 'real_sobrecupo').get()
+        )
+        SlotAgenda.objects.filter(pk=self.pk).update(
+            reservas_normales=self.reservas_normales,
+            reservas_sobrecupo=self.reservas_sobrecupo,
+        )
+        SobrecupoDia.recalcular(self.dentista_id, self.fecha)
+
+
+class SobrecupoDia(models.Model):
+    """Libro de sobrecupos usados por dentista y día.
+
+    Es el único punto de serialización de `Dentista.max_overbook_day`: la admisión de un
+    sobrecupo bloquea esta fila (`select_for_update`) y la incrementa, en vez de contar las
+    reservas con sobrecupo del día.
+    """
+    dentista = models.ForeignKey(Dentista, on_delete=models.CASCADE, related_name='sobrecupos_dia')
+    fecha = models.DateField()
+    sobrecupos_usados = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('dentista', 'fecha')
+
+    def __str__(self):
+        return f"{self.dentista} - {self.fecha}: {self.sobrecupos_usados} sobrecupos"
+
+    @classmethod
+    def recalcular(cls, dentista_id, fecha):
+        """Recalcula la fila del libro desde las reservas con sobrecupo del día."""
+        usados = Reserva.objects.filter(slot__dentista_id=dentista_id, slot__fecha=fecha, sobrecupo=True).count()
+        cls.objects.update_or_create(dentista_id=dentista_id, fecha=fecha, defaults={'sobrecupos_usados': usados})
+        return usados
+
 
 class Reserva(models.Model):
-    """Reserva asociada a un `SlotAgenda` y a un `Paciente`. Campo `sobrecupo` indica si fue overbook."""
+    """Reserva asociada a un `SlotAgenda` y a un `Paciente`. Campo `sobrecupo` indica si fue overbook.
+
+    Si la duración del servicio supera un bloque de 30 minutos, `slot` es el bloque de inicio y
+    `slots_continuacion` los siguientes del mismo dentista y día, que también cuentan la reserva
+    en sus contadores de ocupación.
+    """
     slot = models.ForeignKey(SlotAgenda, on_delete=models.CASCADE, related_name='reservas')
+    slots_continuacion = models.ManyToManyField(SlotAgenda, related_name='continuaciones', blank=True)
     paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='reservas')
     servicio = models.ForeignKey(Servicio, on_delete=models.SET_NULL, null=True, blank=True)
     creado_en = models.DateTimeField(auto_now_add=True)
@@ -113,6 +286,169 @@ class Reserva(models.Model):
 
     class Meta:
         unique_together = ('slot', 'paciente')
+        indexes = [
+            # Recuento de sobrecupos por slot/día (recount_slots, SobrecupoDia.recalcular):
+            # índice parcial solo sobre las reservas con sobrecupo, donde el backend lo soporte
+            models.Index(fields=['slot'], name='reserva_sobrecupo_slot_idx', condition=models.Q(sobrecupo=True)),
+        ]
 
     def __str__(self):
         return f"Reserva {self.paciente} -> {self.slot} {'(Sobrecupo)' if self.sobrecupo else ''}"
+
+
+class RevisionRecurso(models.Model):
+    """Sello de versión de un recurso de lectura (`slots:<dentista|*>:<fecha>`, `dentistas`, ...).
+
+    Se incrementa con cada escritura sobre los modelos del recurso (ver `agenda.revisiones`)
+    y las vistas lo usan para responder `ETag`/`Last-Modified` y 304 sin ejecutar la
+    consulta principal.
+    """
+    recurso = models.CharField(max_length=64, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    actualizado = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.recurso} v{self.version}"
+
+
+class PlantillaHorario(models.Model):
+    """Horario semanal de un dentista: un tramo `desde`-`hasta` (inicios de bloque, ambos inclusive) de un día.
+
+    La disponibilidad futura se calcula desde las plantillas sin crear filas de `SlotAgenda`;
+    el slot se materializa al reservarlo, con la capacidad y los sobrecupos del tramo (ver
+    `agenda.plantillas`). `vigente_desde` / `vigente_hasta` acotan el periodo en que rige.
+    """
+    DIAS_SEMANA = [
+        (0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo'),
+    ]
+
+    dentista = models.ForeignKey(Dentista, on_delete=models.CASCADE, related_name='plantillas')
+    dia_semana = models.PositiveSmallIntegerField(choices=DIAS_SEMANA)
+    desde = models.TimeField()
+    hasta = models.TimeField()
+    capacidad = models.PositiveIntegerField(default=1)
+    max_overbook = models.PositiveIntegerField(default=0)
+    vigente_desde = models.DateField(null=True, blank=True)
+    vigente_hasta = models.DateField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('dentista', 'dia_semana', 'desde')
+
+    def __str__(self):
+        return f"{self.dentista} - {self.get_dia_semana_display()} {self.desde}-{self.hasta}"
+
+    def clean(self):
+        validar_hora_slot(self.desde)
+        validar_hora_slot(self.hasta)
+        if self.hasta < self.desde:
+            raise ValidationError({'hasta': 'hasta debe ser posterior o igual a desde.'})
+        if self.vigente_desde and self.vigente_hasta and self.vigente_hasta < self.vigente_desde:
+            raise ValidationError({'vigente_hasta': 'vigente_hasta debe ser posterior o igual a vigente_desde.'})
+
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        return super().save(*args, **kwargs)
+
+
+class ExcepcionAgenda(models.Model):
+    """Días u horas sin atención (feriados, licencias): anulan los bloques de las plantillas.
+
+    Sin `dentista` aplica a toda la clínica; sin `desde`/`hasta` cubre los días completos, si
+    no, los bloques que empiezan entre `desde` y `hasta` (inclusive). También cubre los slots
+    ya materializados y los de dentistas sin plantillas: no se muestran como disponibles ni
+    admiten reservas nuevas (las existentes se conservan).
+    """
+    dentista = models.ForeignKey(Dentista, on_delete=models.CASCADE, related_name='excepciones', null=True, blank=True)
+    fecha_desde = models.DateField()
+    fecha_hasta = models.DateField()
+    desde = models.TimeField(null=True, blank=True)
+    hasta = models.TimeField(null=True, blank=True)
+    motivo = models.CharField(max_length=150, blank=True)
+
+    class Meta:
+        ordering = ('fecha_desde',)
+        indexes = [
+            models.Index(fields=['fecha_hasta', 'fecha_desde'], name='excepcion_fechas_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.dentista or 'Clínica'} {self.fecha_desde}-{self.fecha_hasta} {self.motivo}".strip()
+
+    def clean(self):
+        if self.fecha_hasta < self.fecha_desde:
+            raise ValidationError({'fecha_hasta': 'fecha_hasta debe ser posterior o igual a fecha_desde.'})
+        if (self.desde is None) != (self.hasta is None):
+            raise ValidationError('Indique desde y hasta, o ninguno para el día completo.')
+        if self.desde is not None and self.hasta < self.desde:
+            raise ValidationError({'hasta': 'hasta debe ser posterior o igual a desde.'})
+
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        return super().save(*args, **kwargs)
+
+
+class HorizonteAgenda(models.Model):
+    """Marca de agua de la pregeneración de slots de un dentista (`manage.py maintain_agenda`).
+
+    `generado_hasta` es el último día cuyos slots ya se generaron: cada corrida genera solo
+    los días entre esta marca y el nuevo horizonte.
+    """
+    dentista = models.OneToOneField(Dentista, on_delete=models.CASCADE, related_name='horizonte')
+    generado_hasta = models.DateField()
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.dentista} hasta {self.generado_hasta}"
+
+
+class SlotAgendaArchivo(models.Model):
+    """Slot pasado movido fuera de `SlotAgenda` por `manage.py archive_agenda` (solo lectura).
+
+    Conserva el ID original, los contadores y la capacidad tal como estaban al archivarse.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    dentista = models.ForeignKey(Dentista, on_delete=models.CASCADE, related_name='slots_archivados')
+    servicio = models.ForeignKey(Servicio, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    fecha = models.DateField()
+    hora = models.TimeField()
+    capacidad = models.PositiveIntegerField()
+    max_overbook = models.PositiveIntegerField()
+    creador = models.CharField(max_length=100, blank=True)
+    reservas_normales = models.PositiveIntegerField()
+    reservas_sobrecupo = models.PositiveIntegerField()
+    archivado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('fecha', 'hora')
+        indexes = [
+            models.Index(fields=['dentista', 'fecha', 'hora'], name='slot_archivo_dentista_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.dentista} - {self.fecha} {self.hora} (archivado)"
+
+
+class ReservaArchivo(models.Model):
+    """Reserva de un slot archivado, con dentista, fecha y hora copiados para consultarla sin joins."""
+    id = models.BigIntegerField(primary_key=True)
+    slot = models.ForeignKey(SlotAgendaArchivo, on_delete=models.CASCADE, related_name='reservas')
+    slots_continuacion = models.ManyToManyField(SlotAgendaArchivo, related_name='continuaciones', blank=True)
+    dentista = models.ForeignKey(Dentista, on_delete=models.CASCADE, related_name='reservas_archivadas')
+    fecha = models.DateField()
+    hora = models.TimeField()
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='reservas_archivadas')
+    servicio = models.ForeignKey(Servicio, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    creado_en = models.DateTimeField()
+    sobrecupo = models.BooleanField(default=False)
+    archivado_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Paginación por cursor del historial: ORDER BY fecha, hora, id
+            models.Index(fields=['fecha', 'hora', 'id'], name='reserva_archivo_fecha_idx'),
+            models.Index(fields=['paciente', 'fecha'], name='reserva_archivo_paciente_idx'),
+            models.Index(fields=['dentista', 'fecha'], name='reserva_archivo_dentista_idx'),
+        ]
+
+    def __str__(self):
+        return f"Reserva {self.paciente} -> {self.dentista} {self.fecha} {self.hora} (archivada)"
@@ -0,0 +1,113 @@
+"""Paginación por cursor (keyset) para listados de slots.
+
+El cursor codifica la clave (fecha, hora, id) del último slot devuelto y la página
+siguiente se obtiene con una condición de rango sobre esa clave, apoyada en el índice
+compuesto (fecha, hora, id): la página N cuesta lo mismo que la página 1.
+
+Los bloques de plantilla aún sin slot (`id` null) se ordenan dentro de su (fecha, hora)
+antes que los slots, con `-dentista_id` como tercer componente de la clave.
+
+El cuerpo de la respuesta sigue siendo una lista; el enlace a la página siguiente
+viaja en las cabeceras `Link: <...>; rel="next"` y `X-Next-Cursor`. Se pagina siempre:
+sin `page_size` la página tiene `AGENDA_SLOTS_PAGE_SIZE` filas, y nunca más de
+`AGENDA_SLOTS_PAGE_SIZE_MAX`.
+
+`ReservaKeysetPagination` aplica lo mismo a las reservas, con la (fecha, hora) de su slot.
+"""
+import base64
+import datetime
+import itertools
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class SlotKeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    ordering = ('fecha', 'hora', 'id')
+
+    def get_page_size(self, request):
+        default = getattr(settings, 'AGENDA_SLOTS_PAGE_SIZE', 200)
+        maximo = getattr(settings, 'AGENDA_SLOTS_PAGE_SIZE_MAX', 1000)
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, default))
+        except (TypeError, ValueError):
+            page_size = default
+        return max(1, min(page_size, maximo))
+
+    def decode_cursor(self, cursor):
+        try:
+            fecha, hora, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return (
+                datetime.date.fromisoformat(fecha),
+                datetime.time.fromisoformat(hora),
+                int(pk),
+            )
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise ValidationError({'detail': 'Cursor inválido.'})
+
+    def clave_cursor(self, request):
+        """(fecha, hora, id) del `cursor` de la petición, o None en la primera página."""
+        cursor = request.query_params.get(self.cursor_query_param)
+        return self.decode_cursor(cursor) if cursor else None
+
+    def encode_cursor(self, fecha, hora, pk):
+        return base64.urlsafe_b64encode(f'{fecha}|{hora}|{pk}'.encode()).decode()
+
+    @staticmethod
+    def clave(fila):
+        """(fecha, hora, id) de una fila serializada; un bloque de plantilla usa `-dentista_id` como id."""
+        pk = fila['id'] if fila['id'] is not None else -fila['dentista_id']
+        return datetime.date.fromisoformat(fila['fecha']), datetime.time.fromisoformat(fila['hora']), pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Devuelve el queryset de la página (page_size + 1 filas, para saber si hay siguiente)."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.clave_cursor(request)
+        if cursor:
+            fecha, hora, pk = cursor
+            c_fecha, c_hora, c_id = self.ordering
+            queryset = queryset.filter(
+                Q(**{f'{c_fecha}__gt': fecha})
+                | Q(**{c_fecha: fecha, f'{c_hora}__gt': hora})
+                | Q(**{c_fecha: fecha, c_hora: hora, f'{c_id}__gt': pk})
+            )
+        return queryset.order_by(*self.ordering)[:self.page_size + 1]
+
+    def paginate_list(self, filas, request):
+        """Como `paginate_queryset`, sobre filas ya serializadas y ordenadas por `clave` (puede ser un iterador)."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.clave_cursor(request)
+        if cursor:
+            filas = (f for f in filas if self.clave(f) > cursor)
+        return list(itertools.islice(filas, self.page_size + 1))
+
+    def get_paginated_response(self, data):
+        """`data` son las filas serializadas de `paginate_queryset` (con `fecha`, `hora` e `id`)."""
+        headers = {}
+        if len(data) > self.page_size:
+            data = data[:self.page_size]
+            ultimo = data[-1]
+            cursor = self.encode_cursor(*self.clave(ultimo))
+            url = replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+            headers = {'Link': f'<{url}>; rel="next"', 'X-Next-Cursor': cursor}
+        return Response(data, headers=headers)
+
+
+
+class ReservaKeysetPagination(SlotKeysetPagination):
+    """Reservas por cursor sobre (fecha, hora) de su slot e id de la reserva."""
+    ordering = ('slot__fecha', 'slot__hora', 'id')
+
+    @staticmethod
+    def clave(fila):
+        """(fecha, hora, id) de una reserva serializada con `ReservaReadSerializer`."""
+        slot = fila['slot']
+        return datetime.date.fromisoformat(slot['fecha']), datetime.time.fromisoformat(slot['hora']), fila['id']
@@ -0,0 +1,233 @@
+"""Agenda virtual a partir de plantillas semanales (`PlantillaHorario`) y excepciones (`ExcepcionAgenda`).
+
+Los slots futuros no se pregeneran: la disponibilidad (matriz, huecos, próxima hora
+disponible) suma a los `SlotAgenda` existentes las filas virtuales que producen las
+plantillas, y una fila de `SlotAgenda` se crea (`materializar_slots`) recién al reservar
+ese bloque. Así el almacenamiento crece con las reservas y no con el horizonte.
+
+Las filas virtuales tienen la misma forma que las de `disponibilidad.consulta_disponibilidad`
+con ocupación cero. Un bloque que ya tiene `SlotAgenda` nunca se repite como virtual.
+
+Las excepciones anulan tanto los bloques de plantilla como los slots ad hoc de los dentistas
+sin plantillas (y, en la admisión y la disponibilidad, los slots ya materializados).
+"""
+import datetime
+
+from django.db.models import Q
+
+from .models import ExcepcionAgenda, PlantillaHorario, SlotAgenda, SobrecupoDia
+
+MENSAJE_FUERA_DE_HORARIO = 'El dentista no atiende en ese horario.'
+
+# Capacidad y sobrecupos de los slots creados para dentistas sin plantillas
+CAPACIDAD_AD_HOC = (1, 0)
+
+
+def _horas(desde, hasta):
+    base = datetime.date.min
+    actual = datetime.datetime.combine(base, desde)
+    fin = datetime.datetime.combine(base, hasta)
+    horas = []
+    while actual <= fin:
+        horas.append(actual.time())
+        actual += datetime.timedelta(minutes=30)
+    return horas
+
+
+def _fechas(desde, hasta):
+    dia = desde
+    while dia <= hasta:
+        yield dia
+        dia += datetime.timedelta(days=1)
+
+
+def consulta_plantillas(desde, hasta, dentista_ids=None, region_id=None):
+    """Plantillas vigentes en [desde, hasta] con el tope diario de sobrecupos de su dentista."""
+    qs = PlantillaHorario.objects.filter(
+        Q(vigente_desde__isnull=True) | Q(vigente_desde__lte=hasta),
+        Q(vigente_hasta__isnull=True) | Q(vigente_hasta__gte=desde),
+    )
+    if dentista_ids:
+        qs = qs.filter(dentista_id__in=dentista_ids)
+    if region_id is not None:
+        qs = qs.filter(dentista__region_id=region_id)
+    return qs.values_list(
+        'dentista_id', 'dia_semana', 'desde', 'hasta', 'capacidad', 'max_overbook',
+        'vigente_desde', 'vigente_hasta', 'dentista__max_overbook_day',
+    )
+
+
+def consulta_excepciones(desde, hasta, dentista_ids):
+    """Excepciones en [desde, hasta] de toda la clínica o de `dentista_ids`."""
+    return (
+        ExcepcionAgenda.objects.filter(fecha_desde__lte=hasta, fecha_hasta__gte=desde)
+        .filter(Q(dentista__isnull=True) | Q(dentista_id__in=dentista_ids))
+        .values_list('dentista_id', 'fecha_desde', 'fecha_hasta', 'desde', 'hasta')
+    )
+
+
+def consulta_materializados(dentista_ids, desde, hasta):
+    """Claves (dentista, fecha, hora) de los slots ya creados en [desde, hasta]."""
+    return SlotAgenda.objects.filter(dentista_id__in=dentista_ids, fecha__range=(desde, hasta)).values_list(
+        'dentista_id', 'fecha', 'hora')
+
+
+def consulta_sobrecupos(dentista_ids, desde, hasta):
+    """Filas (dentista, fecha, sobrecupos usados) del libro `SobrecupoDia` en [desde, hasta]."""
+    return SobrecupoDia.objects.filter(dentista_id__in=dentista_ids, fecha__range=(desde, hasta)).values_list(
+        'dentista_id', 'fecha', 'sobrecupos_usados')
+
+
+class Plantillas:
+    """Plantillas y excepciones vigentes en [desde, hasta] de un conjunto de dentistas, cargadas una vez.
+
+    Sin plantillas no se hace ninguna otra consulta. Las excepciones (de toda la clínica, de
+    los dentistas con plantilla y de `dentista_ids`) se cargan la primera vez que se consultan;
+    las claves de los slots ya materializados y el libro de sobrecupos (para las filas
+    virtuales), al pedir la primera fila de un día: desde ese día hasta `hasta`, o solo
+    `ventana` días si se indica (un recorrido por fecha que corta temprano no carga el resto).
+    """
+
+    def __init__(self, desde, hasta, dentista_ids=None, region_id=None, ventana=None):
+        self.desde, self.hasta = desde, hasta
+        self._ventana = ventana
+        self._dentista_ids = list(dentista_ids or ())
+
+        # dentista → día de la semana → [(horas, capacidad, max_overbook, vigente_desde, vigente_hasta)]
+        self._semana = {}
+        self._max_dia = {}
+        for dentista_id, dia, h_desde, h_hasta, capacidad, max_overbook, v_desde, v_hasta, max_dia in (
+            consulta_plantillas(desde, hasta, dentista_ids, region_id)
+        ):
+            self._semana.setdefault(dentista_id, {}).setdefault(dia, []).append(
+                (_horas(h_desde, h_hasta), capacidad, max_overbook, v_desde, v_hasta)
+            )
+            self._max_dia[dentista_id] = max_dia
+
+        self._excepciones = None
+        self._materializados = None
+        self._usados = None
+        self._estado_desde = self._estado_hasta = None
+
+    @property
+    def dentistas(self):
+        """IDs de los dentistas con plantilla, ordenados."""
+        return sorted(self._semana)
+
+    def tiene(self, dentista_id):
+        return dentista_id in self._semana
+
+    def _excluida(self, dentista_id, fecha, hora):
+        if self._excepciones is None:
+            self._excepciones = list(
+                consulta_excepciones(self.desde, self.hasta, {*self._semana, *self._dentista_ids})
+            )
+        for excepcion_dentista, f_desde, f_hasta, h_desde, h_hasta in self._excepciones:
+            if excepcion_dentista not in (None, dentista_id) or not f_desde <= fecha <= f_hasta:
+                continue
+            if h_desde is None or h_desde <= hora <= h_hasta:
+                return True
+        return False
+
+    def bloques(self, dentista_id, fecha):
+        """{hora: (capacidad, max_overbook)} de los bloques de plantilla del día, sin los exceptuados."""
+        bloques = {}
+        for horas, capacidad, max_overbook, v_desde, v_hasta in self._semana.get(dentista_id, {}).get(fecha.weekday(), ()):
+            if (v_desde and fecha < v_desde) or (v_hasta and fecha > v_hasta):
+                continue
+            for hora in horas:
+                if hora not in bloques and not self._excluida(dentista_id, fecha, hora):
+                    bloques[hora] = (capacidad, max_overbook)
+        return bloques
+
+    def parametros(self, dentista_id, fecha, hora, ad_hoc=False):
+        """(capacidad, max_overbook) del bloque según la plantilla, o None si no se atiende.
+
+        Con `ad_hoc`, un dentista sin plantillas (que debe estar en `dentista_ids`) atiende
+        con `CAPACIDAD_AD_HOC` cualquier bloque que no esté exceptuado.
+        """
+        if dentista_id in self._semana:
+            return self.bloques(dentista_id, fecha).get(hora)
+        if ad_hoc and not self._excluida(dentista_id, fecha, hora):
+            return CAPACIDAD_AD_HOC
+        return None
+
+    def _cargar_estado(self, fecha):
+        desde = fecha
+        hasta = self.hasta
+        if self._ventana is not None:
+            hasta = min(hasta, fecha + datetime.timedelta(days=self._ventana - 1))
+        ids = self.dentistas
+        self._materializados = set(consulta_materializados(ids, desde, hasta))
+        self._usados = {
+            (dentista_id, fecha): usados
+            for dentista_id, fecha, usados in consulta_sobrecupos(ids, desde, hasta)
+        }
+        self._estado_desde, self._estado_hasta = desde, hasta
+
+    def filas_dia(self, dentista_id, fecha, hora_minima=None):
+        """Filas virtuales (forma de `disponibilidad.COLUMNAS`) de un dentista y día, ordenadas por hora."""
+        if self._materializados is None or not self._estado_desde <= fecha <= self._estado_hasta:
+            self._cargar_estado(fecha)
+        usados = self._usados.get((dentista_id, fecha), 0)
+        max_dia = self._max_dia[dentista_id]
+        return [
+            (dentista_id, fecha, hora, capacidad, max_overbook, 0, 0, max_dia, usados)
+            for hora, (capacidad, max_overbook) in sorted(self.bloques(dentista_id, fecha).items())
+            if (dentista_id, fecha, hora) not in self._materializados and (hora_minima is None or hora >= hora_minima)
+        ]
+
+    def filas(self):
+        """Todas las filas virtuales del rango, ordenadas por dentista, fecha y hora."""
+        if not self._semana:
+            return
+        for dentista_id in self.dentistas:
+            for fecha in _fechas(self.desde, self.hasta):
+                yield from self.filas_dia(dentista_id, fecha)
+
+    def filas_por_hora(self, hora_minima=None):
+        """Filas virtuales del rango desde (desde, hora_minima), ordenadas por fecha, hora y -dentista.
+
+        Es la clave de los listados de slots. Se calculan día por día, así que un consumidor que
+        corta temprano no recorre el resto del rango.
+        """
+        if not self._semana:
+            return
+        for fecha in _fechas(self.desde, self.hasta):
+            minima = hora_minima if fecha == self.desde else None
+            filas = [fila for dentista_id in self.dentistas for fila in self.filas_dia(dentista_id, fecha, minima)]
+            yield from sorted(filas, key=lambda f: (f[2], -f[0]))
+
+    def flujo(self, dentista_id, desde, hora_minima=None):
+        """Filas virtuales de un dentista desde (desde, hora_minima), día por día (perezoso)."""
+        if dentista_id not in self._semana:
+            return
+        for fecha in _fechas(desde, self.hasta):
+            yield from self.filas_dia(dentista_id, fecha, hora_minima if fecha == desde else None)
+
+
+def materializar_slots(dentista_id, fecha, horas, servicio=None, ad_hoc=True):
+    """{hora: SlotAgenda} de las `horas` de un dentista y día, creando los slots que falten.
+
+    Un slot que falta se crea con la capacidad y los sobrecupos de la plantilla que cubre su
+    hora. Si el dentista no tiene plantillas y `ad_hoc`, se crea con capacidad 1 y sin
+    sobrecupos (como antes de las plantillas). Las horas que no se atienden (fuera de la
+    plantilla o cubiertas por una `ExcepcionAgenda`) no se crean y
+    quedan fuera del resultado. Los slots se crean con `get_or_create` (pasan por `save()`,
+    sus validaciones y señales).
+    """
+    slots = {s.hora: s for s in SlotAgenda.objects.filter(dentista_id=dentista_id, fecha=fecha, hora__in=horas)}
+    faltantes = [hora for hora in horas if hora not in slots]
+    if not faltantes:
+        return slots
+    plantillas = Plantillas(fecha, fecha, dentista_ids=[dentista_id])
+    for hora in faltantes:
+        parametros = plantillas.parametros(dentista_id, fecha, hora, ad_hoc=ad_hoc)
+        if parametros is None:
+            continue
+        capacidad, max_overbook = parametros
+        slots[hora], _ = SlotAgenda.objects.get_or_create(
+            dentista_id=dentista_id, fecha=fecha, hora=hora,
+            defaults={'servicio': servicio, 'capacidad': capacidad, 'max_overbook': max_overbook},
+        )
+    return slots
@@ -0,0 +1,392 @@
+"""Admisión de reservas sobre un `SlotAgenda`.
+
+Lógica transaccional común en clínicas:
+
+- Si el slot tiene capacidad normal disponible → reserva normal (sobrecupo=False).
+- Si está lleno → sobrecupo solo si el slot (`max_overbook`) y el dentista
+  (`max_overbook_day`) lo permiten.
+
+La ocupación se lee de los contadores desnormalizados de `SlotAgenda`
+(`reservas_normales` / `reservas_sobrecupo`) bajo un bloqueo de la fila del slot,
+en vez de contar las reservas en cada intento. El límite diario del dentista se
+controla con el libro `SobrecupoDia`.
+
+Un servicio de más de 30 minutos ocupa el tramo de slots consecutivos que cubre su
+duración (ver `_admitir_tramo`). Un slot cubierto por una `ExcepcionAgenda` no admite
+reservas nuevas.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .cache import get_cache
+from .models import SlotAgenda, Reserva, SobrecupoDia, Paciente, Servicio, Dentista, validar_hora_slot
+from .models import excepcion_vigente
+from .revisiones import incrementar_dias
+from .plantillas import Plantillas, materializar_slots, MENSAJE_FUERA_DE_HORARIO
+from .tracing import fase
+
+
+class ReservaRechazada(Exception):
+    """La reserva no puede admitirse (slot lleno y sin sobrecupos disponibles)."""
+
+
+MENSAJE_SLOT_LLENO = 'El slot está lleno y no se permiten sobrecupos adicionales.'
+MENSAJE_SIN_TRAMO = 'No hay slots consecutivos suficientes para la duración del servicio.'
+
+# Duración de cada SlotAgenda
+MINUTOS_BLOQUE = 30
+
+# Modos de admisión (settings.AGENDA_RESERVA_MODO)
+MODO_BLOQUEO = 'bloqueo'
+MODO_OPTIMISTA = 'optimista'
+
+
+def bloques_servicio(servicio):
+    """Número de slots consecutivos que ocupa una reserva de `servicio` (1 sin servicio)."""
+    if servicio is None or not servicio.duracion_min:
+        return 1
+    return max(1, -(-servicio.duracion_min // MINUTOS_BLOQUE))
+
+
+def horas_tramo(hora, bloques):
+    """Horas de inicio de los `bloques` slots consecutivos que empiezan en `hora`."""
+    inicio = datetime.datetime.combine(datetime.date.min, hora)
+    return [(inicio + datetime.timedelta(minutes=MINUTOS_BLOQUE * i)).time() for i in range(bloques)]
+
+
+def _crear_reserva(slot, paciente, servicio, sobrecupo, libro=None, continuacion=()):
+    campo = 'reservas_sobrecupo' if sobrecupo else 'reservas_normales'
+    try:
+        with transaction.atomic():
+            reserva = Reserva.objects.create(slot=slot, paciente=paciente, servicio=servicio, sobrecupo=sobrecupo)
+    except IntegrityError:
+        # Si falla por constraint único, buscar la reserva existente
+        existing_reserva = Reserva.objects.filter(slot=slot, paciente=paciente).first()
+        if existing_reserva:
+            return existing_reserva
+        raise
+    SlotAgenda.objects.filter(pk__in=[slot.pk, *(s.pk for s in continuacion)]).update(**{campo: F(campo) + 1})
+    if continuacion:
+        reserva.slots_continuacion.add(*continuacion)
+    if libro is not None:
+        SobrecupoDia.objects.filter(pk=libro.pk).update(sobrecupos_usados=F('sobrecupos_usados') + 1)
+    reserva._creada = True
+    return reserva
+
+
+def admitir_reserva(slot, paciente, servicio=None):
+    """Admite una reserva de `paciente` en `slot`. Lanza `ReservaRechazada` si no hay cupo.
+
+    El modo se elige con `settings.AGENDA_RESERVA_MODO`:
+
+    - ``'bloqueo'`` (por defecto): transacción con `select_for_update` sobre el slot.
+    - ``'optimista'``: reclama la capacidad normal con un UPDATE condicional, sin bloqueo
+      previo; solo si el UPDATE no afecta filas (slot lleno o en conflicto) se recurre al
+      camino con bloqueo, que además resuelve los sobrecupos.
+
+    Las reservas de servicios que ocupan varios slots usan siempre el camino con bloqueo.
+    """
+    bloques = bloques_servicio(servicio)
+    if bloques > 1:
+        return _admitir_tramo(slot, paciente, servicio, bloques)
+    if getattr(settings, 'AGENDA_RESERVA_MODO', MODO_BLOQUEO) == MODO_OPTIMISTA:
+        reserva = _admitir_optimista(slot, paciente, servicio)
+        if reserva is not None:
+            return reserva
+    return _admitir_con_bloqueo(slot, paciente, servicio)
+
+
+def slots_bloqueados():
+    """Slots que bloquea la admisión (`select_for_update`), con su dentista y si están exceptuados."""
+    return SlotAgenda.objects.select_for_update().select_related('dentista').annotate(exceptuado=excepcion_vigente())
+
+
+def reclamo_optimista(slot_pk):
+    """Filas que el UPDATE de `_admitir_optimista` puede reclamar: el slot, si no está lleno ni exceptuado."""
+    return SlotAgenda.objects.sin_excepcion().filter(pk=slot_pk, reservas_normales__lt=F('capacidad'))
+
+
+def _admitir_optimista(slot, paciente, servicio):
+    """Reclama un cupo normal con un único UPDATE condicional. Devuelve None si no lo consigue.
+
+    UPDATE agenda_slotagenda SET reservas_normales = reservas_normales + 1
+     WHERE id = %s AND reservas_normales < capacidad
+
+    El número de filas afectadas indica si se obtuvo el cupo. Si el INSERT de la reserva falla
+    por el unique (slot, paciente) se revierte el reclamo y se devuelve la reserva existente.
+    """
+    try:
+        with transaction.atomic():
+            with fase('claim'):
+                reclamado = reclamo_optimista(slot.pk).update(reservas_normales=F('reservas_normales') + 1)
+            if not reclamado:
+                return None
+            with fase('insert'):
+                reserva = Reserva.objects.create(slot=slot, paciente=paciente, servicio=servicio, sobrecupo=False)
+            reserva._creada = True
+            return reserva
+    except IntegrityError:
+        existing_reserva = Reserva.objects.filter(slot=slot, paciente=paciente).first()
+        if existing_reserva:
+            return existing_reserva
+        raise
+
+
+def _admitir_con_bloqueo(slot, paciente, servicio):
+    with transaction.atomic():
+        # Primero verificar si ya existe esta reserva exacta
+        with fase('lookup'):
+            existing_reserva = Reserva.objects.filter(slot=slot, paciente=paciente).first()
+        if existing_reserva:
+            # Si ya existe, retornar la existente en lugar de crear una nueva
+            return existing_reserva
+
+        # Bloquear solo la fila del slot: los contadores son el punto de serialización
+        with fase('lock'):
+            slot = slots_bloqueados().get(pk=slot.pk)
+        if slot.exceptuado:
+            raise ReservaRechazada(MENSAJE_FUERA_DE_HORARIO)
+        if slot.reservas_normales < slot.capacidad:
+            with fase('insert'):
+                return _crear_reserva(slot, paciente, servicio, sobrecupo=False)
+
+        # Si capacidad alcanzada, permitir sobrecupo si el slot y el dentista lo permiten
+        if slot.reservas_sobrecupo < slot.max_overbook:
+            with fase('count'):
+                libro = _bloquear_sobrecupo_dia(slot)
+            if libro is not None:
+                with fase('insert'):
+                    return _crear_reserva(slot, paciente, servicio, sobrecupo=True, libro=libro)
+
+        raise ReservaRechazada(MENSAJE_SLOT_LLENO)
+
+
+def _admitir_tramo(slot, paciente, servicio, bloques):
+    """Admite una reserva que ocupa `bloques` slots consecutivos desde `slot` (mismo dentista y día).
+
+    Los slots del tramo se bloquean con una sola consulta en orden ascendente de hora: todas
+    las admisiones toman los bloqueos en el mismo orden (slots por hora → libro diario), así
+    que dos tramos que se solapan se esperan en vez de bloquearse mutuamente. La reserva es
+    normal si todos los slots tienen capacidad normal, o sobrecupo si todos admiten uno más y
+    al dentista le quedan sobrecupos en el día; el contador se incrementa en todo el tramo.
+    Los slots de continuación que falten se materializan desde la plantilla del dentista.
+    """
+    with transaction.atomic():
+        with fase('lookup'):
+            existing_reserva = Reserva.objects.filter(slot=slot, paciente=paciente).first()
+        if existing_reserva:
+            return existing_reserva
+
+        horas = horas_tramo(slot.hora, bloques)
+        consulta = (
+            slots_bloqueados().filter(dentista_id=slot.dentista_id, fecha=slot.fecha, hora__in=horas).order_by('hora')
+        )
+        with fase('lock'):
+            tramo = list(consulta)
+        if len(tramo) < bloques:
+            with fase('slot'):
+                # Reserva por `slot`: solo la plantilla completa el tramo. Las reservas por
+                # dentista/fecha/hora ya llegan con el tramo creado (serializer y `admitir_lote`)
+                materializar_slots(slot.dentista_id, slot.fecha, horas, servicio=servicio, ad_hoc=False)
+            with fase('lock'):
+                tramo = list(consulta)
+        if len(tramo) < bloques:
+            raise ReservaRechazada(MENSAJE_SIN_TRAMO)
+        if tramo[0].exceptuado:
+            raise ReservaRechazada(MENSAJE_FUERA_DE_HORARIO)
+        if any(s.exceptuado for s in tramo):
+            raise ReservaRechazada(MENSAJE_SIN_TRAMO)
+        inicio, continuacion = tramo[0], tramo[1:]
+        if all(s.reservas_normales < s.capacidad for s in tramo):
+            with fase('insert'):
+                return _crear_reserva(inicio, paciente, servicio, sobrecupo=False, continuacion=continuacion)
+
+        if all(s.reservas_sobrecupo < s.max_overbook for s in tramo):
+            with fase('count'):
+                libro = _bloquear_sobrecupo_dia(inicio)
+            if libro is not None:
+                with fase('insert'):
+                    return _crear_reserva(inicio, paciente, servicio, sobrecupo=True, libro=libro,
+                                          continuacion=continuacion)
+
+        raise ReservaRechazada(MENSAJE_SLOT_LLENO)
+
+
+def _bloquear_sobrecupo_dia(slot):
+    """Bloquea el libro diario del dentista y lo devuelve si aún queda algún sobrecupo.
+
+    Lectura-modificación-escritura sobre una única fila bloqueada: reservas concurrentes de
+    otros dentistas (u otros días) no compiten por este bloqueo. Debe llamarse dentro de la
+    transacción de la admisión, después de bloquear el slot (orden de bloqueo: slot → libro).
+    """
+    dentista = slot.dentista
+    if not dentista.max_overbook_day:
+        return None
+    libro, _ = SobrecupoDia.objects.select_for_update().get_or_create(dentista=dentista, fecha=slot.fecha)
+    if libro.sobrecupos_usados >= dentista.max_overbook_day:
+        return None
+    return libro
+
+
+def liberar_cupo(reserva):
+    """Descuenta la reserva eliminada de los contadores de su slot (y del libro diario si era sobrecupo).
+
+    Los slots de continuación se leen antes del borrado (`_slots_continuacion`, ver
+    `signals.reserva_por_eliminar`): en el post_delete la tabla intermedia ya está vacía.
+    """
+    campo = 'reservas_sobrecupo' if reserva.sobrecupo else 'reservas_normales'
+    slots = [reserva.slot_id, *getattr(reserva, '_slots_continuacion', ())]
+    SlotAgenda.objects.filter(pk__in=slots, **{f'{campo}__gt': 0}).update(**{campo: F(campo) - 1})
+    if reserva.sobrecupo:
+        slot = SlotAgenda.objects.filter(pk=reserva.slot_id).values('dentista_id', 'fecha').first()
+        if slot:
+            SobrecupoDia.objects.filter(
+                dentista_id=slot['dentista_id'], fecha=slot['fecha'], sobrecupos_usados__gt=0,
+            ).update(sobrecupos_usados=F('sobrecupos_usados') - 1)
+
+
+def admitir_lote(items):
+    """Admite un lote de reservas ya validadas resolviendo todas las referencias por adelantado.
+
+    Cada item es un dict con `paciente`, `servicio` (opcional) y `slot` o bien
+    `dentista` + `fecha` + `hora_inicio`. Pacientes, servicios, dentistas y slots se
+    cargan con unas pocas consultas `in_bulk`; los slots inexistentes se crean en bloque.
+    Las reservas se admiten en orden de slot (cada una en su propia transacción) y el
+    resultado es una lista, en el orden de entrada, de ``(reserva, creada, None)`` o
+    ``(None, False, error)``; `creada` es False si el paciente ya tenía esa reserva.
+    """
+    pacientes = Paciente.objects.in_bulk({item['paciente'] for item in items})
+    servicios = Servicio.objects.in_bulk({item['servicio'] for item in items if item.get('servicio')})
+    slots = SlotAgenda.objects.in_bulk({item['slot'] for item in items if item.get('slot')})
+
+    resultados = [None] * len(items)
+    pendientes = []
+    por_clave = []
+    for indice, item in enumerate(items):
+        paciente = pacientes.get(item['paciente'])
+        if paciente is None:
+            resultados[indice] = (None, False, f"Paciente con ID {item['paciente']} no existe")
+            continue
+        servicio = None
+        if item.get('servicio'):
+            servicio = servicios.get(item['servicio'])
+            if servicio is None:
+                resultados[indice] = (None, False, f"Servicio con ID {item['servicio']} no existe")
+                continue
+        if item.get('slot'):
+            slot = slots.get(item['slot'])
+            if slot is None:
+                resultados[indice] = (None, False, f"Slot con ID {item['slot']} no existe")
+                continue
+            pendientes.append((slot.pk, indice, slot, paciente, servicio))
+        else:
+            por_clave.append((indice, item, paciente, servicio))
+
+    resueltos = _resolver_slots_por_clave([(indice, item, servicio) for indice, item, _, servicio in por_clave])
+    for indice, _, paciente, servicio in por_clave:
+        slot = resueltos[indice]
+        if isinstance(slot, str):
+            resultados[indice] = (None, False, slot)
+            continue
+        pendientes.append((slot.pk, indice, slot, paciente, servicio))
+
+    # Orden estable por slot: las admisiones sobre el mismo slot quedan contiguas y los
+    # bloqueos se toman siempre en el mismo orden
+    pendientes.sort(key=lambda p: (p[0], p[1]))
+    for _, indice, slot, paciente, servicio in pendientes:
+        try:
+            reserva = admitir_reserva(slot, paciente, servicio)
+            resultados[indice] = (reserva, getattr(reserva, '_creada', False), None)
+        except ReservaRechazada as e:
+            resultados[indice] = (None, False, str(e))
+        except IntegrityError:
+            resultados[indice] = (None, False, 'No se pudo crear la reserva.')
+    return resultados
+
+
+def _resolver_slots_por_clave(items):
+    """{indice: slot de inicio o mensaje de error} de los items ``(indice, item, servicio)`` sin `slot`.
+
+    Resuelve el tramo completo de cada item (`horas_tramo` según la duración del servicio) y
+    crea en bloque los slots que falten con la misma regla que la reserva individual
+    (`materializar_slots`): capacidad y sobrecupos de la plantilla del dentista, o capacidad
+    1 sin sobrecupos si no tiene plantillas. Un tramo con alguna hora inválida o fuera de la
+    plantilla no crea ninguno de sus slots.
+    """
+    if not items:
+        return {}
+    dentistas = Dentista.objects.in_bulk({item['dentista'] for _, item, _ in items})
+    resueltos = {}
+    tramos = {}
+    for indice, item, servicio in items:
+        dentista_id, fecha, hora = item['dentista'], item['fecha'], item['hora_inicio']
+        if dentista_id not in dentistas:
+            resueltos[indice] = f'Dentista con ID {dentista_id} no existe'
+            continue
+        try:
+            validar_hora_slot(hora)
+        except ValidationError as e:
+            resueltos[indice] = ' '.join(e.messages)
+            continue
+        horas = horas_tramo(hora, bloques_servicio(servicio))
+        try:
+            for continuacion in horas[1:]:
+                validar_hora_slot(continuacion)
+        except ValidationError:
+            resueltos[indice] = MENSAJE_SIN_TRAMO
+            continue
+        tramos[indice] = ([(dentista_id, fecha, h) for h in horas], servicio)
+
+    claves = {clave for tramo, _ in tramos.values() for clave in tramo}
+    slots = {}
+
+    def cargar():
+        existentes = SlotAgenda.objects.filter(
+            dentista_id__in={c[0] for c in claves},
+            fecha__in={c[1] for c in claves},
+            hora__in={c[2] for c in claves},
+        )
+        for slot in existentes:
+            clave = (slot.dentista_id, slot.fecha, slot.hora)
+            if clave in claves:
+                slots[clave] = slot
+
+    if claves:
+        cargar()
+    faltantes = claves - slots.keys()
+    if faltantes:
+        fechas = [fecha for _, fecha, _ in faltantes]
+        plantillas = Plantillas(min(fechas), max(fechas), dentista_ids=list({c[0] for c in faltantes}))
+        parametros = {
+            (dentista_id, fecha, hora): plantillas.parametros(dentista_id, fecha, hora, ad_hoc=True)
+            for dentista_id, fecha, hora in faltantes
+        }
+        nuevos = {}
+        for indice, (tramo, servicio) in tramos.items():
+            fuera = [clave for clave in tramo if clave in parametros and parametros[clave] is None]
+            if fuera:
+                resueltos[indice] = MENSAJE_FUERA_DE_HORARIO if fuera[0] == tramo[0] else MENSAJE_SIN_TRAMO
+                continue
+            for clave in tramo:
+                # El servicio del primer item que necesita la clave es el del slot creado (como get_or_create)
+                if clave in parametros and clave not in nuevos:
+                    dentista_id, fecha, hora = clave
+                    capacidad, max_overbook = parametros[clave]
+                    nuevos[clave] = SlotAgenda(
+                        dentista_id=dentista_id, fecha=fecha, hora=hora, servicio=servicio,
+                        capacidad=capacidad, max_overbook=max_overbook,
+                    )
+        SlotAgenda.objects.bulk_create(list(nuevos.values()), ignore_conflicts=True)
+        # bulk_create no emite señales: versionar e invalidar la caché de cada día tocado (después
+        # del INSERT, así una lectura intermedia queda con el sello anterior)
+        dias = sorted({(dentista_id, fecha) for dentista_id, fecha, _ in nuevos})
+        incrementar_dias(dias)
+        get_cache().invalidar_dias(dias)
+        cargar()
+    for indice, (tramo, _) in tramos.items():
+        resueltos.setdefault(indice, slots.get(tramo[0], MENSAJE_SIN_TRAMO))
+    return resueltos
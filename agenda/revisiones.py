@@ -0,0 +1,143 @@
+"""Sellos de versión por recurso para respuestas condicionales (ETag / Last-Modified).
+
+Cada recurso de lectura tiene una fila `RevisionRecurso` que se incrementa con cada
+escritura sobre sus modelos (señales en `agenda.signals` y `generate_slots_bulk`):
+
+- ``slots:<fecha>:<dentista_id>``: slots y reservas de un dentista en un día. La vista
+  del día para todos los dentistas no tiene fila propia: su sello reúne las filas
+  ``slots:<fecha>:*`` (un rango del índice único), así que una reserva solo actualiza la
+  fila de su dentista y las reservas del mismo día en otros dentistas no compiten por ella.
+- ``agenda``: cambios que afectan a todos los días (nombres de dentistas, servicios o
+  pacientes, plantillas horarias y excepciones, reparación de contadores).
+- ``dentistas``, ``servicios``, ``regiones``: catálogos de los endpoints del router.
+
+`respuesta_condicional` compara el sello con `If-None-Match`/`If-Modified-Since` y
+responde 304 antes de ejecutar la consulta principal y el serializer. El sello se lee
+de la base en cada petición (nunca de la caché de disponibilidad, que es por proceso);
+la caché guarda los cuerpos junto al sello con que se calcularon.
+"""
+import hashlib
+
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import RevisionRecurso
+
+GLOBAL = 'agenda'
+DENTISTAS = 'dentistas'
+SERVICIOS = 'servicios'
+REGIONES = 'regiones'
+
+# Recursos por sentencia al incrementar muchos días (generación masiva de slots)
+LOTE = 500
+
+
+def recurso_slots(dentista_id, fecha):
+    return f'slots:{fecha.isoformat()}:{dentista_id}'
+
+
+def consulta_dia(dentista_id, fecha):
+    """Filas `RevisionRecurso` de las que depende la vista de un día (de un dentista o de todos)."""
+    if dentista_id is not None:
+        filtro = Q(recurso=recurso_slots(dentista_id, fecha))
+    else:
+        # 'slots:<fecha>:' < recurso < 'slots:<fecha>;' (';' sigue a ':' en ASCII)
+        prefijo = f'slots:{fecha.isoformat()}:'
+        filtro = Q(recurso__gt=prefijo, recurso__lt=prefijo[:-1] + ';')
+    return RevisionRecurso.objects.filter(filtro | Q(recurso=GLOBAL))
+
+
+def incrementar(recursos):
+    """Incrementa la versión de cada recurso (creándolo si no existía)."""
+    recursos = sorted(set(recursos))
+    ahora = timezone.now()
+    for i in range(0, len(recursos), LOTE):
+        lote = recursos[i:i + LOTE]
+        qs = RevisionRecurso.objects.filter(recurso__in=lote)
+        if qs.update(version=F('version') + 1, actualizado=ahora) == len(lote):
+            continue
+        # Crear los que faltan en la versión 0 y volver a incrementar el lote: si otra transacción
+        # los creó a la vez, el conflicto se ignora pero el incremento no se pierde (a los que ya
+        # existían les toca un incremento de más, que es inocuo: el sello solo tiene que cambiar).
+        RevisionRecurso.objects.bulk_create(
+            [RevisionRecurso(recurso=recurso, version=0, actualizado=ahora) for recurso in lote],
+            ignore_conflicts=True,
+        )
+        qs.update(version=F('version') + 1, actualizado=ahora)
+
+
+def incrementar_dias(pares):
+    """Incrementa el recurso de cada (dentista_id, fecha)."""
+    incrementar(recurso_slots(dentista_id, fecha) for dentista_id, fecha in pares)
+
+
+def _consulta_estado(recursos):
+    return RevisionRecurso.objects.filter(recurso__in=recursos).values_list('recurso', 'version', 'actualizado')
+
+
+def _filas_estado(consulta):
+    return consulta.values_list('recurso', 'version', 'actualizado')
+
+
+def _sellar(recursos, filas):
+    versiones = dict.fromkeys(recursos, 0)
+    ultima = None
+    for recurso, version, actualizado in filas:
+        versiones[recurso] = version
+        ultima = actualizado if ultima is None else max(ultima, actualizado)
+    sello = ';'.join(f'{recurso}={version}' for recurso, version in sorted(versiones.items()))
+    return sello, ultima
+
+
+def estado(recursos):
+    """(sello, última modificación) de un conjunto de recursos; los que nunca cambiaron cuentan como versión 0."""
+    recursos = sorted(set(recursos))
+    return _sellar(recursos, _consulta_estado(recursos))
+
+
+async def aestado(recursos):
+    """Variante async de `estado`."""
+    recursos = sorted(set(recursos))
+    return _sellar(recursos, [fila async for fila in _consulta_estado(recursos)])
+
+
+def estado_dia(fecha, dentista_id=None):
+    """`estado` de la vista de un día (de un dentista o de todos), leído de la base en una consulta."""
+    return _sellar([GLOBAL], _filas_estado(consulta_dia(dentista_id, fecha)))
+
+
+async def aestado_dia(fecha, dentista_id=None):
+    """Variante async de `estado_dia`."""
+    return _sellar([GLOBAL], [fila async for fila in _filas_estado(consulta_dia(dentista_id, fecha))])
+
+
+def _condicional(request, estado_recursos):
+    """(etag, last_modified, respuesta 304/412 o None) para `estado_recursos`."""
+    sello, ultima = estado_recursos
+    # El JSON y la API navegable son representaciones distintas del mismo recurso
+    formato = getattr(getattr(request, 'accepted_renderer', None), 'format', '')
+    etag = quote_etag(hashlib.md5(f'{sello}|{formato}'.encode(), usedforsecurity=False).hexdigest())
+    last_modified = int(ultima.timestamp()) if ultima else None
+    return etag, last_modified, get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def _con_cabeceras(respuesta, etag, last_modified):
+    if respuesta.status_code in (200, 304):
+        respuesta['ETag'] = etag
+        if last_modified is not None:
+            respuesta['Last-Modified'] = http_date(last_modified)
+    return respuesta
+
+
+def respuesta_condicional(request, estado_recursos, generar):
+    """Responde 304 si el cliente ya tiene la versión vigente; si no, `generar()` con `ETag` y `Last-Modified`."""
+    etag, last_modified, respuesta = _condicional(request, estado_recursos)
+    return _con_cabeceras(respuesta or generar(), etag, last_modified)
+
+
+async def arespuesta_condicional(request, estado_recursos, agenerar):
+    """Variante async de `respuesta_condicional`: `agenerar()` es una corrutina."""
+    etag, last_modified, respuesta = _condicional(request, estado_recursos)
+    return _con_cabeceras(respuesta or await agenerar(), etag, last_modified)
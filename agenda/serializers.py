@@ -1,15 +1,85 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
-from django.db import IntegrityError
-from .models import SlotAgenda, Reserva, Servicio, Dentista, Paciente, Region
+from .models import SlotAgenda, Reserva, Servicio, Dentista, Paciente, Region, normalizar_rut, formatear_rut
+from .models import PlantillaHorario, ExcepcionAgenda, ReservaArchivo
+from .models import validar_hora_slot
+from .plantillas import materializar_slots, MENSAJE_FUERA_DE_HORARIO
+from .reservas import admitir_reserva, bloques_servicio, horas_tramo, ReservaRechazada, MENSAJE_SIN_TRAMO
+from .tracing import traza, fase
 
 
 class SlotAgendaSerializer(serializers.ModelSerializer):
+    dentista_id = serializers.IntegerField(read_only=True)
     dentista = serializers.StringRelatedField()
     servicio = serializers.StringRelatedField()
 
     class Meta:
         model = SlotAgenda
-        fields = ('id', 'dentista', 'servicio', 'fecha', 'hora', 'capacidad', 'max_overbook')
+        fields = ('id', 'dentista_id', 'dentista', 'servicio', 'fecha', 'hora', 'capacidad', 'max_overbook',
+                  'reservas_normales', 'reservas_sobrecupo')
+
+
+def proyectar_slots(queryset):
+    """Proyección `values()` de los listados de slots (una sola consulta con JOIN a dentista y servicio)."""
+    return queryset.values(
+        'id', 'dentista_id', 'fecha', 'hora', 'capacidad', 'max_overbook', 'reservas_normales', 'reservas_sobrecupo',
+        'dentista__nombre', 'dentista__apellido', 'dentista__especialidad', 'servicio__nombre',
+    )
+
+
+def serializar_slots(queryset):
+    """Serializa slots con la misma forma JSON que `SlotAgendaSerializer`, sin instanciar modelos.
+
+    Usa una proyección `values()` con las etiquetas de dentista y servicio unidas en la misma
+    consulta, evitando el N+1 de los `StringRelatedField` y la maquinaria de campos por instancia.
+    """
+    return [fila_slot(f) for f in proyectar_slots(queryset)]
+
+
+def fila_slot(f):
+    """Fila de `proyectar_slots` → dict con la forma JSON de `SlotAgendaSerializer`."""
+    return {
+        'id': f['id'],
+        'dentista_id': f['dentista_id'],
+        # Mismo texto que Dentista.__str__ / Servicio.__str__
+        'dentista': f"{f['dentista__nombre']} {f['dentista__apellido']} - {f['dentista__especialidad']}",
+        'servicio': f['servicio__nombre'],
+        'fecha': f['fecha'].isoformat(),
+        'hora': f['hora'].isoformat(),
+        'capacidad': f['capacidad'],
+        'max_overbook': f['max_overbook'],
+        'reservas_normales': f['reservas_normales'],
+        'reservas_sobrecupo': f['reservas_sobrecupo'],
+    }
+
+
+def serializar_virtuales(plantillas, filas):
+    """Filas virtuales de `plantillas` → dicts con la forma de `fila_slot`, `id` None y sin servicio (perezoso).
+
+    Las etiquetas de los dentistas se consultan al llegar a la primera fila.
+    """
+    etiquetas = None
+    for dentista_id, fecha, hora, capacidad, max_overbook, normales, sobrecupos, _, _ in filas:
+        if etiquetas is None:
+            etiquetas = Dentista.objects.in_bulk(plantillas.dentistas)
+        dentista = etiquetas[dentista_id]
+        yield fila_slot({
+            'id': None, 'dentista_id': dentista_id, 'fecha': fecha, 'hora': hora,
+            'capacidad': capacidad, 'max_overbook': max_overbook,
+            'reservas_normales': normales, 'reservas_sobrecupo': sobrecupos,
+            'dentista__nombre': dentista.nombre, 'dentista__apellido': dentista.apellido,
+            'dentista__especialidad': dentista.especialidad, 'servicio__nombre': None,
+        })
+
+
+def validar_slot_o_clave(data):
+    # Si no se proporciona slot, se debe proporcionar dentista, fecha y hora_inicio
+    if not data.get('slot'):
+        if not all([data.get('dentista'), data.get('fecha'), data.get('hora_inicio')]):
+            raise serializers.ValidationError(
+                "Se debe proporcionar 'slot' o los campos 'dentista', 'fecha' y 'hora_inicio'"
+            )
+    return data
 
 
 class ReservaCreateSerializer(serializers.Serializer):
@@ -25,126 +95,99 @@ class ReservaCreateSerializer(serializers.Serializer):
     observaciones = serializers.CharField(required=False, allow_blank=True)
 
     def validate(self, data):
-        # Si no se proporciona slot, se debe proporcionar dentista, fecha y hora_inicio
-        if not data.get('slot'):
-            if not all([data.get('dentista'), data.get('fecha'), data.get('hora_inicio')]):
-                raise serializers.ValidationError(
-                    "Se debe proporcionar 'slot' o los campos 'dentista', 'fecha' y 'hora_inicio'"
-                )
-        return data
+        return validar_slot_o_clave(data)
 
     def create(self, validated_data):
-        # Debug: imprimir los datos que llegan
-        print("=== DEBUG SERIALIZER CREATE ===")
-        print("validated_data:", validated_data)
-        print("Tipos de datos:")
-        for key, value in validated_data.items():
-            print(f"  {key}: {type(value)} = {value}")
-        print("================================")
-        
+        slot = validated_data.get('slot')
+        with traza('reserva', slot=slot.pk if slot else None, paciente=validated_data.get('paciente')):
+            return self._create(validated_data)
+
+    def _create(self, validated_data):
         # Extraer campos adicionales
         dentista_id = validated_data.pop('dentista', None)
         fecha = validated_data.pop('fecha', None)
         hora_inicio = validated_data.pop('hora_inicio', None)
         observaciones = validated_data.pop('observaciones', None)
         
-        # Obtener instancias de paciente y servicio
-        paciente_data = validated_data.get('paciente')
-        servicio_id = validated_data.get('servicio')
-        
-        # Manejar si paciente es un objeto o un ID
-        if isinstance(paciente_data, Paciente):
-            paciente = paciente_data
-        else:
-            try:
-                paciente_id = int(paciente_data) if paciente_data else None
-                if not paciente_id:
-                    raise serializers.ValidationError("ID de paciente es requerido")
-                paciente = Paciente.objects.get(id=paciente_id)
-            except (ValueError, TypeError):
-                raise serializers.ValidationError(f"ID de paciente inválido: {paciente_data}")
-            except Paciente.DoesNotExist:
-                raise serializers.ValidationError(f"Paciente con ID {paciente_id} no existe")
+        with fase('lookup'):
+            # Obtener instancias de paciente y servicio
+            paciente_data = validated_data.get('paciente')
+            servicio_id = validated_data.get('servicio')
         
-        servicio = None
-        if servicio_id:
-            # Manejar si servicio es un objeto o un ID
-            if isinstance(servicio_id, Servicio):
-                servicio = servicio_id
+            # Manejar si paciente es un objeto o un ID
+            if isinstance(paciente_data, Paciente):
+                paciente = paciente_data
             else:
                 try:
-                    servicio_id_int = int(servicio_id)
-                    servicio = Servicio.objects.get(id=servicio_id_int)
+                    paciente_id = int(paciente_data) if paciente_data else None
+                    if not paciente_id:
+                        raise serializers.ValidationError("ID de paciente es requerido")
+                    paciente = Paciente.objects.get(id=paciente_id)
                 except (ValueError, TypeError):
-                    raise serializers.ValidationError(f"ID de servicio inválido: {servicio_id}")
-                except Servicio.DoesNotExist:
-                    raise serializers.ValidationError(f"Servicio con ID {servicio_id} no existe")
+                    raise serializers.ValidationError(f"ID de paciente inválido: {paciente_data}")
+                except Paciente.DoesNotExist:
+                    raise serializers.ValidationError(f"Paciente con ID {paciente_id} no existe")
         
-        # Si no hay slot, buscar o crear uno
-        slot = validated_data.get('slot')
-        if not slot and dentista_id and fecha and hora_inicio:
-            try:
-                dentista = Dentista.objects.get(id=dentista_id)
+            servicio = None
+            if servicio_id:
+                # Manejar si servicio es un objeto o un ID
+                if isinstance(servicio_id, Servicio):
+                    servicio = servicio_id
+                else:
+                    try:
+                        servicio_id_int = int(servicio_id)
+                        servicio = Servicio.objects.get(id=servicio_id_int)
+                    except (ValueError, TypeError):
+                        raise serializers.ValidationError(f"ID de servicio inválido: {servicio_id}")
+                    except Servicio.DoesNotExist:
+                        raise serializers.ValidationError(f"Servicio con ID {servicio_id} no existe")
+        
+        with fase('slot'):
+            # Si no hay slot, buscar o crear uno
+            slot = validated_data.get('slot')
+            if not slot and dentista_id and fecha and hora_inicio:
+                try:
+                    dentista = Dentista.objects.get(id=dentista_id)
                 
-                # Buscar slot existente
-                slot, created = SlotAgenda.objects.get_or_create(
-                    dentista=dentista,
-                    fecha=fecha,
-                    hora=hora_inicio,
-                    defaults={
-                        'servicio': servicio,
-                        'capacidad': 1,
-                        'max_overbook': 0
-                    }
-                )
-            except Dentista.DoesNotExist:
-                raise serializers.ValidationError(f"Dentista con ID {dentista_id} no existe")
+                    # Buscar slot existente (y los siguientes si el servicio dura más de un bloque)
+                    horas = horas_tramo(hora_inicio, bloques_servicio(servicio))
+                    for hora in horas[1:]:
+                        try:
+                            validar_hora_slot(hora)
+                        except DjangoValidationError:
+                            raise serializers.ValidationError({'detail': MENSAJE_SIN_TRAMO})
+                    try:
+                        # Los slots que falten se crean según la plantilla del dentista (o ad hoc si no tiene)
+                        slots = materializar_slots(dentista.pk, fecha, horas, servicio=servicio)
+                    except DjangoValidationError as e:
+                        raise serializers.ValidationError({'detail': ' '.join(e.messages)})
+                    slot = slots.get(hora_inicio)
+                    if slot is None:
+                        raise serializers.ValidationError({'detail': MENSAJE_FUERA_DE_HORARIO})
+                except Dentista.DoesNotExist:
+                    raise serializers.ValidationError(f"Dentista con ID {dentista_id} no existe")
         
         if not slot:
             raise serializers.ValidationError("No se pudo crear o encontrar un slot válido")
         
-        # Lógica transaccional común en clínicas: contar reservas con select_for_update
-        from django.db import transaction
-
-        with transaction.atomic():
-            # Primero verificar si ya existe esta reserva exacta
-            existing_reserva = Reserva.objects.filter(slot=slot, paciente=paciente).first()
-            if existing_reserva:
-                # Si ya existe, retornar la existente en lugar de crear una nueva
-                return existing_reserva
-            
-            reservas_actuales = slot.reservas.select_for_update().count()
-            if reservas_actuales < slot.capacidad:
-                try:
-                    return Reserva.objects.create(slot=slot, paciente=paciente, servicio=servicio, sobrecupo=False)
-                except IntegrityError:
-                    # Si falla por constraint único, buscar la reserva existente
-                    existing_reserva = Reserva.objects.filter(slot=slot, paciente=paciente).first()
-                    if existing_reserva:
-                        return existing_reserva
-                    raise
-
-            # Si capacidad alcanzada, permitir sobrecupo si el slot y el dentista lo permiten
-            sobrecupos_actuales_slot = slot.reservas.filter(sobrecupo=True).count()
-            if sobrecupos_actuales_slot < slot.max_overbook:
-                # comprobar límite diario del dentista
-                fecha = slot.fecha
-                dentista = slot.dentista
-                sobrecupos_dia = Reserva.objects.filter(slot__dentista=dentista, slot__fecha=fecha, sobrecupo=True).count()
-                if sobrecupos_dia < dentista.max_overbook_day:
-                    try:
-                        return Reserva.objects.create(slot=slot, paciente=paciente, servicio=servicio, sobrecupo=True)
-                    except IntegrityError:
-                        # Si falla por constraint único, buscar la reserva existente
-                        existing_reserva = Reserva.objects.filter(slot=slot, paciente=paciente).first()
-                        if existing_reserva:
-                            return existing_reserva
-                        raise
+        try:
+            return admitir_reserva(slot, paciente, servicio)
+        except ReservaRechazada as e:
+            raise serializers.ValidationError({'detail': str(e)})
 
-            from rest_framework import serializers as drf_serializers
-            raise drf_serializers.ValidationError({'detail': 'El slot está lleno y no se permiten sobrecupos adicionales.'})
 
+class ReservaBatchItemSerializer(serializers.Serializer):
+    """Valida un item del lote sin resolver referencias: `admitir_lote` las carga en bloque."""
+    slot = serializers.IntegerField(required=False, allow_null=True)
+    paciente = serializers.IntegerField()
+    servicio = serializers.IntegerField(required=False)
+    dentista = serializers.IntegerField(required=False)
+    fecha = serializers.DateField(required=False)
+    hora_inicio = serializers.TimeField(required=False)
+    observaciones = serializers.CharField(required=False, allow_blank=True)
 
+    def validate(self, data):
+        return validar_slot_o_clave(data)
 
 
 class RegionSerializer(serializers.ModelSerializer):
@@ -168,11 +211,55 @@ class ServicioSerializer(serializers.ModelSerializer):
         fields = ('id', 'nombre', 'duracion_min', 'precio')
 
 
+class ValidacionModeloMixin:
+    """Corre `Model.clean()` en la validación: sus errores son 400 y no llegan al `full_clean` de `save()`."""
+
+    def validate(self, data):
+        data = super().validate(data)
+        instancia = self.Meta.model(**{**self._valores_actuales(), **data})
+        try:
+            instancia.clean()
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.message_dict if hasattr(e, 'error_dict') else e.messages)
+        return data
+
+    def _valores_actuales(self):
+        if self.instance is None:
+            return {}
+        return {campo: getattr(self.instance, campo) for campo in self.Meta.fields if campo != 'id'}
+
+
+class PlantillaHorarioSerializer(ValidacionModeloMixin, serializers.ModelSerializer):
+    class Meta:
+        model = PlantillaHorario
+        fields = ('id', 'dentista', 'dia_semana', 'desde', 'hasta', 'capacidad', 'max_overbook',
+                  'vigente_desde', 'vigente_hasta')
+
+
+class ExcepcionAgendaSerializer(ValidacionModeloMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ExcepcionAgenda
+        fields = ('id', 'dentista', 'fecha_desde', 'fecha_hasta', 'desde', 'hasta', 'motivo')
+
+
 class PacienteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Paciente
         fields = ('id', 'rut', 'nombre', 'apellido', 'telefono', 'email', 'fecha_registro')
 
+    def validate_rut(self, value):
+        """Valida el dígito verificador, la unicidad y guarda el RUT como '12345678-5'."""
+        try:
+            normalizado = normalizar_rut(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        existentes = Paciente.objects.filter(rut_normalizado=normalizado)
+        if self.instance is not None:
+            existentes = existentes.exclude(pk=self.instance.pk)
+        if existentes.exists():
+            raise serializers.ValidationError('Ya existe un paciente con este RUT.')
+        return formatear_rut(normalizado)
+
 
 class ReservaReadSerializer(serializers.ModelSerializer):
     """Serializer para lectura de reservas con información detallada"""
@@ -183,3 +270,11 @@ class ReservaReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reserva
         fields = ('id', 'slot', 'paciente', 'servicio', 'creado_en', 'sobrecupo')
+
+
+class ReservaArchivoSerializer(serializers.ModelSerializer):
+    """Reserva archivada (solo lectura); `dentista`, `paciente` y `servicio` como IDs."""
+    class Meta:
+        model = ReservaArchivo
+        fields = ('id', 'fecha', 'hora', 'dentista', 'paciente', 'servicio', 'sobrecupo', 'creado_en', 'archivado_en')
+        read_only_fields = fields
@@ -0,0 +1,129 @@
+"""Receptores de señales de la app agenda."""
+from django.core.signals import setting_changed
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import revisiones
+from .busqueda import desindexar_paciente, indexar_pacientes
+from .cache import get_cache, reset_cache
+from .models import Reserva, SlotAgenda, Dentista, Servicio, Paciente, Region, PlantillaHorario, ExcepcionAgenda
+from .reservas import liberar_cupo
+
+
+def _dia_de_reserva(reserva):
+    if Reserva.slot.is_cached(reserva):
+        return reserva.slot.dentista_id, reserva.slot.fecha
+    return SlotAgenda.objects.filter(pk=reserva.slot_id).values_list('dentista_id', 'fecha').first()
+
+
+def _dias_cambiados(dias):
+    # Solo la fila de cada dentista y día: el sello de la vista de todos se reúne al leer. La
+    # caché ya no sirve entradas con el sello anterior; invalidarlas solo libera memoria antes
+    revisiones.incrementar_dias(dias)
+    get_cache().invalidar_dias(dias)
+
+
+@receiver(pre_delete, sender=Reserva)
+def reserva_por_eliminar(sender, instance, **kwargs):
+    # La tabla intermedia se borra antes que la reserva: guardar el tramo para liberar_cupo
+    instance._slots_continuacion = list(instance.slots_continuacion.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Reserva)
+def reserva_eliminada(sender, instance, **kwargs):
+    # Cubre borrados desde la API, el admin y en cascada
+    liberar_cupo(instance)
+
+
+@receiver(post_save, sender=Reserva)
+@receiver(post_delete, sender=Reserva)
+def reserva_cambiada(sender, instance, **kwargs):
+    dia = _dia_de_reserva(instance)
+    if dia:
+        _dias_cambiados([dia])
+
+
+@receiver(pre_save, sender=SlotAgenda)
+def slot_por_cambiar(sender, instance, **kwargs):
+    # Si un slot se mueve de día o de dentista también hay que invalidar el día anterior
+    if instance.pk:
+        instance._dia_anterior = SlotAgenda.objects.filter(pk=instance.pk).values_list('dentista_id', 'fecha').first()
+
+
+@receiver(post_save, sender=SlotAgenda)
+@receiver(post_delete, sender=SlotAgenda)
+def slot_cambiado(sender, instance, **kwargs):
+    dias = [(instance.dentista_id, instance.fecha)]
+    anterior = getattr(instance, '_dia_anterior', None)
+    if anterior and anterior != dias[0]:
+        dias.append(anterior)
+    _dias_cambiados(dias)
+
+
+@receiver(post_save, sender=Dentista)
+@receiver(post_save, sender=Servicio)
+def etiqueta_cambiada(sender, instance, created, **kwargs):
+    # Los listados cacheados de todos los días incluyen el nombre del dentista y del servicio: el
+    # sello global nuevo descarta todas las entradas sin vaciar la caché
+    if not created:
+        revisiones.incrementar([revisiones.GLOBAL])
+
+
+@receiver(post_save, sender=PlantillaHorario)
+@receiver(post_delete, sender=PlantillaHorario)
+@receiver(post_save, sender=ExcepcionAgenda)
+@receiver(post_delete, sender=ExcepcionAgenda)
+def horario_cambiado(sender, instance, **kwargs):
+    # Los listados de cada día incluyen los bloques de plantilla y omiten los slots exceptuados;
+    # una plantilla o una excepción puede cubrir días sin límite, así que cambian todos
+    revisiones.incrementar([revisiones.GLOBAL])
+
+
+@receiver(post_save, sender=Paciente)
+def paciente_modificado(sender, instance, created, **kwargs):
+    # Un paciente solo aparece en las reservas del día de sus propias reservas
+    if not created:
+        dias = set(Reserva.objects.filter(paciente=instance).values_list('slot__dentista_id', 'slot__fecha'))
+        if dias:
+            _dias_cambiados(sorted(dias))
+
+
+@receiver(post_save, sender=Dentista)
+@receiver(post_delete, sender=Dentista)
+@receiver(post_save, sender=Servicio)
+@receiver(post_delete, sender=Servicio)
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def catalogo_cambiado(sender, instance, **kwargs):
+    recurso = {
+        Dentista: revisiones.DENTISTAS,
+        Servicio: revisiones.SERVICIOS,
+        Region: revisiones.REGIONES,
+    }[sender]
+    revisiones.incrementar([recurso])
+
+
+@receiver(post_save, sender=Paciente)
+def paciente_guardado(sender, instance, using, **kwargs):
+    indexar_pacientes([instance], using=using)
+
+
+@receiver(post_delete, sender=Paciente)
+def paciente_eliminado(sender, instance, using, **kwargs):
+    desindexar_paciente(instance.pk, using=using)
+
+
+@receiver(connection_created)
+def configurar_sqlite(sender, connection, **kwargs):
+    # WAL: las lecturas no esperan a las transacciones de reserva (un solo escritor a la vez)
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+
+
+@receiver(setting_changed)
+def agenda_cache_setting_changed(sender, setting, **kwargs):
+    if setting == 'AGENDA_CACHE':
+        reset_cache()
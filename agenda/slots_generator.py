@@ -2,10 +2,26 @@
 
 - Slots de 30 minutos
 - Horario por defecto 08:00-18:00 (extendido para mayor flexibilidad)
-- Evita duplicados usando get_or_create
+- Generación por conjuntos: se cargan las claves existentes del rango en una sola
+  consulta, se calculan las faltantes en memoria y se insertan con `bulk_create`
+  por lotes (`ignore_conflicts=True` cubre inserciones concurrentes).
+- Generación paralela: el trabajo se particiona por dentista y ventana de fechas y
+  cada partición se ejecuta en un proceso con su propia conexión a la base de datos.
 """
 import datetime
-from .models import SlotAgenda
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.db import connections, transaction
+
+from .cache import get_cache
+from .revisiones import incrementar_dias
+from .models import SlotAgenda, validar_hora_slot
+from .slots_worker import ejecutar_particion, inicializar_worker
+
+# Tamaño de lote por defecto para los INSERT masivos
+BULK_CHUNK_SIZE = 500
 
 
 def _parse_time(t):
@@ -14,30 +30,142 @@ def _parse_time(t):
     return datetime.datetime.strptime(t, '%H:%M').time()
 
 
-def generate_slots_for_day(dentista, fecha, desde='08:00', hasta='18:00', capacidad_default=1):
-    t_desde = _parse_time(desde)
-    t_hasta = _parse_time(hasta)
-    current = datetime.datetime.combine(fecha, t_desde)
-    end = datetime.datetime.combine(fecha, t_hasta)
-    created = 0
-    # crear slots en bloques de 30 minutos (excluye el instante final si es igual a end)
+def _horas_del_dia(desde, hasta):
+    """Horas de inicio de cada bloque de 30 minutos entre `desde` y `hasta` (ambos inclusive)."""
+    base = datetime.date.min
+    current = datetime.datetime.combine(base, _parse_time(desde))
+    end = datetime.datetime.combine(base, _parse_time(hasta))
+    horas = []
     while current <= end:
-        hora = current.time()
-        SlotAgenda.objects.get_or_create(
-            dentista=dentista,
-            fecha=fecha,
-            hora=hora,
-            defaults={'capacidad': capacidad_default}
-        )
-        created += 1
+        horas.append(current.time())
         current += datetime.timedelta(minutes=30)
-    return created
+    return horas
+
+
+def validar_horario(desde, hasta):
+    """Devuelve las horas de los bloques entre `desde` y `hasta` validadas con las reglas de `SlotAgenda.clean`.
+
+    Es la pre-validación vectorizada de la generación masiva: se valida una vez por hora del
+    día en vez de una vez por fila (bulk_create no llama a save()/full_clean()).
+    """
+    horas = _horas_del_dia(desde, hasta)
+    for hora in horas:
+        validar_hora_slot(hora)
+    return horas
 
 
-def generate_slots_range(dentista, start_date, end_date, desde='08:00', hasta='18:00', capacidad_default=1):
-    total = 0
+def _fechas(start_date, end_date):
     day = start_date
     while day <= end_date:
-        total += generate_slots_for_day(dentista, day, desde=desde, hasta=hasta, capacidad_default=capacidad_default)
+        yield day
         day += datetime.timedelta(days=1)
-    return total
+
+
+def generate_slots_bulk(dentistas, start_date, end_date, desde='08:00', hasta='18:00',
+                        capacidad_default=1, chunk_size=BULK_CHUNK_SIZE, max_overbook_default=0):
+    """Genera los slots faltantes de varios dentistas en un rango de fechas.
+
+    `dentistas` acepta instancias de `Dentista` o IDs. Devuelve un dict con
+    `created` (filas realmente insertadas) y `skipped` (slots que ya existían).
+    """
+    horas = validar_horario(desde, hasta)
+
+    dentista_ids = [getattr(d, 'pk', d) for d in dentistas]
+    fechas = list(_fechas(start_date, end_date))
+    total = len(dentista_ids) * len(fechas) * len(horas)
+    if not total:
+        return {'created': 0, 'skipped': 0}
+
+    scope = SlotAgenda.objects.filter(
+        dentista_id__in=dentista_ids,
+        fecha__range=(start_date, end_date),
+        hora__in=horas,
+    )
+    existentes = set(scope.values_list('dentista_id', 'fecha', 'hora'))
+    if len(existentes) >= total:
+        return {'created': 0, 'skipped': total}
+
+    nuevos = (
+        SlotAgenda(dentista_id=dentista_id, fecha=fecha, hora=hora, capacidad=capacidad_default,
+                   max_overbook=max_overbook_default)
+        for dentista_id in dentista_ids
+        for fecha in fechas
+        for hora in horas
+        if (dentista_id, fecha, hora) not in existentes
+    )
+    with transaction.atomic():
+        while True:
+            lote = list(itertools.islice(nuevos, chunk_size))
+            if not lote:
+                break
+            SlotAgenda.objects.bulk_create(lote, ignore_conflicts=True)
+        # ignore_conflicts no informa cuántas filas se insertaron: se recuenta el rango.
+        created = scope.count() - len(existentes)
+        # bulk_create no emite señales: versionar e invalidar la caché de cada día tocado
+        dias = [(dentista_id, fecha) for dentista_id in dentista_ids for fecha in fechas]
+        incrementar_dias(dias)
+        get_cache().invalidar_dias(dias)
+
+    return {'created': created, 'skipped': total - created}
+
+
+def generate_slots_for_day(dentista, fecha, desde='08:00', hasta='18:00', capacidad_default=1,
+                           max_overbook_default=0):
+    return generate_slots_bulk([dentista], fecha, fecha, desde=desde, hasta=hasta,
+                               capacidad_default=capacidad_default, max_overbook_default=max_overbook_default)
+
+
+def generate_slots_range(dentista, start_date, end_date, desde='08:00', hasta='18:00', capacidad_default=1,
+                         max_overbook_default=0):
+    return generate_slots_bulk([dentista], start_date, end_date, desde=desde, hasta=hasta,
+                               capacidad_default=capacidad_default, max_overbook_default=max_overbook_default)
+
+
+def partition_slots_work(dentista_ids, start_date, end_date, window_days=30):
+    """Divide el trabajo en particiones (dentista_id, inicio, fin) de como máximo `window_days` días."""
+    if window_days <= 0:
+        raise ValueError('window_days debe ser mayor que 0')
+    particiones = []
+    for dentista_id in dentista_ids:
+        inicio = start_date
+        while inicio <= end_date:
+            fin = min(inicio + datetime.timedelta(days=window_days - 1), end_date)
+            particiones.append((dentista_id, inicio, fin))
+            inicio = fin + datetime.timedelta(days=1)
+    return particiones
+
+
+def run_slots_partition(particion, desde='08:00', hasta='18:00', capacidad_default=1, max_overbook_default=0):
+    """Ejecuta una partición y devuelve sus contadores junto con el tiempo y el throughput."""
+    dentista_id, inicio, fin = particion
+    t0 = time.perf_counter()
+    resultado = generate_slots_bulk([dentista_id], inicio, fin, desde=desde, hasta=hasta,
+                                    capacidad_default=capacidad_default, max_overbook_default=max_overbook_default)
+    segundos = time.perf_counter() - t0
+    resultado.update({
+        'dentista': dentista_id,
+        'desde': inicio,
+        'hasta': fin,
+        'segundos': segundos,
+        'slots_por_segundo': (resultado['created'] + resultado['skipped']) / segundos if segundos else 0.0,
+    })
+    return resultado
+
+
+def generate_slots_parallel(particiones, workers=1, desde='08:00', hasta='18:00', capacidad_default=1,
+                            max_overbook_default=0):
+    """Ejecuta las particiones en un pool de procesos. Genera los resultados a medida que terminan."""
+    kwargs = {'desde': desde, 'hasta': hasta, 'capacidad_default': capacidad_default,
+              'max_overbook_default': max_overbook_default}
+    if workers <= 1:
+        for particion in particiones:
+            yield run_slots_partition(particion, **kwargs)
+        return
+
+    # No compartir sockets/handles abiertos con los procesos hijos
+    connections.close_all()
+    # El inicializador y la tarea viven en `slots_worker`, importable sin Django configurado ("spawn")
+    with ProcessPoolExecutor(max_workers=workers, initializer=inicializar_worker) as pool:
+        futures = [pool.submit(ejecutar_particion, particion, **kwargs) for particion in particiones]
+        for future in as_completed(futures):
+            yield future.result()
@@ -0,0 +1,22 @@
+"""Punto de entrada de los procesos de `slots_generator.generate_slots_parallel`.
+
+Con el método de arranque "spawn" (Windows, macOS) el proceso hijo importa este módulo para
+desempaquetar el inicializador y la tarea antes de que Django esté configurado, así que no
+importa modelos al cargarse: `inicializar_worker` llama a `django.setup()` y la tarea importa
+`slots_generator` recién al ejecutarse. Con "fork" el hijo hereda Django ya configurado.
+"""
+
+
+def inicializar_worker():
+    import django
+    from django.db import connections
+
+    django.setup()
+    # Con "fork" el hijo hereda las conexiones del padre, que no deben reutilizarse: cada worker abre la suya
+    connections.close_all()
+
+
+def ejecutar_particion(particion, **kwargs):
+    from .slots_generator import run_slots_partition
+
+    return run_slots_partition(particion, **kwargs)
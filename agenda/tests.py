@@ -1,7 +1,34 @@
-from django.test import TestCase
+import gc
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time as pytime
+from io import StringIO
+
+from django.contrib.admin.sites import site
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APIClient
-from .models import SlotAgenda, Paciente, Dentista, Servicio, Reserva
+from .models import SlotAgenda, Paciente, Dentista, Servicio, Reserva, Region, SobrecupoDia, digito_verificador_rut
+from .models import PlantillaHorario, ExcepcionAgenda, HorizonteAgenda, SlotAgendaArchivo, ReservaArchivo
+from .models import RevisionRecurso
+from . import revisiones
+from .mantenimiento import _borrar_vacios, extender_horizonte
+from .reservas import admitir_reserva, ReservaRechazada, MENSAJE_SIN_TRAMO, _resolver_slots_por_clave
+from .plantillas import MENSAJE_FUERA_DE_HORARIO
+from .tracing import TrazaJSONFormatter
+from .cache import get_cache
+from .busqueda import fts_disponible, indexar_pacientes
+from .disponibilidad import decodificar_fila, proximas_disponibles
+from .serializers import SlotAgendaSerializer, serializar_slots
+from .slots_generator import generate_slots_bulk, partition_slots_work
 from django.utils import timezone
 from datetime import time, timedelta
 
@@ -51,6 +78,195 @@ class GenerateSlotsTest(TestCase):
         self.assertEqual(r.status_code, 201)
         self.assertTrue('created' in r.data)
 
+    def test_generate_slots_counts_created_and_skipped(self):
+        hoy = timezone.localdate()
+        SlotAgenda.objects.create(dentista=self.dentista, fecha=hoy, hora=time(9, 0))
+        otro = Dentista.objects.create(nombre='Elena', apellido='Soto')
+
+        r = generate_slots_bulk([self.dentista, otro.pk], hoy, hoy + timedelta(days=1), desde='08:00', hasta='10:00')
+        # 2 dentistas x 2 días x 5 bloques, uno ya existía
+        self.assertEqual(r, {'created': 19, 'skipped': 1})
+        self.assertEqual(SlotAgenda.objects.count(), 20)
+
+        r = generate_slots_bulk([self.dentista, otro.pk], hoy, hoy + timedelta(days=1), desde='08:00', hasta='10:00')
+        self.assertEqual(r, {'created': 0, 'skipped': 20})
+
+    def test_generate_slots_rejects_invalid_hours(self):
+        url = reverse('generar-slots', kwargs={'dentista_id': self.dentista.id})
+        payload = {'fecha': timezone.localdate().isoformat(), 'desde': '07:00', 'hasta': '09:00'}
+        r = self.client.post(url, payload, format='json')
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(SlotAgenda.objects.exists())
+
+
+class GenerateSlotsCommandTest(TestCase):
+    def setUp(self):
+        self.norte = Region.objects.create(nombre='Norte', codigo='N')
+        self.d1 = Dentista.objects.create(nombre='Ana', apellido='Uno', region=self.norte)
+        self.d2 = Dentista.objects.create(nombre='Beto', apellido='Dos', region=self.norte)
+        self.d3 = Dentista.objects.create(nombre='Carla', apellido='Tres')
+
+    def test_partition_by_dentist_and_window(self):
+        hoy = timezone.localdate()
+        particiones = partition_slots_work([1, 2], hoy, hoy + timedelta(days=9), window_days=4)
+        self.assertEqual(len(particiones), 6)
+        self.assertEqual(particiones[2], (1, hoy + timedelta(days=8), hoy + timedelta(days=9)))
+
+    def test_worker_arranca_con_spawn(self):
+        # El hijo "spawn" desempaqueta el inicializador y la tarea antes de tener Django configurado
+        codigo = (
+            'import datetime, multiprocessing\n'
+            'from concurrent.futures import ProcessPoolExecutor\n'
+            'from agenda.slots_worker import ejecutar_particion, inicializar_worker\n'
+            'if __name__ == "__main__":\n'
+            '    hoy = datetime.date.today()\n'
+            '    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"),\n'
+            '                             initializer=inicializar_worker) as pool:\n'
+            '        print(pool.submit(ejecutar_particion, (1, hoy, hoy - datetime.timedelta(days=1))).result()["created"])\n'
+        )
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'backendClinica.settings'}
+        salida = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True, env=env,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), timeout=60)
+        self.assertEqual(salida.returncode, 0, salida.stderr)
+        self.assertEqual(salida.stdout.strip(), '0')
+
+    def test_generate_all(self):
+        out = StringIO()
+        call_command('generate_slots', '--all', '--fecha', timezone.localdate().isoformat(), '--dias', '3',
+                     '--desde', '08:00', '--hasta', '09:00', '--ventana', '2', stdout=out)
+        self.assertEqual(SlotAgenda.objects.count(), 3 * 3 * 3)
+        self.assertIn('6 particiones', out.getvalue())
+
+    def test_generate_region(self):
+        call_command('generate_slots', '--region', 'N', '--fecha', timezone.localdate().isoformat(),
+                     '--desde', '08:00', '--hasta', '09:00', stdout=StringIO())
+        self.assertEqual(set(SlotAgenda.objects.values_list('dentista_id', flat=True)), {self.d1.id, self.d2.id})
+
+
+class SeedDataCommandTest(TestCase):
+    def test_regiones_y_sobrecupos(self):
+        call_command('seed_data', '--regiones', '2', '--dentistas', '4', '--pacientes', '3', '--generate-slots', '1',
+                     '--desde', '08:00', '--hasta', '08:30', '--max-overbook', '1', '--max-overbook-dia', '3',
+                     stdout=StringIO())
+        self.assertEqual(
+            list(Dentista.objects.order_by('nombre').values_list('region__codigo', 'max_overbook_day')),
+            [('R1', 3), ('R2', 3), ('R1', 3), ('R2', 3)],
+        )
+        self.assertEqual(SlotAgenda.objects.filter(max_overbook=1).count(), 4 * 2)
+        # Volver a sembrar no duplica nada
+        call_command('seed_data', '--regiones', '2', '--dentistas', '4', '--pacientes', '3', stdout=StringIO())
+        self.assertEqual((Region.objects.count(), Dentista.objects.count(), Paciente.objects.count()), (2, 4, 3))
+
+
+class MaintainAgendaCommandTest(TestCase):
+    def setUp(self):
+        self.hoy = timezone.localdate()
+        self.ana = Dentista.objects.create(nombre='Ana', apellido='Horizonte')
+        self.beto = Dentista.objects.create(nombre='Beto', apellido='Plantilla')
+        PlantillaHorario.objects.create(dentista=self.beto, dia_semana=0, desde=time(9, 0), hasta=time(12, 0))
+
+    def test_horizonte_incremental(self):
+        call_command('maintain_agenda', '--dias', '3', '--desde', '08:00', '--hasta', '08:30', '--sin-podar',
+                     stdout=StringIO())
+        # Beto tiene plantilla: sus slots se materializan al reservar
+        self.assertEqual(SlotAgenda.objects.filter(dentista=self.beto).count(), 0)
+        self.assertEqual(SlotAgenda.objects.filter(dentista=self.ana).count(), 3 * 2)
+        self.assertEqual(HorizonteAgenda.objects.get(dentista=self.ana).generado_hasta, self.hoy + timedelta(days=2))
+
+        # Al día siguiente solo se genera el día nuevo
+        grupos = extender_horizonte(3, hoy=self.hoy + timedelta(days=1), desde='08:00', hasta='08:30')
+        self.assertEqual([(g['desde'], g['hasta'], g['created'], g['skipped']) for g in grupos],
+                         [(self.hoy + timedelta(days=3), self.hoy + timedelta(days=3), 2, 0)])
+        self.assertEqual(extender_horizonte(3, hoy=self.hoy + timedelta(days=1), desde='08:00', hasta='08:30'), [])
+
+    def test_poda_slots_vacios(self):
+        paciente = Paciente.objects.create(nombre='Pia', apellido='Poda')
+        larga = Servicio.objects.create(nombre='Endodoncia', duracion_min=60, precio=90)
+        pasado = self.hoy - timedelta(days=10)
+        vacios = [SlotAgenda.objects.create(dentista=self.ana, fecha=pasado, hora=time(h, 0)) for h in (8, 11, 12)]
+        inicio = SlotAgenda.objects.create(dentista=self.ana, fecha=pasado, hora=time(9, 0))
+        continuacion = SlotAgenda.objects.create(dentista=self.ana, fecha=pasado, hora=time(9, 30))
+        admitir_reserva(inicio, paciente, larga)
+        reciente = SlotAgenda.objects.create(dentista=self.ana, fecha=self.hoy - timedelta(days=1), hora=time(8, 0))
+
+        out = StringIO()
+        call_command('maintain_agenda', '--sin-generar', '--dry-run', stdout=out)
+        self.assertIn('3 slots vacíos', out.getvalue())
+        self.assertEqual(SlotAgenda.objects.count(), 6)
+
+        call_command('maintain_agenda', '--sin-generar', '--chunk', '2', stdout=StringIO())
+        self.assertEqual(set(SlotAgenda.objects.values_list('pk', flat=True)), {inicio.pk, continuacion.pk, reciente.pk})
+        self.assertFalse(SlotAgenda.objects.filter(pk__in=[s.pk for s in vacios]).exists())
+
+        # El DELETE vuelve a exigir que no haya reservas, aunque los contadores digan lo contrario
+        SlotAgenda.objects.filter(pk__in=[inicio.pk, continuacion.pk]).update(reservas_normales=0)
+        self.assertEqual(_borrar_vacios([inicio.pk, continuacion.pk, reciente.pk]), 1)
+        self.assertEqual(set(SlotAgenda.objects.values_list('pk', flat=True)), {inicio.pk, continuacion.pk})
+
+
+class ArchiveAgendaCommandTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hoy = timezone.localdate()
+        self.viejo = self.hoy - timedelta(days=400)
+        self.dentista = Dentista.objects.create(nombre='Ana', apellido='Archivo', max_overbook_day=1)
+        self.otro = Dentista.objects.create(nombre='Beto', apellido='Archivo')
+        self.paciente = Paciente.objects.create(nombre='Pia', apellido='Archivo')
+        self.larga = Servicio.objects.create(nombre='Endodoncia', duracion_min=60, precio=90)
+        inicio = SlotAgenda.objects.create(dentista=self.dentista, fecha=self.viejo, hora=time(9, 0), max_overbook=1)
+        SlotAgenda.objects.create(dentista=self.dentista, fecha=self.viejo, hora=time(9, 30), max_overbook=1)
+        self.tramo = admitir_reserva(inicio, self.paciente, self.larga)
+        sobre = SlotAgenda.objects.create(dentista=self.dentista, fecha=self.viejo, hora=time(11, 0), max_overbook=1)
+        SlotAgenda.objects.filter(pk=sobre.pk).update(capacidad=0)
+        admitir_reserva(SlotAgenda.objects.get(pk=sobre.pk), self.paciente)
+        for dias in (400, 399):
+            SlotAgenda.objects.create(dentista=self.otro, fecha=self.hoy - timedelta(days=dias), hora=time(8, 0))
+        self.reciente = SlotAgenda.objects.create(dentista=self.dentista, fecha=self.hoy, hora=time(8, 0))
+        admitir_reserva(self.reciente, self.paciente)
+
+    def test_archiva_por_lotes(self):
+        dia_viejo = {'fecha': self.viejo.isoformat(), 'dentista_id': self.dentista.id}
+        etag = self.client.get(reverse('slots-por-fecha'), dia_viejo)['ETag']
+        versiones = dict(RevisionRecurso.objects.filter(recurso__startswith='slots:').values_list('recurso', 'version'))
+        out = StringIO()
+        call_command('archive_agenda', '--dry-run', stdout=out)
+        self.assertIn('5 slots y 2 reservas', out.getvalue())
+
+        call_command('archive_agenda', '--dias', '365', '--chunk', '1', stdout=StringIO())
+        self.assertEqual(list(SlotAgenda.objects.values_list('pk', flat=True)), [self.reciente.pk])
+        self.assertEqual(Reserva.objects.count(), 1)
+        self.assertFalse(SobrecupoDia.objects.filter(fecha=self.viejo).exists())
+        self.assertEqual(SlotAgendaArchivo.objects.count(), 5)
+        archivada = ReservaArchivo.objects.get(pk=self.tramo.pk)
+        self.assertEqual((archivada.dentista_id, archivada.fecha, archivada.hora), (self.dentista.id, self.viejo, time(9, 0)))
+        self.assertEqual([s.hora for s in archivada.slots_continuacion.all()], [time(9, 30)])
+        self.assertEqual(SlotAgendaArchivo.objects.get(hora=time(11, 0)).reservas_sobrecupo, 1)
+        # Los sellos de los días archivados avanzan (no se reinician) y el ETag anterior deja de valer
+        archivados = {revisiones.recurso_slots(d, f) for d, f in [
+            (self.dentista.id, self.viejo), (self.otro.id, self.viejo), (self.otro.id, self.hoy - timedelta(days=399)),
+        ]}
+        despues = dict(RevisionRecurso.objects.filter(recurso__in=archivados).values_list('recurso', 'version'))
+        self.assertEqual(despues.keys(), archivados)
+        self.assertTrue(all(despues[r] > versiones.get(r, 0) for r in archivados))
+        r = self.client.get(reverse('slots-por-fecha'), dia_viejo, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((r.status_code, r.data), (200, []))
+
+        # Volver a correr no mueve nada
+        call_command('archive_agenda', '--dias', '365', stdout=StringIO())
+        self.assertEqual(ReservaArchivo.objects.count(), 2)
+
+    def test_historial(self):
+        call_command('archive_agenda', '--antes', (self.hoy - timedelta(days=365)).isoformat(), stdout=StringIO())
+        r = self.client.get(reverse('historial-reservas'), {'paciente': self.paciente.id, 'page_size': 1})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([x['hora'] for x in r.data], ['09:00:00'])
+        r = self.client.get(reverse('historial-reservas'), {'paciente': self.paciente.id, 'cursor': r['X-Next-Cursor']})
+        self.assertEqual([(x['hora'], x['sobrecupo']) for x in r.data], [('11:00:00', True)])
+        r = self.client.get(reverse('historial-reservas'), {'desde': self.hoy.isoformat()})
+        self.assertEqual(r.data, [])
+        self.assertEqual(self.client.get(reverse('historial-reservas'), {'dentista': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('historial-reservas'), {}).status_code, 405)
+
 
 class AgendaExtraTests(TestCase):
     def setUp(self):
@@ -121,3 +337,1277 @@ class AgendaExtraTests(TestCase):
     def test_listar_pacientes(self):
         r = self.client.get('/agenda/api/pacientes/')
         self.assertEqual(r.status_code, 200)
+
+
+class OcupacionSlotTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Rosa', apellido='Diaz', max_overbook_day=1)
+        self.servicio = Servicio.objects.create(nombre='Limpieza', duracion_min=30, precio=30)
+        self.pacientes = [Paciente.objects.create(nombre=f'P{i}', apellido='Test') for i in range(4)]
+        self.slot = SlotAgenda.objects.create(
+            dentista=self.dentista, fecha=timezone.localdate(), hora=time(11, 0), capacidad=1, max_overbook=1
+        )
+
+    def reservar(self, paciente):
+        return self.client.post(reverse('crear-reserva'), {'slot': self.slot.id, 'paciente': paciente.id}, format='json')
+
+    def test_counters_follow_create_and_delete(self):
+        self.assertEqual(self.reservar(self.pacientes[0]).data['sobrecupo'], False)
+        self.assertEqual(self.reservar(self.pacientes[1]).data['sobrecupo'], True)
+        self.assertEqual(self.reservar(self.pacientes[2]).status_code, 400)
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.reservas_normales, self.slot.reservas_sobrecupo), (1, 1))
+        self.assertFalse(self.slot.tiene_cupo)
+
+        reserva = Reserva.objects.get(slot=self.slot, sobrecupo=False)
+        r = self.client.delete(f'/agenda/api/reservas/{reserva.id}/')
+        self.assertEqual(r.status_code, 204)
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.reservas_normales, self.slot.reservas_sobrecupo), (0, 1))
+
+    def test_slots_disponibles_filter(self):
+        lleno = SlotAgenda.objects.create(dentista=self.dentista, fecha=timezone.localdate(), hora=time(12, 0))
+        SlotAgenda.objects.filter(pk=lleno.pk).update(reservas_normales=1)
+        r = self.client.get(reverse('slots-disponibles'), {'disponibles': '1'})
+        ids = [s['id'] for s in r.data]
+        self.assertIn(self.slot.id, ids)
+        self.assertNotIn(lleno.id, ids)
+
+    def test_recount_slots_repairs_counters(self):
+        self.reservar(self.pacientes[0])
+        SlotAgenda.objects.filter(pk=self.slot.pk).update(reservas_normales=5, reservas_sobrecupo=2)
+        out = StringIO()
+        call_command('recount_slots', '--dry-run', stdout=out)
+        self.assertIn('1 slots con contadores inconsistentes', out.getvalue())
+        call_command('recount_slots', stdout=StringIO())
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.reservas_normales, self.slot.reservas_sobrecupo), (1, 0))
+
+
+class SobrecupoDiaTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Luis', apellido='Vera', max_overbook_day=1)
+        self.pacientes = [Paciente.objects.create(nombre=f'P{i}', apellido='Libro') for i in range(4)]
+        hoy = timezone.localdate()
+        self.slots = [
+            SlotAgenda.objects.create(dentista=self.dentista, fecha=hoy, hora=time(h, 0), capacidad=1, max_overbook=1)
+            for h in (9, 10)
+        ]
+
+    def reservar(self, slot, paciente):
+        return self.client.post(reverse('crear-reserva'), {'slot': slot.id, 'paciente': paciente.id}, format='json')
+
+    def test_daily_limit_enforced_by_ledger(self):
+        self.reservar(self.slots[0], self.pacientes[0])
+        self.reservar(self.slots[1], self.pacientes[1])
+        self.assertTrue(self.reservar(self.slots[0], self.pacientes[2]).data['sobrecupo'])
+        # El slot 10:00 admite sobrecupo, pero el dentista ya agotó su límite diario
+        self.assertEqual(self.reservar(self.slots[1], self.pacientes[3]).status_code, 400)
+        libro = SobrecupoDia.objects.get(dentista=self.dentista, fecha=timezone.localdate())
+        self.assertEqual(libro.sobrecupos_usados, 1)
+
+        Reserva.objects.get(sobrecupo=True).delete()
+        libro.refresh_from_db()
+        self.assertEqual(libro.sobrecupos_usados, 0)
+        self.assertTrue(self.reservar(self.slots[1], self.pacientes[3]).data['sobrecupo'])
+
+    def test_recount_repairs_ledger(self):
+        self.reservar(self.slots[0], self.pacientes[0])
+        self.reservar(self.slots[0], self.pacientes[1])
+        SobrecupoDia.objects.update(sobrecupos_usados=0)
+        call_command('recount_slots', stdout=StringIO())
+        self.assertEqual(SobrecupoDia.objects.get().sobrecupos_usados, 1)
+
+
+class ReservaTramoTest(TestCase):
+    """Servicios de más de 30 minutos ocupan los slots consecutivos que cubre su duración."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Rosa', apellido='Tramo', max_overbook_day=1)
+        self.larga = Servicio.objects.create(nombre='Endodoncia', duracion_min=60, precio=90)
+        self.corta = Servicio.objects.create(nombre='Control', duracion_min=30, precio=20)
+        self.pacientes = [Paciente.objects.create(nombre=f'P{i}', apellido='Tramo') for i in range(4)]
+        self.hoy = timezone.localdate()
+        self.slots = {
+            h: SlotAgenda.objects.create(dentista=self.dentista, fecha=self.hoy, hora=h, max_overbook=1)
+            for h in (time(9, 0), time(9, 30), time(10, 0), time(11, 0))
+        }
+
+    def reservar(self, hora, paciente, servicio):
+        return self.client.post(reverse('crear-reserva'), {
+            'slot': self.slots[hora].id, 'paciente': paciente.id, 'servicio': servicio.id,
+        }, format='json')
+
+    def ocupacion(self):
+        return {s.hora: (s.reservas_normales, s.reservas_sobrecupo) for s in SlotAgenda.objects.all()}
+
+    def test_reserva_ocupa_el_tramo(self):
+        r = self.reservar(time(9, 0), self.pacientes[0], self.larga)
+        self.assertEqual(r.status_code, 201)
+        self.assertFalse(r.data['sobrecupo'])
+        reserva = Reserva.objects.get(pk=r.data['id'])
+        self.assertEqual(list(reserva.slots_continuacion.all()), [self.slots[time(9, 30)]])
+        self.assertEqual(self.ocupacion()[time(9, 30)], (1, 0))
+        # El bloque de las 9:30 ya no está libre para un servicio corto
+        self.assertTrue(self.reservar(time(9, 30), self.pacientes[1], self.corta).data['sobrecupo'])
+
+        out = StringIO()
+        call_command('recount_slots', '--dry-run', stdout=out)
+        self.assertIn('0 slots con contadores inconsistentes', out.getvalue())
+
+        reserva.delete()
+        self.assertEqual(self.ocupacion()[time(9, 0)], (0, 0))
+        self.assertEqual(self.ocupacion()[time(9, 30)], (0, 1))
+
+    def test_tramo_incompleto_o_lleno(self):
+        # 10:30 no existe: 10:00 no tiene dos bloques consecutivos
+        r = self.reservar(time(10, 0), self.pacientes[0], self.larga)
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Reserva.objects.count(), 0)
+
+        self.reservar(time(9, 30), self.pacientes[0], self.corta)
+        # 9:30 lleno: el tramo de 9:00 solo entra como sobrecupo (en ambos slots, un cupo del día)
+        self.assertTrue(self.reservar(time(9, 0), self.pacientes[1], self.larga).data['sobrecupo'])
+        self.assertEqual(self.ocupacion()[time(9, 0)], (0, 1))
+        self.assertEqual(self.ocupacion()[time(9, 30)], (1, 1))
+        self.assertEqual(SobrecupoDia.objects.get().sobrecupos_usados, 1)
+        self.assertEqual(self.reservar(time(9, 0), self.pacientes[2], self.larga).status_code, 400)
+
+    def test_crear_slots_del_tramo(self):
+        r = self.client.post(reverse('crear-reserva'), {
+            'dentista': self.dentista.id, 'fecha': self.hoy.isoformat(), 'hora_inicio': '14:00',
+            'paciente': self.pacientes[0].id, 'servicio': self.larga.id,
+        }, format='json')
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(self.ocupacion()[time(14, 30)], (1, 0))
+        r = self.client.post(reverse('crear-reserva'), {
+            'dentista': self.dentista.id, 'fecha': self.hoy.isoformat(), 'hora_inicio': '18:00',
+            'paciente': self.pacientes[0].id, 'servicio': self.larga.id,
+        }, format='json')
+        self.assertEqual(r.status_code, 400)
+
+    def test_huecos(self):
+        self.reservar(time(9, 30), self.pacientes[0], self.corta)
+        r = self.client.get(reverse('huecos'), {'servicio': self.larga.id, 'desde': self.hoy.isoformat(),
+                                                'hasta': self.hoy.isoformat()})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(r.data['bloques'], 2)
+        self.assertEqual(r.data['huecos'], [])
+
+        r = self.client.get(reverse('huecos'), {'servicio': self.larga.id, 'desde': self.hoy.isoformat(),
+                                                'sobrecupo': '1'})
+        self.assertEqual(r.data['huecos'], [
+            {'dentista': self.dentista.id, 'fecha': self.hoy.isoformat(), 'horas': [], 'sobrecupo': ['09:00', '09:30']},
+        ])
+        r = self.client.get(reverse('huecos'), {'servicio': self.corta.id, 'desde': self.hoy.isoformat()})
+        self.assertEqual(r.data['huecos'][0]['horas'], ['09:00', '10:00', '11:00'])
+        self.assertEqual(self.client.get(reverse('huecos')).status_code, 400)
+
+
+class ProximaDisponibleTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.norte = Region.objects.create(nombre='Norte', codigo='N')
+        self.sur = Region.objects.create(nombre='Sur', codigo='S')
+        self.ana = Dentista.objects.create(nombre='Ana', apellido='N', especialidad='General', region=self.norte,
+                                           max_overbook_day=1)
+        self.beto = Dentista.objects.create(nombre='Beto', apellido='N', especialidad='Ortodoncia', region=self.norte)
+        self.carla = Dentista.objects.create(nombre='Carla', apellido='S', especialidad='General', region=self.sur)
+        self.larga = Servicio.objects.create(nombre='Endodoncia', duracion_min=60, precio=90)
+        self.manana = timezone.localdate() + timedelta(days=1)
+        self.pasado = self.manana + timedelta(days=1)
+        # Ana: mañana 10:00 lleno (admite sobrecupo) y 10:30; pasado 08:00-09:00
+        lleno = SlotAgenda.objects.create(dentista=self.ana, fecha=self.manana, hora=time(10, 0), max_overbook=1)
+        SlotAgenda.objects.filter(pk=lleno.pk).update(reservas_normales=1)
+        SlotAgenda.objects.create(dentista=self.ana, fecha=self.manana, hora=time(10, 30), max_overbook=1)
+        for h in (time(8, 0), time(8, 30), time(9, 0)):
+            SlotAgenda.objects.create(dentista=self.ana, fecha=self.pasado, hora=h)
+        # Beto: mañana 09:00; Carla: mañana 08:00 y 08:30
+        SlotAgenda.objects.create(dentista=self.beto, fecha=self.manana, hora=time(9, 0))
+        SlotAgenda.objects.create(dentista=self.carla, fecha=self.manana, hora=time(8, 0))
+        SlotAgenda.objects.create(dentista=self.carla, fecha=self.manana, hora=time(8, 30))
+
+    def buscar(self, **params):
+        r = self.client.get(reverse('proxima-disponible'), {'desde': self.manana.isoformat(), **params})
+        self.assertEqual(r.status_code, 200, r.data)
+        return [(x['dentista'], x['fecha'], x['hora'], x['sobrecupo']) for x in r.data['resultados']]
+
+    def test_mezcla_ordenada_entre_dentistas(self):
+        m, p = self.manana.isoformat(), self.pasado.isoformat()
+        self.assertEqual(self.buscar(k=4), [
+            (self.carla.id, m, '08:00', False), (self.carla.id, m, '08:30', False),
+            (self.beto.id, m, '09:00', False), (self.ana.id, m, '10:30', False),
+        ])
+        self.assertEqual(self.buscar(k=2, region=self.norte.id, especialidad='general'), [
+            (self.ana.id, m, '10:30', False), (self.ana.id, p, '08:00', False),
+        ])
+        self.assertEqual(self.buscar(k=2, region=self.norte.id, especialidad='general', sobrecupo=1), [
+            (self.ana.id, m, '10:00', True), (self.ana.id, m, '10:30', False),
+        ])
+
+    def test_servicio_de_varios_bloques(self):
+        m, p = self.manana.isoformat(), self.pasado.isoformat()
+        self.assertEqual(self.buscar(k=3, servicio=self.larga.id), [
+            (self.carla.id, m, '08:00', False), (self.ana.id, p, '08:00', False), (self.ana.id, p, '08:30', False),
+        ])
+
+    def test_se_detiene_en_k(self):
+        # Una página por flujo (más la de plantillas): no se recorre el resto del horizonte
+        with CaptureQueriesContext(connection) as ctx:
+            inicios = proximas_disponibles([self.ana.id, self.beto.id, self.carla.id], 1, self.manana, self.pasado, 1)
+        self.assertEqual(inicios[0][2], self.carla.id)
+        self.assertEqual(len(ctx.captured_queries), 4)
+        self.assertEqual(self.client.get(reverse('proxima-disponible'), {'k': 'x'}).status_code, 400)
+
+
+class PlantillaHorarioTest(TestCase):
+    """La disponibilidad sale de las plantillas; los slots se materializan al reservar."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Tomas', apellido='Plantilla', max_overbook_day=1)
+        self.corta = Servicio.objects.create(nombre='Control', duracion_min=30, precio=20)
+        self.larga = Servicio.objects.create(nombre='Endodoncia', duracion_min=60, precio=90)
+        self.paciente = Paciente.objects.create(nombre='Pia', apellido='Plantilla')
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        PlantillaHorario.objects.create(dentista=self.dentista, dia_semana=0, desde=time(9, 0), hasta=time(10, 0),
+                                        capacidad=2, max_overbook=1)
+        self.excepcion = ExcepcionAgenda.objects.create(
+            dentista=self.dentista, fecha_desde=self.lunes, fecha_hasta=self.lunes,
+            desde=time(9, 30), hasta=time(9, 30), motivo='Reunión',
+        )
+
+    def reservar(self, hora, servicio=None, paciente=None):
+        return self.client.post(reverse('crear-reserva'), {
+            'dentista': self.dentista.id, 'fecha': self.lunes.isoformat(), 'hora_inicio': hora,
+            'paciente': (paciente or self.paciente).id, 'servicio': (servicio or self.corta).id,
+        }, format='json')
+
+    def test_disponibilidad_virtual(self):
+        dia = {'desde': self.lunes.isoformat(), 'hasta': self.lunes.isoformat()}
+        r = self.client.get(reverse('disponibilidad'), dia)
+        self.assertEqual(r.data['dentistas'], [self.dentista.id])
+        # 09:00 y 10:00 libres; 09:30 exceptuado
+        self.assertEqual(decodificar_fila(r.data['matriz'][0][0])[2:5], [1, 0, 1])
+        self.assertFalse(SlotAgenda.objects.exists())
+
+        # Un slot materializado reemplaza al bloque virtual
+        lleno = SlotAgenda.objects.create(dentista=self.dentista, fecha=self.lunes, hora=time(9, 0))
+        SlotAgenda.objects.filter(pk=lleno.pk).update(reservas_normales=1)
+        r = self.client.get(reverse('disponibilidad'), dia)
+        self.assertEqual(decodificar_fila(r.data['matriz'][0][0])[2:5], [2, 0, 1])
+        r = self.client.get(reverse('async-disponibilidad'), dia)
+        self.assertEqual(decodificar_fila(r.json()['matriz'][0][0])[2:5], [2, 0, 1])
+
+        r = self.client.get(reverse('proxima-disponible'), {'desde': self.lunes.isoformat(), 'k': 3})
+        self.assertEqual([(x['fecha'], x['hora']) for x in r.data['resultados']], [
+            (self.lunes.isoformat(), '10:00'), ((self.lunes + timedelta(days=7)).isoformat(), '09:00'),
+            ((self.lunes + timedelta(days=7)).isoformat(), '09:30'),
+        ])
+
+    def test_listados_incluyen_bloques_de_plantilla(self):
+        dia = {'fecha': self.lunes.isoformat(), 'dentista_id': self.dentista.id}
+        r = self.client.get(reverse('slots-por-fecha'), dia)
+        self.assertEqual([(f['id'], f['dentista_id'], f['hora'], f['capacidad']) for f in r.data],
+                         [(None, self.dentista.id, '09:00:00', 2), (None, self.dentista.id, '10:00:00', 2)])
+        self.assertEqual(r.data[0]['dentista'], str(self.dentista))
+
+        # Un bloque reservado aparece como slot, con su ocupación (la reserva invalida el día)
+        self.assertEqual(self.reservar('10:00').status_code, 201)
+        slot = SlotAgenda.objects.get()
+        r = self.client.get(reverse('slots-por-fecha'), dia)
+        self.assertEqual([(f['id'], f['hora'], f['reservas_normales']) for f in r.data],
+                         [(None, '09:00:00', 0), (slot.id, '10:00:00', 1)])
+        self.assertEqual(self.client.get(reverse('async-slots-por-fecha'), dia).json(), r.data)
+        self.assertEqual(self.client.get(reverse('slots-disponibles'), dia).data, r.data)
+
+        # Una excepción nueva cambia el listado cacheado de todos los días
+        ExcepcionAgenda.objects.create(fecha_desde=self.lunes, fecha_hasta=self.lunes, motivo='Feriado')
+        self.assertEqual(self.client.get(reverse('slots-por-fecha'), dia).data, [])
+
+    @override_settings(AGENDA_HORIZONTE_DIAS=14)
+    def test_slots_disponibles_pagina_bloques_de_plantilla(self):
+        otro = Dentista.objects.create(nombre='Ana', apellido='Plantilla')
+        PlantillaHorario.objects.create(dentista=otro, dia_semana=0, desde=time(9, 0), hasta=time(9, 30))
+        SlotAgenda.objects.create(dentista=otro, fecha=self.lunes, hora=time(12, 0))
+        completo = self.client.get(reverse('slots-disponibles')).data
+        # Dentro de una hora, los bloques sin slot van por -dentista_id y antes que los slots
+        lunes = [(f['hora'], f['dentista_id'], f['id']) for f in completo if f['fecha'] == self.lunes.isoformat()]
+        self.assertEqual(lunes, [
+            ('09:00:00', otro.id, None), ('09:00:00', self.dentista.id, None), ('09:30:00', otro.id, None),
+            ('10:00:00', self.dentista.id, None), ('12:00:00', otro.id, SlotAgenda.objects.get().id),
+        ])
+
+        paginado, params = [], {'page_size': 2}
+        while True:
+            r = self.client.get(reverse('slots-disponibles'), params)
+            paginado += r.data
+            if 'X-Next-Cursor' not in r:
+                break
+            params = {'page_size': 2, 'cursor': r['X-Next-Cursor']}
+        self.assertEqual(paginado, completo)
+
+    def test_pagina_tardia_no_carga_el_horizonte(self):
+        # Los bloques de una página se generan desde su cursor y el estado se carga por ventana de días
+        consultas, params = [], {'page_size': 2}
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                r = self.client.get(reverse('slots-disponibles'), params)
+            consultas.append([q['sql'] for q in ctx.captured_queries])
+            if 'X-Next-Cursor' not in r:
+                break
+            params = {'page_size': 2, 'cursor': r['X-Next-Cursor']}
+        self.assertGreater(len(consultas), 10)
+        self.assertLessEqual(max(len(c) for c in consultas), len(consultas[0]))
+        # La última página no vuelve a leer el estado (slots materializados y sobrecupos) desde hoy
+        hoy = timezone.localdate().isoformat()
+        estado = [sql for sql in consultas[-1] if 'BETWEEN' in sql]
+        self.assertEqual(len(estado), 2)
+        self.assertFalse(any(hoy in sql for sql in estado))
+
+    def test_huecos_con_excepcion(self):
+        params = {'servicio': self.larga.id, 'desde': self.lunes.isoformat(), 'hasta': self.lunes.isoformat()}
+        self.assertEqual(self.client.get(reverse('huecos'), params).data['huecos'], [])
+        self.excepcion.delete()
+        self.assertEqual(self.client.get(reverse('huecos'), params).data['huecos'], [
+            {'dentista': self.dentista.id, 'fecha': self.lunes.isoformat(), 'horas': ['09:00', '09:30']},
+        ])
+
+    def test_reserva_materializa_slot(self):
+        r = self.reservar('10:00')
+        self.assertEqual(r.status_code, 201)
+        slot = SlotAgenda.objects.get()
+        self.assertEqual((slot.hora, slot.capacidad, slot.max_overbook, slot.reservas_normales), (time(10, 0), 2, 1, 1))
+
+        self.assertEqual(self.reservar('09:30').data['detail'], 'El dentista no atiende en ese horario.')
+        self.assertEqual(self.reservar('12:00').status_code, 400)
+        # 10:30 está fuera de la plantilla: el tramo no se completa ni se crea
+        otro = Paciente.objects.create(nombre='Otro', apellido='Plantilla')
+        self.assertEqual(self.reservar('10:00', self.larga, otro).status_code, 400)
+        self.assertEqual(SlotAgenda.objects.count(), 1)
+
+        self.excepcion.delete()
+        r = self.reservar('09:00', self.larga)
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(Reserva.objects.get(pk=r.data['id']).slots_continuacion.get().hora, time(9, 30))
+
+    def test_feriado_anula_slots_materializados(self):
+        self.assertEqual(self.reservar('10:00').status_code, 201)
+        slot = SlotAgenda.objects.get(hora=time(10, 0))
+        ExcepcionAgenda.objects.create(fecha_desde=self.lunes, fecha_hasta=self.lunes, motivo='Feriado')
+
+        otro = Paciente.objects.create(nombre='Otro', apellido='Plantilla')
+        self.assertEqual(self.reservar('10:00', paciente=otro).data['detail'], MENSAJE_FUERA_DE_HORARIO)
+        for modo in ('bloqueo', 'optimista'):
+            with override_settings(AGENDA_RESERVA_MODO=modo), self.assertRaises(ReservaRechazada):
+                admitir_reserva(slot, otro)
+        slot.refresh_from_db()
+        self.assertEqual(slot.reservas_normales, 1)
+
+        dia = {'desde': self.lunes.isoformat(), 'hasta': self.lunes.isoformat()}
+        self.assertEqual(self.client.get(reverse('disponibilidad'), dia).data['dentistas'], [])
+        r = self.client.get(reverse('proxima-disponible'), {'desde': self.lunes.isoformat(), 'k': 1})
+        self.assertEqual(r.data['resultados'][0]['fecha'], (self.lunes + timedelta(days=7)).isoformat())
+
+    def test_licencia_de_dentista_sin_plantillas(self):
+        sin_plantilla = Dentista.objects.create(nombre='Ana', apellido='Libre')
+        existente = SlotAgenda.objects.create(dentista=sin_plantilla, fecha=self.lunes, hora=time(11, 0))
+        ExcepcionAgenda.objects.create(dentista=sin_plantilla, fecha_desde=self.lunes, fecha_hasta=self.lunes,
+                                       motivo='Licencia')
+
+        r = self.client.post(reverse('crear-reserva'), {
+            'dentista': sin_plantilla.id, 'fecha': self.lunes.isoformat(), 'hora_inicio': '12:00',
+            'paciente': self.paciente.id,
+        }, format='json')
+        self.assertEqual(r.data['detail'], MENSAJE_FUERA_DE_HORARIO)
+        r = self.client.post('/agenda/api/reservas/batch/', [
+            {'dentista': sin_plantilla.id, 'fecha': self.lunes.isoformat(), 'hora_inicio': '12:00',
+             'paciente': self.paciente.id},
+            {'slot': existente.id, 'paciente': self.paciente.id},
+        ], format='json')
+        self.assertEqual([x['errores'] for x in r.data['resultados']],
+                         [{'detail': MENSAJE_FUERA_DE_HORARIO}] * 2)
+        self.assertEqual(list(SlotAgenda.objects.filter(dentista=sin_plantilla)), [existente])
+        r = self.client.get(reverse('disponibilidad'), {
+            'desde': self.lunes.isoformat(), 'hasta': self.lunes.isoformat(), 'dentistas': sin_plantilla.id,
+        })
+        self.assertEqual(r.data['dentistas'], [])
+
+        # El día siguiente no está cubierto
+        r = self.client.post(reverse('crear-reserva'), {
+            'dentista': sin_plantilla.id, 'fecha': (self.lunes + timedelta(days=1)).isoformat(),
+            'hora_inicio': '12:00', 'paciente': self.paciente.id,
+        }, format='json')
+        self.assertEqual(r.status_code, 201)
+
+    def test_lote_fuera_de_horario(self):
+        items = [
+            {'dentista': self.dentista.id, 'fecha': self.lunes.isoformat(), 'hora_inicio': hora, 'paciente': self.paciente.id}
+            for hora in ('10:00', '12:00')
+        ]
+        # 09:30 está bloqueada por la excepción: el tramo no se completa y no deja el slot de 09:00
+        otro = Paciente.objects.create(nombre='Otro', apellido='Plantilla')
+        items.append({'dentista': self.dentista.id, 'fecha': self.lunes.isoformat(), 'hora_inicio': '09:00',
+                      'paciente': otro.id, 'servicio': self.larga.id})
+        r = self.client.post('/agenda/api/reservas/batch/', items, format='json')
+        self.assertEqual(r.data['creadas'], 1)
+        self.assertEqual(r.data['resultados'][1]['errores'], {'detail': 'El dentista no atiende en ese horario.'})
+        self.assertEqual(r.data['resultados'][2]['errores'], {'detail': MENSAJE_SIN_TRAMO})
+        self.assertEqual(SlotAgenda.objects.get().capacidad, 2)
+
+    def test_api_valida_plantilla(self):
+        datos = {'dentista': self.dentista.id, 'dia_semana': 1, 'desde': '12:00', 'hasta': '09:00'}
+        self.assertEqual(self.client.post('/agenda/api/plantillas/', datos, format='json').status_code, 400)
+        datos['hasta'] = '13:00'
+        self.assertEqual(self.client.post('/agenda/api/plantillas/', datos, format='json').status_code, 201)
+        r = self.client.get('/agenda/api/excepciones/', {'dentista': self.dentista.id})
+        self.assertEqual([e['motivo'] for e in r.data], ['Reunión'])
+
+
+class ReservaConcurrencyTest(TransactionTestCase):
+    """Muchos hilos reservando el mismo slot: nunca se supera capacidad + max_overbook."""
+    HILOS = 16
+
+    def setUp(self):
+        self.dentista = Dentista.objects.create(nombre='Ines', apellido='Paz', max_overbook_day=1)
+        self.slot = SlotAgenda.objects.create(
+            dentista=self.dentista, fecha=timezone.localdate(), hora=time(15, 0), capacidad=3, max_overbook=2
+        )
+        self.pacientes = [Paciente.objects.create(nombre=f'P{i}', apellido='Hilo') for i in range(self.HILOS)]
+
+    def martillar(self):
+        barrera = threading.Barrier(self.HILOS)
+        resultados = []
+
+        def reservar(paciente):
+            try:
+                barrera.wait()
+                for _ in range(20):
+                    try:
+                        reserva = admitir_reserva(self.slot, paciente)
+                        resultados.append(reserva.sobrecupo)
+                        return
+                    except OperationalError:
+                        # SQLite: "database is locked" bajo escritura concurrente → reintentar
+                        pytime.sleep(0.01)
+            except ReservaRechazada:
+                resultados.append(None)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=reservar, args=(p,)) for p in self.pacientes]
+        for h in hilos:
+            h.start()
+        for h in hilos:
+            h.join()
+        return resultados
+
+    def verificar(self, resultados):
+        self.slot.refresh_from_db()
+        normales = Reserva.objects.filter(slot=self.slot, sobrecupo=False).count()
+        sobrecupos = Reserva.objects.filter(slot=self.slot, sobrecupo=True).count()
+        self.assertLessEqual(normales, self.slot.capacidad)
+        self.assertLessEqual(sobrecupos, min(self.slot.max_overbook, self.dentista.max_overbook_day))
+        self.assertEqual((self.slot.reservas_normales, self.slot.reservas_sobrecupo), (normales, sobrecupos))
+        self.assertEqual(resultados.count(False), normales)
+        self.assertEqual(resultados.count(True), sobrecupos)
+        self.assertGreater(normales, 0)
+
+    def test_locked_mode(self):
+        with override_settings(AGENDA_RESERVA_MODO='bloqueo'):
+            self.verificar(self.martillar())
+
+    def test_optimistic_mode(self):
+        with override_settings(AGENDA_RESERVA_MODO='optimista'):
+            self.verificar(self.martillar())
+
+
+class ReservaBatchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Olga', apellido='Rey')
+        self.servicio = Servicio.objects.create(nombre='Control', duracion_min=30, precio=20)
+        self.pacientes = [Paciente.objects.create(nombre=f'P{i}', apellido='Lote') for i in range(5)]
+        self.slot = SlotAgenda.objects.create(dentista=self.dentista, fecha=timezone.localdate(), hora=time(9, 0))
+
+    def test_batch_partial_failure(self):
+        fecha = timezone.localdate().isoformat()
+        payload = [
+            {'slot': self.slot.id, 'paciente': self.pacientes[0].id, 'servicio': self.servicio.id},
+            {'slot': self.slot.id, 'paciente': self.pacientes[1].id},  # lleno
+            {'dentista': self.dentista.id, 'fecha': fecha, 'hora_inicio': '10:00', 'paciente': self.pacientes[2].id},
+            {'dentista': self.dentista.id, 'fecha': fecha, 'hora_inicio': '10:00', 'paciente': self.pacientes[3].id},
+            {'dentista': self.dentista.id, 'fecha': fecha, 'hora_inicio': '07:00', 'paciente': self.pacientes[4].id},
+            {'slot': self.slot.id, 'paciente': 999999},
+            {'paciente': self.pacientes[4].id},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.post('/agenda/api/reservas/batch/', payload, format='json')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([x['ok'] for x in r.data['resultados']], [True, False, True, False, False, False, False])
+        self.assertEqual(r.data['creadas'], 2)
+        self.assertEqual(Reserva.objects.count(), 2)
+        self.assertTrue(SlotAgenda.objects.filter(dentista=self.dentista, hora=time(10, 0)).exists())
+        self.assertLess(len(ctx.captured_queries), 40)
+
+    def test_batch_no_cuenta_duplicados(self):
+        admitir_reserva(self.slot, self.pacientes[0])
+        payload = [
+            {'slot': self.slot.id, 'paciente': self.pacientes[0].id},
+            {'dentista': self.dentista.id, 'fecha': timezone.localdate().isoformat(), 'hora_inicio': '10:00',
+             'paciente': self.pacientes[1].id},
+        ]
+        r = self.client.post('/agenda/api/reservas/batch/', payload, format='json')
+        self.assertEqual([x['created'] for x in r.data['resultados']], [False, True])
+        self.assertEqual((r.data['creadas'], r.data['existentes'], r.data['rechazadas']), (1, 1, 0))
+
+    def test_batch_crea_el_tramo_como_la_reserva_individual(self):
+        larga = Servicio.objects.create(nombre='Endodoncia', duracion_min=60, precio=90)
+        fecha = timezone.localdate().isoformat()
+        r = self.client.post('/agenda/api/reservas/batch/', [
+            {'dentista': self.dentista.id, 'fecha': fecha, 'hora_inicio': '11:00',
+             'paciente': self.pacientes[0].id, 'servicio': larga.id},
+            {'dentista': self.dentista.id, 'fecha': fecha, 'hora_inicio': '18:00',
+             'paciente': self.pacientes[1].id, 'servicio': larga.id},
+        ], format='json')
+        self.assertEqual([x['ok'] for x in r.data['resultados']], [True, False])
+        self.assertEqual(r.data['resultados'][1]['errores'], {'detail': MENSAJE_SIN_TRAMO})
+        individual = self.client.post(reverse('crear-reserva'), {
+            'dentista': self.dentista.id, 'fecha': fecha, 'hora_inicio': '13:00',
+            'paciente': self.pacientes[2].id, 'servicio': larga.id,
+        }, format='json')
+        self.assertEqual(individual.status_code, 201)
+
+        lote = Reserva.objects.get(paciente=self.pacientes[0])
+        self.assertEqual(lote.slots_continuacion.get().hora, time(11, 30))
+        self.assertEqual(
+            Reserva.objects.get(pk=individual.data['id']).slots_continuacion.get().hora, time(13, 30),
+        )
+        # El tramo de 18:00 no cabe en el día: no se crea ningún slot
+        self.assertEqual(
+            sorted(SlotAgenda.objects.values_list('hora', 'capacidad', 'max_overbook')),
+            [(time(9, 0), 1, 0), (time(11, 0), 1, 0), (time(11, 30), 1, 0), (time(13, 0), 1, 0), (time(13, 30), 1, 0)],
+        )
+
+    def test_slots_creados_por_el_lote_invalidan_el_dia(self):
+        hoy = timezone.localdate()
+        dia = {'fecha': hoy.isoformat(), 'dentista_id': self.dentista.id}
+        self.assertEqual([f['hora'] for f in self.client.get(reverse('slots-por-fecha'), dia).data], ['09:00:00'])
+        item = {'dentista': self.dentista.id, 'fecha': hoy, 'hora_inicio': time(10, 0)}
+        slot = _resolver_slots_por_clave([(0, item, self.servicio)])[0]
+        r = self.client.get(reverse('slots-por-fecha'), dia)
+        self.assertEqual([(f['id'], f['hora']) for f in r.data], [(self.slot.id, '09:00:00'), (slot.id, '10:00:00')])
+
+    def test_batch_requires_list(self):
+        r = self.client.post('/agenda/api/reservas/batch/', {'reservas': 'x'}, format='json')
+        self.assertEqual(r.status_code, 400)
+
+
+class ReservaTracingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Tito', apellido='Lara')
+        self.paciente = Paciente.objects.create(nombre='Ana', apellido='Traza')
+
+    def reservar(self):
+        payload = {'dentista': self.dentista.id, 'fecha': timezone.localdate().isoformat(),
+                   'hora_inicio': '09:30', 'paciente': self.paciente.id}
+        return self.client.post(reverse('crear-reserva'), payload, format='json')
+
+    @override_settings(AGENDA_TRACE_SAMPLE_RATE=1.0)
+    def test_sampled_trace_has_phases(self):
+        with self.assertLogs('agenda.tracing', level='INFO') as logs:
+            self.assertEqual(self.reservar().status_code, 201)
+        registro = logs.records[0]
+        self.assertEqual(registro.traza, 'reserva')
+        self.assertEqual(registro.resultado, 'ok')
+        self.assertTrue({'lookup', 'slot', 'lock', 'insert'} <= set(registro.fases_ms))
+        self.assertIn('"fases_ms"', TrazaJSONFormatter().format(registro))
+
+    @override_settings(AGENDA_TRACE_SAMPLE_RATE=0.0)
+    def test_unsampled_emits_nothing(self):
+        with self.assertNoLogs('agenda.tracing'):
+            self.assertEqual(self.reservar().status_code, 201)
+
+
+class EndpointBudgetTests(TestCase):
+    """Presupuesto de consultas SQL y latencia p95 por endpoint sobre un dataset realista.
+
+    Detecta regresiones N+1 (p.ej. un `StringRelatedField` sin `select_related`). Los
+    techos de latencia se pueden escalar en máquinas lentas con AGENDA_LATENCY_FACTOR.
+    """
+    REGIONES = 3
+    DENTISTAS_POR_REGION = 3
+    DIAS = 15
+    PACIENTES = 300
+    REPETICIONES = 5
+    FACTOR_LATENCIA = float(os.environ.get('AGENDA_LATENCY_FACTOR', '1'))
+
+    @classmethod
+    def setUpTestData(cls):
+        hoy = timezone.localdate()
+        servicios = [Servicio.objects.create(nombre=f'Servicio {i}', duracion_min=30, precio=20 + i) for i in range(3)]
+        dentistas = []
+        for r in range(cls.REGIONES):
+            region = Region.objects.create(nombre=f'Region {r}', codigo=f'R{r}')
+            for d in range(cls.DENTISTAS_POR_REGION):
+                dentistas.append(Dentista.objects.create(
+                    nombre=f'D{r}{d}', apellido='Carga', especialidad='General', region=region, max_overbook_day=2,
+                ))
+        generate_slots_bulk(dentistas, hoy, hoy + timedelta(days=cls.DIAS - 1), desde='08:00', hasta='18:00')
+        SlotAgenda.objects.filter(hora__lt=time(12, 0)).update(servicio=servicios[0])
+        pacientes = Paciente.objects.bulk_create([
+            Paciente(rut=f'{10000000 + i}-{i % 10}', nombre=f'P{i}', apellido='Carga') for i in range(cls.PACIENTES)
+        ])
+        # Aproximadamente un tercio de los slots con una reserva
+        slots = list(SlotAgenda.objects.order_by('pk').values_list('pk', flat=True)[::3])
+        Reserva.objects.bulk_create([
+            Reserva(slot_id=slot_id, paciente=pacientes[i % len(pacientes)], servicio=servicios[i % 3])
+            for i, slot_id in enumerate(slots)
+        ])
+        SlotAgenda.objects.filter(pk__in=slots).update(reservas_normales=1)
+        cls.dentista = dentistas[0]
+        cls.paciente = pacientes[0]
+        cls.hoy = hoy
+
+    def setUp(self):
+        self.client = APIClient()
+        get_cache().clear()
+
+    def medir(self, metodo, url, data=None, max_queries=None, p95_ms=None, repeticiones=None, status_code=200):
+        repeticiones = repeticiones or self.REPETICIONES
+        # La basura de tests anteriores no debe cobrarse como una pausa del GC dentro de la medición
+        gc.collect()
+        tiempos = []
+        for i in range(repeticiones):
+            cuerpo = data(i) if callable(data) else data
+            with CaptureQueriesContext(connection) as ctx:
+                t0 = pytime.perf_counter()
+                r = getattr(self.client, metodo)(url, cuerpo, format='json' if metodo == 'post' else None)
+                tiempos.append((pytime.perf_counter() - t0) * 1000)
+            self.assertEqual(r.status_code, status_code, url)
+            self.assertLessEqual(len(ctx.captured_queries), max_queries,
+                                 f'{url}: {len(ctx.captured_queries)} consultas (máx {max_queries})')
+        tiempos.sort()
+        p95 = tiempos[min(len(tiempos) - 1, int(round(0.95 * (len(tiempos) - 1))))]
+        self.assertLessEqual(p95, p95_ms * self.FACTOR_LATENCIA, f'{url}: p95 {p95:.1f}ms (máx {p95_ms}ms)')
+        return r
+
+    def test_slots_disponibles(self):
+        # Slots + plantillas (sin plantillas no se consulta nada más)
+        self.medir('get', reverse('slots-disponibles'), max_queries=2, p95_ms=500)
+
+    def test_slots_por_fecha(self):
+        # Sello de revisión del día + slots y plantillas del día (en frío; luego solo el sello)
+        self.medir('get', reverse('slots-por-fecha'), {'fecha': self.hoy.isoformat()}, max_queries=3, p95_ms=300)
+        self.medir('get', reverse('slots-por-fecha'), {'fecha': self.hoy.isoformat(), 'dentista_id': self.dentista.id},
+                   max_queries=3, p95_ms=100)
+
+    def test_generar_slots(self):
+        url = reverse('generar-slots', kwargs={'dentista_id': self.dentista.id})
+        fecha = (self.hoy + timedelta(days=self.DIAS + 5)).isoformat()
+        # Incluye crear e incrementar los sellos de revisión de los días nuevos (3 consultas)
+        self.medir('post', url, {'fecha': fecha, 'dias': 7}, max_queries=10, p95_ms=300, status_code=201)
+
+    def test_crear_reserva(self):
+        hora = SlotAgenda.objects.filter(dentista=self.dentista, fecha=self.hoy, reservas_normales=0).first()
+        SlotAgenda.objects.filter(pk=hora.pk).update(capacidad=self.REPETICIONES)
+        pacientes = list(Paciente.objects.values_list('pk', flat=True)[:self.REPETICIONES])
+        self.medir('post', reverse('crear-reserva'), lambda i: {'slot': hora.id, 'paciente': pacientes[i]},
+                   max_queries=12, p95_ms=200, status_code=201)
+
+    def test_router_endpoints(self):
+        # Regiones, dentistas y servicios consultan además su sello de revisión; las reservas sin
+        # `fecha` devuelven una página (AGENDA_SLOTS_PAGE_SIZE) y no todo el historial
+        presupuestos = {
+            'regiones': (2, 100),
+            'dentistas': (2, 100),
+            'servicios': (2, 100),
+            'pacientes': (1, 300),
+            'reservas': (1, 300),
+        }
+        for recurso, (max_queries, p95_ms) in presupuestos.items():
+            with self.subTest(recurso=recurso):
+                self.medir('get', f'/agenda/api/{recurso}/', max_queries=max_queries, p95_ms=p95_ms)
+
+    def test_disponibilidad(self):
+        # Slots y plantillas
+        self.medir('get', reverse('disponibilidad'), {'desde': self.hoy.isoformat()}, max_queries=2, p95_ms=300)
+
+    def test_reservas_filtradas(self):
+        self.medir('get', '/agenda/api/reservas/', {'dentista': self.dentista.id, 'fecha': self.hoy.isoformat()},
+                   max_queries=2, p95_ms=100)
+
+
+class SlotProjectionTest(TestCase):
+    def test_projection_matches_model_serializer(self):
+        dentista = Dentista.objects.create(nombre='Raul', apellido='Mena', especialidad='Endodoncia')
+        servicio = Servicio.objects.create(nombre='Endodoncia', duracion_min=60, precio=90)
+        hoy = timezone.localdate()
+        SlotAgenda.objects.create(dentista=dentista, servicio=servicio, fecha=hoy, hora=time(8, 30), max_overbook=1)
+        SlotAgenda.objects.create(dentista=dentista, fecha=hoy, hora=time(9, 0), capacidad=2)
+        qs = SlotAgenda.objects.order_by('hora')
+        esperado = json.loads(json.dumps(SlotAgendaSerializer(qs, many=True).data))
+        self.assertEqual(serializar_slots(qs), esperado)
+
+        r = APIClient().get(reverse('slots-por-fecha'), {'fecha': hoy.isoformat()})
+        self.assertEqual(json.loads(r.content), esperado)
+
+
+class SlotsCursorPaginationTest(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.d1 = Dentista.objects.create(nombre='Ana', apellido='Cursor')
+        self.d2 = Dentista.objects.create(nombre='Beto', apellido='Cursor')
+        hoy = timezone.localdate()
+        generate_slots_bulk([self.d1, self.d2], hoy, hoy + timedelta(days=2), desde='08:00', hasta='10:00')
+
+    def test_pages_cover_all_slots_in_order(self):
+        vistos = []
+        params = {'page_size': 7}
+        paginas = 0
+        while True:
+            r = self.client.get(reverse('slots-disponibles'), params)
+            self.assertEqual(r.status_code, 200)
+            self.assertLessEqual(len(r.data), 7)
+            vistos.extend(s['id'] for s in r.data)
+            paginas += 1
+            if 'X-Next-Cursor' not in r:
+                break
+            self.assertIn('rel="next"', r['Link'])
+            params = {'page_size': 7, 'cursor': r['X-Next-Cursor']}
+        esperado = list(SlotAgenda.objects.order_by('fecha', 'hora', 'id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperado)
+        self.assertEqual(paginas, 5)  # 30 slots / 7 por página
+
+    def test_filters_and_page_size_cap(self):
+        r = self.client.get(reverse('slots-disponibles'), {
+            'dentista_id': self.d2.id, 'fecha': timezone.localdate().isoformat(), 'page_size': 100000,
+        })
+        self.assertEqual(len(r.data), 5)
+        with self.settings(AGENDA_SLOTS_PAGE_SIZE_MAX=3):
+            r = self.client.get(reverse('slots-disponibles'), {'page_size': 100})
+        self.assertEqual(len(r.data), 3)
+        self.assertEqual(self.client.get(reverse('slots-disponibles'), {'cursor': 'xx'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('slots-disponibles'), {'fecha': 'hoy'}).status_code, 400)
+        r = self.client.get(reverse('slots-disponibles'), {'dentista_id': 'x'})
+        self.assertEqual(r.data['detail'], 'dentista_id debe ser un ID numérico.')
+
+    def test_pagina_por_defecto(self):
+        with self.settings(AGENDA_SLOTS_PAGE_SIZE=7):
+            r = self.client.get(reverse('slots-disponibles'))
+            self.assertEqual(len(r.data), 7)
+            self.assertIn('X-Next-Cursor', r)
+            r = self.client.get(reverse('slots-disponibles'), {'fecha': timezone.localdate().isoformat()})
+            self.assertEqual(len(r.data), 7)
+        with self.settings(AGENDA_SLOTS_PAGE_SIZE=100, AGENDA_SLOTS_PAGE_SIZE_MAX=3):
+            self.assertEqual(len(self.client.get(reverse('slots-disponibles')).data), 3)
+
+    def test_reservas_paginadas(self):
+        slots = list(SlotAgenda.objects.order_by('-fecha', 'hora')[:9])
+        for i, slot in enumerate(slots):
+            Reserva.objects.create(slot=slot, paciente=Paciente.objects.create(nombre=f'P{i}', apellido='Cursor'))
+        vistos, params = [], {'page_size': 4}
+        while True:
+            r = self.client.get('/agenda/api/reservas/', params)
+            vistos.extend(x['id'] for x in r.data)
+            if 'X-Next-Cursor' not in r:
+                break
+            params = {'page_size': 4, 'cursor': r['X-Next-Cursor']}
+        esperado = Reserva.objects.order_by('slot__fecha', 'slot__hora', 'id').values_list('id', flat=True)
+        self.assertEqual(vistos, list(esperado))
+        # Las reservas de un día siguen completas (desde la caché)
+        r = self.client.get('/agenda/api/reservas/', {'fecha': slots[0].fecha.isoformat(), 'page_size': 1})
+        self.assertEqual(len(r.data), Reserva.objects.filter(slot__fecha=slots[0].fecha).count())
+
+
+class ExplainHotQueriesTest(TestCase):
+    def test_command_explains_every_view_query(self):
+        Dentista.objects.create(nombre='Plan', apellido='Query')
+        out = StringIO()
+        call_command('explain_hot_queries', stdout=out)
+        salida = out.getvalue()
+        self.assertIn('== slots_por_fecha (fecha + dentista)', salida)
+        self.assertIn('== reservas (dentista + fecha)', salida)
+        for nombre in ('disponibilidad (semana)', 'plantillas vigentes', 'plantillas: slots materializados',
+                       'admisión: bloqueo del tramo'):
+            self.assertIn(f'== {nombre}', salida)
+        # El plan de slots_por_fecha es el de la consulta de la vista, que omite los slots exceptuados
+        plan = salida.split('== slots_por_fecha (fecha + dentista)')[1].split('==')[0]
+        self.assertIn('agenda_excepcionagenda', plan.lower())
+        self.assertIn('consultas con recorrido completo de tabla', salida)
+
+
+class DisponibilidadMatrizTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.region = Region.objects.create(nombre='Sur', codigo='S')
+        self.d1 = Dentista.objects.create(nombre='Ana', apellido='Grid', region=self.region, max_overbook_day=1)
+        self.d2 = Dentista.objects.create(nombre='Beto', apellido='Grid')
+        self.hoy = timezone.localdate()
+        self.libre = SlotAgenda.objects.create(dentista=self.d1, fecha=self.hoy, hora=time(8, 0))
+        self.lleno = SlotAgenda.objects.create(dentista=self.d1, fecha=self.hoy, hora=time(8, 30))
+        self.sobre = SlotAgenda.objects.create(dentista=self.d1, fecha=self.hoy, hora=time(18, 0), max_overbook=1)
+        SlotAgenda.objects.filter(pk__in=[self.lleno.pk, self.sobre.pk]).update(reservas_normales=1)
+        SlotAgenda.objects.create(dentista=self.d2, fecha=self.hoy + timedelta(days=1), hora=time(9, 0))
+
+    def test_matrix_states_two_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(reverse('disponibilidad'), {
+                'desde': self.hoy.isoformat(), 'hasta': (self.hoy + timedelta(days=1)).isoformat(),
+            })
+        self.assertEqual(r.status_code, 200)
+        # Slots y plantillas (sin plantillas no se consulta nada más)
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertEqual(r.data['dentistas'], [self.d1.id, self.d2.id])
+        fila = decodificar_fila(r.data['matriz'][0][0])
+        self.assertEqual(fila[:3], [1, 2, 0])
+        self.assertEqual(fila[-1], 3)
+        self.assertEqual(set(decodificar_fila(r.data['matriz'][0][1])), {0})
+        self.assertEqual(decodificar_fila(r.data['matriz'][1][1])[2], 1)
+
+    def test_overbook_exhausted_by_daily_ledger(self):
+        SobrecupoDia.objects.create(dentista=self.d1, fecha=self.hoy, sobrecupos_usados=1)
+        r = self.client.get(reverse('disponibilidad'), {'desde': self.hoy.isoformat(), 'region': self.region.id})
+        self.assertEqual(r.data['dentistas'], [self.d1.id])
+        self.assertEqual(decodificar_fila(r.data['matriz'][0][0])[-1], 2)
+
+    def test_invalid_range(self):
+        r = self.client.get(reverse('disponibilidad'), {'desde': self.hoy.isoformat(), 'hasta': '2000-01-01'})
+        self.assertEqual(r.status_code, 400)
+
+
+class AgendaCacheTest(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Ana', apellido='Perez', especialidad='General')
+        self.paciente = Paciente.objects.create(nombre='Juan', apellido='Lopez')
+        self.hoy = timezone.localdate()
+        self.slot = SlotAgenda.objects.create(dentista=self.dentista, fecha=self.hoy, hora=time(10, 0), capacidad=1)
+        self.url = reverse('slots-por-fecha') + f'?fecha={self.hoy.isoformat()}&dentista_id={self.dentista.id}'
+
+    def assertSoloSello(self, ctx):
+        # El sello de revisión se lee de la base en cada petición; el cuerpo sale de la caché
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('revisionrecurso', ctx.captured_queries[0]['sql'])
+
+    def test_segunda_lectura_solo_lee_el_sello(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(self.url)
+        self.assertEqual(r.status_code, 200)
+        self.assertSoloSello(ctx)
+        self.assertGreaterEqual(get_cache().estadisticas()['aciertos'], 1)
+
+    def test_escritura_de_otro_proceso(self):
+        # Otro proceso incrementa el sello en la base pero no puede invalidar esta caché local
+        self.client.get(self.url)
+        SlotAgenda.objects.filter(pk=self.slot.pk).update(reservas_normales=1)
+        revisiones.incrementar_dias([(self.dentista.id, self.hoy)])
+        self.assertEqual(self.client.get(self.url).json()[0]['reservas_normales'], 1)
+
+    def test_reserva_invalida_el_dia(self):
+        antes = self.client.get(self.url).json()
+        self.assertEqual(antes[0]['reservas_normales'], 0)
+        admitir_reserva(self.slot, self.paciente)
+        self.assertEqual(self.client.get(self.url).json()[0]['reservas_normales'], 1)
+        # La vista de todos los dentistas del día también se invalida
+        r = self.client.get(reverse('slots-disponibles') + f'?fecha={self.hoy.isoformat()}')
+        self.assertEqual(r.json()[0]['reservas_normales'], 1)
+        Reserva.objects.get().delete()
+        self.assertEqual(self.client.get(self.url).json()[0]['reservas_normales'], 0)
+
+    def test_generar_slots_invalida_el_dia(self):
+        self.assertEqual(len(self.client.get(self.url).json()), 1)
+        generate_slots_bulk([self.dentista], self.hoy, self.hoy, desde='11:00', hasta='12:00')
+        self.assertEqual(len(self.client.get(self.url).json()), 4)
+
+    def test_reservas_del_dia_cacheadas(self):
+        url = f'/agenda/api/reservas/?fecha={self.hoy.isoformat()}&dentista={self.dentista.id}'
+        self.assertEqual(self.client.get(url).json(), [])
+        admitir_reserva(self.slot, self.paciente)
+        datos = self.client.get(url).json()
+        self.assertEqual(len(datos), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).json(), datos)
+        self.assertSoloSello(ctx)
+
+    @override_settings(AGENDA_CACHE={'BACKEND': 'locmem', 'MAX_ENTRIES': 2})
+    def test_lru_desaloja_la_entrada_menos_usada(self):
+        cache = get_cache()
+        for i in range(3):
+            cache.get_or_set('slots', i, self.hoy, lambda: [])
+        estadisticas = cache.estadisticas()
+        self.assertEqual(estadisticas['entradas'], 2)
+        self.assertEqual(estadisticas['desalojos'], 1)
+
+    @override_settings(AGENDA_CACHE={'BACKEND': 'locmem', 'TIMEOUT': 0})
+    def test_locmem_expira(self):
+        cache = get_cache()
+        cache.get_or_set('slots', 1, self.hoy, lambda: [1])
+        self.assertEqual(cache.get_or_set('slots', 1, self.hoy, lambda: [2]), [2])
+
+    def test_sello_distinto_es_fallo(self):
+        # Una carga que termina después de una invalidación no se sirve con el sello nuevo
+        cache = get_cache()
+        cache.get_or_set('slots', 1, self.hoy, lambda: ['viejo'], sello='v1')
+        self.assertEqual(cache.get_or_set('slots', 1, self.hoy, lambda: ['nuevo'], sello='v2'), ['nuevo'])
+        self.assertEqual(cache.get_or_set('slots', 1, self.hoy, lambda: ['otro'], sello='v2'), ['nuevo'])
+
+    def test_editar_paciente_invalida_solo_sus_dias(self):
+        url = f'/agenda/api/reservas/?fecha={self.hoy.isoformat()}&dentista={self.dentista.id}'
+        admitir_reserva(self.slot, self.paciente)
+        self.client.get(url)
+        entradas = get_cache().estadisticas()['entradas']
+        self.paciente.nombre = 'Juana'
+        self.paciente.save()
+        self.assertEqual(self.client.get(url).json()[0]['paciente']['nombre'], 'Juana')
+        Paciente.objects.create(nombre='Otro', apellido='Sin reservas').save()
+        self.assertEqual(get_cache().estadisticas()['entradas'], entradas)
+
+    @override_settings(AGENDA_CACHE={'BACKEND': 'django', 'TIMEOUT': 60})
+    def test_backend_django(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+        self.assertSoloSello(ctx)
+        self.assertEqual(get_cache().estadisticas()['backend'], 'DjangoCacheBackend')
+
+        # Editar un dentista descarta las entradas por sello y clear() no vacía el resto del alias
+        from django.core.cache import cache as cache_django
+        cache_django.set('otra-app', 1)
+        self.dentista.especialidad = 'Ortodoncia'
+        self.dentista.save()
+        self.assertTrue(self.client.get(self.url).json()[0]['dentista'].endswith('Ortodoncia'))
+        get_cache().clear()
+        self.assertEqual(cache_django.get('otra-app'), 1)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+        self.assertGreater(len(ctx.captured_queries), 1)
+
+
+class RespuestaCondicionalTest(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.dentista = Dentista.objects.create(nombre='Ana', apellido='Perez', especialidad='General')
+        self.paciente = Paciente.objects.create(nombre='Juan', apellido='Lopez')
+        self.hoy = timezone.localdate()
+        self.slot = SlotAgenda.objects.create(dentista=self.dentista, fecha=self.hoy, hora=time(10, 0), capacidad=1)
+        self.url = reverse('slots-por-fecha') + f'?fecha={self.hoy.isoformat()}&dentista_id={self.dentista.id}'
+
+    def test_304_sin_consulta_principal(self):
+        r = self.client.get(self.url)
+        self.assertIn('ETag', r)
+        self.assertIn('Last-Modified', r)
+        get_cache().clear()
+        with CaptureQueriesContext(connection) as ctx:
+            r2 = self.client.get(self.url, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r2.status_code, 304)
+        self.assertEqual(r2['ETag'], r['ETag'])
+        # Solo el sello de revisión, sin la consulta de slots
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('revisionrecurso', ctx.captured_queries[0]['sql'])
+
+    def test_reserva_cambia_el_etag_del_dia(self):
+        etag = self.client.get(self.url)['ETag']
+        otro_dia = self.client.get(reverse('slots-por-fecha') + f'?fecha={(self.hoy + timedelta(days=1)).isoformat()}')
+        admitir_reserva(self.slot, self.paciente)
+        r = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r['ETag'], etag)
+        # Los demás días conservan su sello
+        r = self.client.get(reverse('slots-por-fecha') + f'?fecha={(self.hoy + timedelta(days=1)).isoformat()}',
+                            HTTP_IF_NONE_MATCH=otro_dia['ETag'])
+        self.assertEqual(r.status_code, 304)
+
+    def test_sello_de_todos_los_dentistas(self):
+        url = reverse('slots-por-fecha') + f'?fecha={self.hoy.isoformat()}'
+        etag = self.client.get(url)['ETag']
+        admitir_reserva(self.slot, self.paciente)
+        # Solo se escribe la fila del dentista; la vista de todos la reúne al leer
+        self.assertEqual(list(RevisionRecurso.objects.filter(recurso__startswith='slots:').values_list('recurso', flat=True)),
+                         [f'slots:{self.hoy.isoformat()}:{self.dentista.id}'])
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+
+    def test_catalogos(self):
+        r = self.client.get('/agenda/api/servicios/')
+        self.assertEqual(self.client.get('/agenda/api/servicios/', HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+        Servicio.objects.create(nombre='Limpieza', duracion_min=30, precio=30)
+        self.assertEqual(self.client.get('/agenda/api/servicios/', HTTP_IF_NONE_MATCH=r['ETag']).status_code, 200)
+        # Un cambio de región invalida el listado de dentistas, que la incluye
+        r = self.client.get('/agenda/api/dentistas/')
+        Region.objects.create(nombre='Norte', codigo='N')
+        self.assertEqual(self.client.get('/agenda/api/dentistas/', HTTP_IF_NONE_MATCH=r['ETag']).status_code, 200)
+
+
+def rut_valido(cuerpo):
+    return f'{cuerpo}-{digito_verificador_rut(str(cuerpo))}'
+
+
+class BusquedaPacientesTest(TestCase):
+    PACIENTES = 20000
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = '/agenda/api/pacientes/'
+
+    def test_rut_validado_y_normalizado(self):
+        r = self.client.post(self.url, {'rut': '12.345.678-5', 'nombre': 'Ana', 'apellido': 'Rojas'}, format='json')
+        self.assertEqual(r.status_code, 201, r.content)
+        self.assertEqual(r.json()['rut'], '12345678-5')
+        self.assertEqual(Paciente.objects.get().rut_normalizado, '123456785')
+        # Dígito verificador incorrecto
+        r = self.client.post(self.url, {'rut': '12.345.678-4', 'nombre': 'Ana', 'apellido': 'Rojas'}, format='json')
+        self.assertEqual(r.status_code, 400)
+        # Mismo RUT con otro formato
+        r = self.client.post(self.url, {'rut': '123456785', 'nombre': 'Otra', 'apellido': 'Rojas'}, format='json')
+        self.assertEqual(r.status_code, 400)
+
+    def test_admin_valida_rut(self):
+        Paciente.objects.create(rut='12.345.678-5', nombre='Ana', apellido='Rojas')
+        Formulario = site._registry[Paciente].get_form(RequestFactory().get('/'))
+        datos = {'nombre': 'Otra', 'apellido': 'Rojas', 'telefono': '', 'email': ''}
+        # Mismo RUT con otro formato: error del formulario, no IntegrityError
+        form = Formulario(data={**datos, 'rut': '123456785'})
+        self.assertEqual(form.errors['rut'], ['Ya existe un paciente con este RUT.'])
+        form = Formulario(data={**datos, 'rut': '12.345.678-4'})
+        self.assertEqual(form.errors['rut'], ['Dígito verificador del RUT inválido'])
+        form = Formulario(data={**datos, 'rut': '7.654.321-6'})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual((form.save().rut, Paciente.objects.get(nombre='Otra').rut_normalizado), ('7654321-6', '76543216'))
+
+    def test_busqueda_por_rut_nombre_y_email(self):
+        ana = Paciente.objects.create(rut='12.345.678-5', nombre='Ana', apellido='Muñoz', email='ana@clinica.cl')
+        Paciente.objects.create(rut=rut_valido(7654321), nombre='José', apellido='Pérez', email='jperez@correo.cl')
+
+        def ids(q):
+            return [p['id'] for p in self.client.get(self.url, {'q': q}).json()]
+        self.assertEqual(ids('12.345'), [ana.id])
+        self.assertEqual(ids('12345678-5'), [ana.id])
+        self.assertEqual(ids('an mu'), [ana.id])
+        self.assertEqual(ids('jperez'), [Paciente.objects.get(nombre='José').id])
+        self.assertEqual(ids('zzz'), [])
+        if fts_disponible():
+            # El índice FTS5 ignora las tildes; el respaldo istartswith no
+            self.assertEqual(ids('munoz'), [ana.id])
+            self.assertEqual(ids('jose perez'), [Paciente.objects.get(nombre='José').id])
+        self.assertEqual(len(self.client.get(self.url).json()), 2)
+
+    def test_indice_sincronizado(self):
+        paciente = Paciente.objects.create(rut=rut_valido(11111111), nombre='Luis', apellido='Soto')
+        paciente.apellido = 'Vera'
+        paciente.save()
+        self.assertEqual(self.client.get(self.url, {'q': 'soto'}).json(), [])
+        self.assertEqual(len(self.client.get(self.url, {'q': 'vera'}).json()), 1)
+        paciente.delete()
+        self.assertEqual(self.client.get(self.url, {'q': 'vera'}).json(), [])
+
+    def test_latencia_busqueda(self):
+        pacientes = Paciente.objects.bulk_create([
+            Paciente(rut=rut_valido(10000000 + i), rut_normalizado=rut_valido(10000000 + i).replace('-', ''),
+                     nombre=f'Nombre{i}', apellido=f'Apellido{i % 997}', email=f'p{i}@correo.cl')
+            for i in range(self.PACIENTES)
+        ])
+        indexar_pacientes(pacientes)
+        factor = float(os.environ.get('AGENDA_LATENCY_FACTOR', '1'))
+        for q in ('10012', '10012345-', 'apellido51 nombre512', 'p1999'):
+            tiempos = []
+            for _ in range(5):
+                with CaptureQueriesContext(connection) as ctx:
+                    t0 = pytime.perf_counter()
+                    r = self.client.get(self.url, {'q': q})
+                    tiempos.append((pytime.perf_counter() - t0) * 1000)
+                self.assertEqual(r.status_code, 200)
+                self.assertTrue(r.json(), q)
+                self.assertLessEqual(len(ctx.captured_queries), 2, q)
+            self.assertLessEqual(sorted(tiempos)[2], 10 * factor, f'{q}: mediana {sorted(tiempos)[2]:.1f}ms')
+
+
+class ImportPacientesTest(TestCase):
+    def setUp(self):
+        self.existente = Paciente.objects.create(rut=rut_valido(11111111), nombre='Ya', apellido='Existe')
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def escribir(self, nombre, contenido):
+        ruta = os.path.join(self.dir.name, nombre)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+        return ruta
+
+    def test_comando_csv(self):
+        filas = ['rut,nombre,apellido,telefono,email']
+        filas += [f'{rut_valido(20000000 + i)},Nombre{i},Apellido{i},,p{i}@correo.cl' for i in range(25)]
+        filas += [
+            f'{rut_valido(11111111)},Ya,Existe,,',           # ya existe en la base
+            '12.345.678-4,Mal,Verificador,,',                # dígito verificador inválido
+            f'{rut_valido(20000000)},Repetido,Archivo,,',    # repetido en el archivo
+            f'{rut_valido(30000000)},,SinNombre,,',          # falta el nombre
+            f'{rut_valido(30000001)},Mal,Email,,no-es-email',
+        ]
+        ruta = self.escribir('pacientes.csv', '\n'.join(filas) + '\n')
+        out = StringIO()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('import_pacientes', ruta, '--chunk', '10', stdout=out)
+        self.assertIn('25 creados, 1 ya existían, 4 rechazados', out.getvalue())
+        self.assertIn('filas/s', out.getvalue())
+        self.assertEqual(Paciente.objects.count(), 26)
+        self.assertEqual(Paciente.objects.get(nombre='Nombre3').rut_normalizado, rut_valido(20000003).replace('-', ''))
+        # Por lote: consulta de existentes + insert + índice de búsqueda (4 lotes de 10 filas)
+        inserts = [q for q in ctx.captured_queries if q['sql'].startswith('INSERT INTO "agenda_paciente"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertLessEqual(len(ctx.captured_queries), 4 * 8)
+
+        with open(ruta + '.rechazos.jsonl', encoding='utf-8') as f:
+            rechazos = [json.loads(linea) for linea in f]
+        self.assertEqual([r['linea'] for r in rechazos], [28, 29, 30, 31])
+        self.assertIn('verificador', rechazos[0]['motivo'])
+        # Los importados quedan en el índice de búsqueda
+        r = APIClient().get('/agenda/api/pacientes/', {'q': 'apellido12'})
+        self.assertEqual([p['nombre'] for p in r.json()], ['Nombre12'])
+
+    def test_comando_dry_run(self):
+        ruta = self.escribir('pacientes.jsonl', json.dumps({'rut': rut_valido(20000001), 'nombre': 'A', 'apellido': 'B'}) + '\n')
+        out = StringIO()
+        call_command('import_pacientes', ruta, '--dry-run', stdout=out)
+        self.assertIn('dry-run', out.getvalue())
+        self.assertEqual(Paciente.objects.count(), 1)
+
+    def test_endpoint_jsonl(self):
+        contenido = '\n'.join([
+            json.dumps({'rut': rut_valido(20000001), 'nombre': 'Ana', 'apellido': 'Rojas'}),
+            'no es json',
+            json.dumps({'rut': rut_valido(11111111), 'nombre': 'Ya', 'apellido': 'Existe'}),
+        ]).encode()
+        archivo = SimpleUploadedFile('pacientes.jsonl', contenido, content_type='application/x-ndjson')
+        r = APIClient().post('/agenda/api/pacientes/import/', {'archivo': archivo}, format='multipart')
+        self.assertEqual(r.status_code, 200, r.content)
+        datos = r.json()
+        self.assertEqual((datos['creados'], datos['existentes'], datos['rechazados']), (1, 1, 1))
+        self.assertEqual(datos['rechazos'], [{'linea': 2, 'motivo': 'JSON inválido'}])
+
+        archivo = SimpleUploadedFile('pacientes.txt', b'x', content_type='text/plain')
+        r = APIClient().post('/agenda/api/pacientes/import/', {'archivo': archivo}, format='multipart')
+        self.assertEqual(r.status_code, 400)
+
+    def test_codificacion_invalida_no_importa_nada(self):
+        # El byte inválido está después de los primeros lotes (--chunk 10): no debe quedar ninguno confirmado
+        filas = [f'{rut_valido(40000000 + i)},N{i},A{i},,' for i in range(30)]
+        contenido = ('rut,nombre,apellido,telefono,email\n' + '\n'.join(filas) + '\n').encode() + b'x,Mu\xf1oz,B,,\n'
+        antes = Paciente.objects.count()
+        archivo = SimpleUploadedFile('pacientes.csv', contenido, content_type='text/csv')
+        r = APIClient().post('/agenda/api/pacientes/import/', {'archivo': archivo}, format='multipart')
+        self.assertEqual(r.status_code, 400)
+        ruta = self.escribir('latin1.csv', '')
+        with open(ruta, 'wb') as f:
+            f.write(contenido)
+        with self.assertRaises(CommandError):
+            call_command('import_pacientes', ruta, '--chunk', '10', stdout=StringIO())
+        self.assertEqual(Paciente.objects.count(), antes)
+
+
+class ExportAgendaTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.hoy = timezone.localdate()
+        norte = Region.objects.create(nombre='Norte', codigo='N')
+        sur = Region.objects.create(nombre='Sur', codigo='S')
+        self.region = norte
+        self.d_norte = Dentista.objects.create(nombre='Ana', apellido='Perez', especialidad='General', region=norte)
+        self.d_sur = Dentista.objects.create(nombre='Luis', apellido='Soto', especialidad='General', region=sur)
+        servicio = Servicio.objects.create(nombre='Limpieza', duracion_min=30, precio=30)
+        paciente = Paciente.objects.create(rut=rut_valido(12345678), nombre='Juan', apellido='Lopez')
+        for dentista in (self.d_norte, self.d_sur):
+            for dias in (0, 10):
+                slot = SlotAgenda.objects.create(dentista=dentista, servicio=servicio, capacidad=2,
+                                                 fecha=self.hoy + timedelta(days=dias), hora=time(9, 0))
+                admitir_reserva(slot, paciente, servicio)
+
+    def test_csv_filtrado_por_region_y_fecha(self):
+        r = self.client.get(reverse('exportar-agenda', kwargs={'recurso': 'reservas', 'formato': 'csv'}),
+                            {'region': self.region.id, 'hasta': (self.hoy + timedelta(days=5)).isoformat()})
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.streaming)
+        self.assertTrue(r['Content-Type'].startswith('text/csv'))
+        lineas = b''.join(r.streaming_content).decode().splitlines()
+        self.assertEqual(lineas[0].split(',')[:3], ['id', 'fecha', 'hora'])
+        self.assertEqual(len(lineas), 2)
+        self.assertIn(f'{self.hoy.isoformat()},09:00:00', lineas[1])
+        self.assertIn(',N,', lineas[1])
+
+    def test_jsonl_de_slots(self):
+        r = self.client.get(reverse('exportar-agenda', kwargs={'recurso': 'slots', 'formato': 'jsonl'}))
+        filas = [json.loads(linea) for linea in b''.join(r.streaming_content).decode().splitlines()]
+        self.assertEqual(len(filas), 4)
+        self.assertEqual(filas[0]['reservas_normales'], 1)
+        self.assertEqual([f['fecha'] for f in filas], sorted(f['fecha'] for f in filas))
+
+    async def test_asgi_itera_sin_cargar_todo(self):
+        # Bajo ASGI el cuerpo es un iterador async (Django 4.2 haría list() de uno síncrono)
+        r = await AsyncClient().get(reverse('exportar-agenda', kwargs={'recurso': 'slots', 'formato': 'csv'}))
+        self.assertTrue(r.is_async)
+        lineas = [linea async for linea in r.streaming_content]
+        self.assertEqual(len(lineas), 5)
+        self.assertTrue(lineas[0].startswith(b'id,fecha,hora'))
+
+    def test_parametros_invalidos(self):
+        url = reverse('exportar-agenda', kwargs={'recurso': 'reservas', 'formato': 'xml'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse('exportar-agenda', kwargs={'recurso': 'reservas', 'formato': 'csv'})
+        self.assertEqual(self.client.get(url, {'desde': 'ayer'}).status_code, 400)
+
+    def test_comando(self):
+        out = StringIO()
+        call_command('export_agenda', 'reservas', '--formato', 'jsonl', '--region', 'S', '--chunk', '1', stdout=out)
+        filas = [json.loads(linea) for linea in out.getvalue().splitlines()]
+        self.assertEqual([f['dentista_id'] for f in filas], [self.d_sur.id, self.d_sur.id])
+        self.assertEqual(filas[0]['paciente_rut'], rut_valido(12345678))
+
+
+class AsyncLecturaTest(TestCase):
+    """Las variantes async devuelven lo mismo que las síncronas."""
+
+    def setUp(self):
+        get_cache().clear()
+        self.client = APIClient()
+        self.hoy = timezone.localdate()
+        region = Region.objects.create(nombre='Norte', codigo='N')
+        self.dentista = Dentista.objects.create(nombre='Ana', apellido='Perez', especialidad='General', region=region)
+        Dentista.objects.create(nombre='Luis', apellido='Soto', especialidad='General')
+        servicio = Servicio.objects.create(nombre='Limpieza', duracion_min=30, precio=30)
+        generate_slots_bulk([self.dentista], self.hoy, self.hoy + timedelta(days=1), desde='09:00', hasta='11:00')
+        SlotAgenda.objects.filter(hora=time(9, 0)).update(servicio=servicio)
+        paciente = Paciente.objects.create(rut=rut_valido(12345678), nombre='Juan', apellido='Lopez')
+        admitir_reserva(SlotAgenda.objects.get(fecha=self.hoy, hora=time(10, 0)), paciente)
+
+    def comparar(self, url_sync, url_async, params=None):
+        sincrona = self.client.get(url_sync, params)
+        asincrona = self.client.get(url_async, params)
+        self.assertEqual(sincrona.status_code, 200)
+        self.assertEqual(asincrona.status_code, 200)
+        self.assertEqual(asincrona.json(), sincrona.json())
+        return asincrona
+
+    def test_mismas_respuestas(self):
+        params = {'fecha': self.hoy.isoformat(), 'dentista_id': self.dentista.id}
+        r = self.comparar(reverse('slots-por-fecha'), reverse('async-slots-por-fecha'), params)
+        self.assertEqual(self.client.get(reverse('async-slots-por-fecha'), params,
+                                         HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+        self.comparar(reverse('disponibilidad'), reverse('async-disponibilidad'), {'desde': self.hoy.isoformat()})
+        self.comparar('/agenda/api/dentistas/', reverse('async-dentistas'))
+        r = self.comparar('/agenda/api/servicios/', reverse('async-servicios'))
+        self.assertEqual(self.client.get(reverse('async-servicios'), HTTP_IF_NONE_MATCH=r['ETag']).status_code, 304)
+
+    def test_errores(self):
+        self.assertEqual(self.client.get(reverse('async-slots-por-fecha'), {'fecha': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('async-dentistas'), {'region': 'x'}).status_code, 400)
+        self.assertEqual(self.client.post(reverse('async-servicios')).status_code, 405)
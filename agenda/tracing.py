@@ -0,0 +1,105 @@
+"""Trazas muestreadas del camino caliente de reservas.
+
+Uso::
+
+    with traza('reserva', paciente=paciente_id):
+        with fase('lookup'):
+            ...
+        with fase('insert'):
+            ...
+
+Solo una fracción de las trazas (`settings.AGENDA_TRACE_SAMPLE_RATE`, 0.0 por defecto)
+se mide y se emite como un registro del logger ``agenda.tracing`` con la duración total
+y la de cada fase en milisegundos. `fase()` busca la traza activa en un `ContextVar`, así
+que puede usarse en cualquier función llamada dentro de `traza()` sin pasarla como
+argumento; fuera de una traza muestreada no hace nada.
+"""
+import contextvars
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+logger = logging.getLogger('agenda.tracing')
+
+_traza_activa = contextvars.ContextVar('agenda_traza_activa', default=None)
+
+
+class Traza:
+    def __init__(self, nombre, atributos):
+        self.nombre = nombre
+        self.atributos = atributos
+        self.fases = {}
+        self.inicio = time.perf_counter()
+
+    @contextmanager
+    def fase(self, nombre):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases[nombre] = self.fases.get(nombre, 0.0) + (time.perf_counter() - t0) * 1000
+
+    def emitir(self, resultado):
+        duracion_ms = (time.perf_counter() - self.inicio) * 1000
+        logger.info(
+            'traza %s %.2fms', self.nombre, duracion_ms,
+            extra={
+                'traza': self.nombre,
+                'duracion_ms': round(duracion_ms, 3),
+                'fases_ms': {k: round(v, 3) for k, v in self.fases.items()},
+                'resultado': resultado,
+                'atributos': self.atributos,
+            },
+        )
+
+
+def _muestrear():
+    tasa = getattr(settings, 'AGENDA_TRACE_SAMPLE_RATE', 0.0)
+    return tasa > 0 and random.random() < tasa
+
+
+@contextmanager
+def traza(nombre, **atributos):
+    """Abre una traza muestreada. Devuelve la `Traza` o None si no fue muestreada."""
+    if not _muestrear():
+        yield None
+        return
+    actual = Traza(nombre, atributos)
+    token = _traza_activa.set(actual)
+    resultado = 'ok'
+    try:
+        yield actual
+    except Exception as e:
+        resultado = type(e).__name__
+        raise
+    finally:
+        _traza_activa.reset(token)
+        actual.emitir(resultado)
+
+
+def fase(nombre):
+    """Context manager que mide una fase de la traza activa (no-op si no hay traza)."""
+    actual = _traza_activa.get()
+    if actual is None:
+        return nullcontext()
+    return actual.fase(nombre)
+
+
+class TrazaJSONFormatter(logging.Formatter):
+    """Formatea los registros de `agenda.tracing` como una línea JSON."""
+
+    def format(self, record):
+        datos = {
+            'ts': self.formatTime(record),
+            'logger': record.name,
+            'traza': getattr(record, 'traza', None),
+            'duracion_ms': getattr(record, 'duracion_ms', None),
+            'fases_ms': getattr(record, 'fases_ms', {}),
+            'resultado': getattr(record, 'resultado', None),
+        }
+        datos.update(getattr(record, 'atributos', {}))
+        return json.dumps(datos, default=str)
@@ -1,8 +1,10 @@
 from django.urls import path, include
-from .views import SlotsDisponiblesList, CrearReserva, generar_slots
-from .views import slots_por_fecha
+from .views import SlotsDisponiblesList, CrearReserva, HistorialReservasList, generar_slots
+from .views import slots_por_fecha, disponibilidad, huecos, proxima_disponible, cache_estadisticas, exportar_agenda
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .viewsets import DentistaViewSet, ServicioViewSet, PacienteViewSet, RegionViewSet, ReservaViewSet
+from .viewsets import PlantillaHorarioViewSet, ExcepcionAgendaViewSet
 
 router = DefaultRouter()
 router.register(r'regiones', RegionViewSet, basename='region')
@@ -10,11 +12,23 @@ router.register(r'dentistas', DentistaViewSet, basename='dentista')
 router.register(r'servicios', ServicioViewSet, basename='servicio')
 router.register(r'pacientes', PacienteViewSet, basename='paciente')
 router.register(r'reservas', ReservaViewSet, basename='reserva')
+router.register(r'plantillas', PlantillaHorarioViewSet, basename='plantilla')
+router.register(r'excepciones', ExcepcionAgendaViewSet, basename='excepcion')
 
 urlpatterns = [
     path('slots/', SlotsDisponiblesList.as_view(), name='slots-disponibles'),
     path('reservas/', CrearReserva.as_view(), name='crear-reserva'),
     path('dentistas/<int:dentista_id>/generar_slots/', generar_slots, name='generar-slots'),
     path('slots_por_fecha/', slots_por_fecha, name='slots-por-fecha'),
+    path('disponibilidad/', disponibilidad, name='disponibilidad'),
+    path('huecos/', huecos, name='huecos'),
+    path('proxima-disponible/', proxima_disponible, name='proxima-disponible'),
+    path('historial/reservas/', HistorialReservasList.as_view(), name='historial-reservas'),
+    path('cache/', cache_estadisticas, name='cache-estadisticas'),
+    path('export/<str:recurso>.<str:formato>', exportar_agenda, name='exportar-agenda'),
+    path('async/slots_por_fecha/', async_views.slots_por_fecha, name='async-slots-por-fecha'),
+    path('async/disponibilidad/', async_views.disponibilidad, name='async-disponibilidad'),
+    path('async/dentistas/', async_views.dentistas, name='async-dentistas'),
+    path('async/servicios/', async_views.servicios, name='async-servicios'),
     path('api/', include(router.urls)),
 ]
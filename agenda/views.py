@@ -1,9 +1,26 @@
+import heapq
+import itertools
+
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
-from .models import SlotAgenda, Reserva, Dentista
-from .serializers import SlotAgendaSerializer, ReservaCreateSerializer
+from .models import SlotAgenda, Reserva, Dentista, Servicio, ReservaArchivo
+from .serializers import SlotAgendaSerializer, ReservaCreateSerializer, ReservaArchivoSerializer, serializar_slots
+from .serializers import serializar_virtuales
+from .pagination import SlotKeysetPagination
+from .disponibilidad import matriz_disponibilidad, primeros_huecos, proximas_disponibles
+from .plantillas import Plantillas
+from .reservas import bloques_servicio
+from .export import FORMATOS as FORMATOS_EXPORTACION, RECURSOS as RECURSOS_EXPORTACION, aexportar, exportar
+from .cache import get_cache
+from . import revisiones
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view
 from rest_framework import status
 from rest_framework.response import Response
@@ -13,13 +30,164 @@ from rest_framework.response import Response
 from .slots_generator import generate_slots_for_day, generate_slots_range
 
 
+MENSAJE_FECHA_INVALIDA = 'Formato de fecha inválido. Use YYYY-MM-DD.'
+MENSAJE_DENTISTA_INVALIDO = 'dentista_id debe ser un ID numérico.'
+
+
+def parametros_dia(params):
+    """(fecha, dentista_id) de los query params `fecha=YYYY-MM-DD` y `dentista_id` (None si faltan).
+
+    Lanza ValueError, con el mensaje del parámetro que falló, si alguno tiene un formato inválido.
+    """
+    import datetime
+    fecha = params.get('fecha')
+    dentista_id = params.get('dentista_id')
+    try:
+        fecha = datetime.datetime.strptime(fecha, '%Y-%m-%d').date() if fecha else None
+    except ValueError:
+        raise ValueError(MENSAJE_FECHA_INVALIDA)
+    try:
+        dentista_id = int(dentista_id) if dentista_id else None
+    except ValueError:
+        raise ValueError(MENSAJE_DENTISTA_INVALIDO)
+    return fecha, dentista_id
+
+
+def filtrar_slots(qs, params):
+    """Aplica los filtros comunes de listados de slots: fecha=YYYY-MM-DD y dentista_id.
+
+    Lanza ValueError si algún parámetro tiene un formato inválido.
+    """
+    fecha, dentista_id = parametros_dia(params)
+    if fecha:
+        qs = qs.filter(fecha=fecha)
+    if dentista_id:
+        qs = qs.filter(dentista_id=dentista_id)
+    return qs
+
+
+# Días de slots materializados y sobrecupos que el listado paginado carga por consulta
+LISTADO_VENTANA_DIAS = 7
+
+
+def virtuales(desde, hasta, dentista_id=None, hora_minima=None, ventana=None):
+    """Bloques de plantilla aún sin slot desde (desde, hora_minima) hasta `hasta`, serializados y en el
+    orden de `SlotKeysetPagination.clave` (ver `Plantillas.filas_por_hora`)."""
+    plantillas = Plantillas(desde, hasta, dentista_ids=[dentista_id] if dentista_id else None, ventana=ventana)
+    return serializar_virtuales(plantillas, plantillas.filas_por_hora(hora_minima))
+
+
+def mezclar_listado(slots, bloques):
+    """Slots serializados y bloques de plantilla, ambos ordenados, en un solo flujo (como `mezclar_filas`)."""
+    return heapq.merge(slots, bloques, key=SlotKeysetPagination.clave)
+
+
+def consulta_slots_dia(fecha, dentista_id=None):
+    """Slots no exceptuados de un día (de un dentista o de todos), ordenados por hora."""
+    qs = SlotAgenda.objects.sin_excepcion().filter(fecha=fecha)
+    if dentista_id:
+        qs = qs.filter(dentista_id=dentista_id)
+    return qs.order_by('hora', 'id')
+
+
+def slots_del_dia(fecha, dentista_id=None, sello=None):
+    """Vista cacheada de los slots de un día (de un dentista o de todos), ordenada por hora.
+
+    Incluye los bloques de plantilla aún sin slot (`id` null) y omite los slots exceptuados.
+    `sello` es el de `revisiones.estado_dia` para ese día; si no se pasa, se lee.
+    """
+    if sello is None:
+        sello, _ = revisiones.estado_dia(fecha, dentista_id)
+
+    def cargar():
+        slots = serializar_slots(consulta_slots_dia(fecha, dentista_id))
+        return list(mezclar_listado(slots, virtuales(fecha, fecha, dentista_id)))
+    return get_cache().get_or_set('slots', dentista_id, fecha, cargar, sello=sello)
+
+
+def con_cupo(filas):
+    """Filas serializadas con capacidad normal o sobrecupo disponible (como `SlotAgendaQuerySet.con_cupo`)."""
+    return (f for f in filas if f['reservas_normales'] < f['capacidad'] or f['reservas_sobrecupo'] < f['max_overbook'])
+
+
 class SlotsDisponiblesList(generics.ListAPIView):
+    """Slots con fecha >= hoy, paginados por cursor sobre (fecha, hora, id).
+
+    Incluye los bloques de plantilla aún sin slot (`id` null) hasta AGENDA_HORIZONTE_DIAS días.
+    Query params: fecha, dentista_id (como `slots_por_fecha`), disponibles=1,
+    page_size (acotado por AGENDA_SLOTS_PAGE_SIZE_MAX) y cursor.
+    """
     serializer_class = SlotAgendaSerializer
+    pagination_class = SlotKeysetPagination
 
     def get_queryset(self):
         # devolver slots >= hoy
         hoy = timezone.localdate()
-        return SlotAgenda.objects.filter(fecha__gte=hoy).order_by('fecha', 'hora')
+        qs = SlotAgenda.objects.sin_excepcion().filter(fecha__gte=hoy)
+        # ?disponibles=1 → solo slots con cupo (normal o sobrecupo) según los contadores
+        if self.request.query_params.get('disponibles') in ('1', 'true'):
+            qs = qs.con_cupo()
+        return qs
+
+    def list(self, request, *args, **kwargs):
+        import datetime
+        try:
+            fecha, dentista_id = parametros_dia(request.query_params)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if fecha:
+            # Un solo día: se sirve desde la caché de disponibilidad
+            filas = slots_del_dia(fecha, dentista_id) if fecha >= timezone.localdate() else []
+            if request.query_params.get('disponibles') in ('1', 'true'):
+                filas = list(con_cupo(filas))
+            return self.get_paginated_response(self.paginator.paginate_list(filas, request))
+        qs = filtrar_slots(self.filter_queryset(self.get_queryset()), request.query_params)
+        page = serializar_slots(self.paginate_queryset(qs))
+
+        # Los bloques de plantilla se generan desde el cursor y solo hasta donde la página puede llegar:
+        # si la página de slots está completa, hasta su última fecha; si no, hasta el horizonte
+        hoy = timezone.localdate()
+        desde, hora_minima = hoy, None
+        cursor = self.paginator.clave_cursor(request)
+        if cursor and cursor[0] >= hoy:
+            desde, hora_minima = cursor[0], cursor[1]
+        hasta = hoy + datetime.timedelta(days=settings.AGENDA_HORIZONTE_DIAS - 1)
+        if len(page) > self.paginator.page_size:
+            hasta = min(hasta, datetime.date.fromisoformat(page[-1]['fecha']))
+        bloques = virtuales(desde, hasta, dentista_id, hora_minima, ventana=LISTADO_VENTANA_DIAS)
+        if request.query_params.get('disponibles') in ('1', 'true'):
+            bloques = con_cupo(bloques)
+
+        # La página son las primeras filas de la mezcla de ambas páginas (cada una ya cortada desde el cursor)
+        bloques = self.paginator.paginate_list(bloques, request)
+        filas = mezclar_listado(page, bloques)
+        return self.get_paginated_response(list(itertools.islice(filas, self.paginator.page_size + 1)))
+
+
+class HistorialReservasList(generics.ListAPIView):
+    """Reservas archivadas (`manage.py archive_agenda`), paginadas por cursor sobre (fecha, hora, id).
+
+    Query params: dentista, paciente, desde, hasta (YYYY-MM-DD), page_size y cursor. Las
+    reservas aún no archivadas se consultan en /agenda/api/reservas/.
+    """
+    serializer_class = ReservaArchivoSerializer
+    pagination_class = SlotKeysetPagination
+
+    def get_queryset(self):
+        import datetime
+        params = self.request.query_params
+        qs = ReservaArchivo.objects.all()
+        try:
+            for campo in ('dentista', 'paciente'):
+                if params.get(campo):
+                    qs = qs.filter(**{f'{campo}_id': int(params[campo])})
+            if params.get('desde'):
+                qs = qs.filter(fecha__gte=datetime.datetime.strptime(params['desde'], '%Y-%m-%d').date())
+            if params.get('hasta'):
+                qs = qs.filter(fecha__lte=datetime.datetime.strptime(params['hasta'], '%Y-%m-%d').date())
+        except ValueError:
+            raise ValidationError({'detail': 'dentista y paciente deben ser IDs numéricos y las fechas YYYY-MM-DD.'})
+        return qs
 
 
 class CrearReserva(generics.CreateAPIView):
@@ -69,31 +237,210 @@ def generar_slots(request, dentista_id):
         return Response({'detail': 'El campo dias debe ser un entero.'}, status=status.HTTP_400_BAD_REQUEST)
 
     # si dias > 1 usamos generate_slots_range
-    if dias > 1:
-        end_date = fecha_obj + datetime.timedelta(days=dias - 1)
-        created = generate_slots_range(dentista, fecha_obj, end_date, desde=desde, hasta=hasta)
-    else:
-        created = generate_slots_for_day(dentista, fecha_obj, desde=desde, hasta=hasta)
+    try:
+        if dias > 1:
+            end_date = fecha_obj + datetime.timedelta(days=dias - 1)
+            resultado = generate_slots_range(dentista, fecha_obj, end_date, desde=desde, hasta=hasta)
+        else:
+            resultado = generate_slots_for_day(dentista, fecha_obj, desde=desde, hasta=hasta)
+    except ValueError:
+        return Response({'detail': 'Formato de hora inválido. Use HH:MM.'}, status=status.HTTP_400_BAD_REQUEST)
+    except DjangoValidationError as e:
+        return Response({'detail': e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response({'created': created}, status=status.HTTP_201_CREATED)
+    return Response({'created': resultado['created'], 'skipped': resultado['skipped']}, status=status.HTTP_201_CREATED)
 
 
 @api_view(['GET'])
 def slots_por_fecha(request):
     """Endpoint adicional útil: filtrar por fecha y opcionalmente por dentista.
     Query params: fecha=YYYY-MM-DD, dentista_id=1
+    Con `fecha` responde `ETag`/`Last-Modified` y 304 si el día no cambió.
     """
-    import datetime
-    fecha = request.GET.get('fecha')
-    dentista_id = request.GET.get('dentista_id')
-    qs = SlotAgenda.objects.all()
+    try:
+        fecha, dentista_id = parametros_dia(request.GET)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     if fecha:
-        try:
-            fecha_obj = datetime.datetime.strptime(fecha, '%Y-%m-%d').date()
-            qs = qs.filter(fecha=fecha_obj)
-        except Exception:
-            return Response({'detail': 'Formato de fecha inválido. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
-    if dentista_id:
-        qs = qs.filter(dentista_id=dentista_id)
-    serializer = SlotAgendaSerializer(qs.order_by('hora'), many=True)
-    return Response(serializer.data)
+        estado = revisiones.estado_dia(fecha, dentista_id)
+        return revisiones.respuesta_condicional(
+            request, estado, lambda: Response(slots_del_dia(fecha, dentista_id, sello=estado[0])),
+        )
+    qs = filtrar_slots(SlotAgenda.objects.sin_excepcion(), request.GET)
+    return Response(serializar_slots(qs.order_by('hora', 'id')))
+
+
+@api_view(['GET'])
+def cache_estadisticas(request):
+    """Contadores de la caché de disponibilidad: aciertos, fallos, desalojos e invalidaciones."""
+    return Response(get_cache().estadisticas())
+
+
+# Rango máximo de días de la matriz de disponibilidad
+DISPONIBILIDAD_MAX_DIAS = 62
+
+
+@api_view(['GET'])
+def disponibilidad(request):
+    """Matriz compacta de disponibilidad dentista × día × bloque de 30 minutos.
+    Query params: desde=YYYY-MM-DD (default hoy), hasta=YYYY-MM-DD (default desde + 6),
+    region=<id> y/o dentistas=1,2,3 (opcionales).
+    Cada celda de `matriz[i][j]` (dentista i, fecha j) es un bitmap hex con 2 bits por bloque
+    (ver `agenda.disponibilidad`).
+    """
+    try:
+        desde, hasta, region, dentistas = parametros_disponibilidad(request.GET)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(matriz_disponibilidad(desde, hasta, region_id=region, dentista_ids=dentistas))
+
+
+@api_view(['GET'])
+def huecos(request):
+    """Horas de inicio posibles para un servicio: por dentista y día, cada hora con tantos slots
+    consecutivos libres como bloques de 30 minutos dura el servicio.
+    Query params: servicio=<id> (requerido), desde, hasta, region, dentistas (como `disponibilidad`)
+    y sobrecupo=1 para incluir, aparte, los inicios que solo se admitirían como sobrecupo.
+    """
+    try:
+        desde, hasta, region, dentistas = parametros_disponibilidad(request.GET)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        servicio = Servicio.objects.get(pk=int(request.GET.get('servicio', '')))
+    except (ValueError, Servicio.DoesNotExist):
+        return Response({'detail': 'Se requiere un servicio existente (servicio=<id>).'}, status=status.HTTP_400_BAD_REQUEST)
+    bloques = bloques_servicio(servicio)
+    sobrecupo = request.GET.get('sobrecupo') in ('1', 'true')
+    return Response({
+        'servicio': servicio.pk,
+        'duracion_min': servicio.duracion_min,
+        'bloques': bloques,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'huecos': primeros_huecos(bloques, desde, hasta, region_id=region, dentista_ids=dentistas, sobrecupo=sobrecupo),
+    })
+
+
+# Resultados por defecto y máximos de la próxima hora disponible, y días hacia adelante en que se busca
+PROXIMA_K = 5
+PROXIMA_K_MAX = 50
+PROXIMA_MAX_DIAS = 90
+
+
+@api_view(['GET'])
+def proxima_disponible(request):
+    """Las k horas de inicio más tempranas entre todos los dentistas que cumplen los filtros.
+    Query params: servicio=<id> (su duración fija cuántos slots consecutivos hacen falta),
+    region=<id>, especialidad=<texto>, desde=YYYY-MM-DD (default hoy, desde la hora actual),
+    dias (horizonte, default y máx. PROXIMA_MAX_DIAS), k (default 5) y sobrecupo=1 para
+    incluir inicios que solo se admitirían como sobrecupo.
+    """
+    import datetime
+    params = request.GET
+    try:
+        desde = params.get('desde')
+        desde = datetime.datetime.strptime(desde, '%Y-%m-%d').date() if desde else timezone.localdate()
+    except ValueError:
+        return Response({'detail': 'Formato de fecha inválido. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        k = min(int(params.get('k', PROXIMA_K)), PROXIMA_K_MAX)
+        dias = min(int(params.get('dias', PROXIMA_MAX_DIAS)), PROXIMA_MAX_DIAS)
+        region = params.get('region')
+        region = int(region) if region else None
+        servicio = params.get('servicio')
+        servicio = Servicio.objects.get(pk=int(servicio)) if servicio else None
+    except ValueError:
+        return Response({'detail': 'k, dias, region y servicio deben ser numéricos.'}, status=status.HTTP_400_BAD_REQUEST)
+    except Servicio.DoesNotExist:
+        return Response({'detail': 'Servicio no encontrado.'}, status=status.HTTP_400_BAD_REQUEST)
+    if k < 1 or dias < 1:
+        return Response({'detail': 'k y dias deben ser mayores que 0.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    dentistas = Dentista.objects.order_by('pk')
+    if region is not None:
+        dentistas = dentistas.filter(region_id=region)
+    if params.get('especialidad'):
+        dentistas = dentistas.filter(especialidad__iexact=params['especialidad'])
+    nombres = {pk: f'{nombre} {apellido}' for pk, nombre, apellido in dentistas.values_list('pk', 'nombre', 'apellido')}
+
+    bloques = bloques_servicio(servicio)
+    hasta = desde + datetime.timedelta(days=dias - 1)
+    # Hoy solo cuentan los inicios que aún no pasaron
+    hora_minima = timezone.localtime().time() if desde == timezone.localdate() else None
+    inicios = proximas_disponibles(
+        list(nombres), bloques, desde, hasta, k, hora_minima=hora_minima,
+        sobrecupo=params.get('sobrecupo') in ('1', 'true'),
+    )
+    return Response({
+        'servicio': servicio.pk if servicio else None,
+        'bloques': bloques,
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'resultados': [
+            {
+                'dentista': dentista_id,
+                'dentista_nombre': nombres[dentista_id],
+                'fecha': fecha.isoformat(),
+                'hora': hora.strftime('%H:%M'),
+                'sobrecupo': es_sobrecupo,
+            }
+            for fecha, hora, dentista_id, es_sobrecupo in inicios
+        ],
+    })
+
+
+def parametros_disponibilidad(params):
+    """(desde, hasta, region_id, dentista_ids) de los query params de la matriz de disponibilidad.
+
+    Lanza ValueError con el mensaje para el cliente si algún parámetro es inválido.
+    """
+    import datetime
+    try:
+        desde = params.get('desde')
+        desde = datetime.datetime.strptime(desde, '%Y-%m-%d').date() if desde else timezone.localdate()
+        hasta = params.get('hasta')
+        hasta = datetime.datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else desde + datetime.timedelta(days=6)
+    except ValueError:
+        raise ValueError('Formato de fecha inválido. Use YYYY-MM-DD.')
+    if hasta < desde or (hasta - desde).days >= DISPONIBILIDAD_MAX_DIAS:
+        raise ValueError(f'Rango inválido: hasta >= desde y como máximo {DISPONIBILIDAD_MAX_DIAS} días.')
+    try:
+        region = params.get('region')
+        region = int(region) if region else None
+        dentistas = [int(d) for d in params.get('dentistas', '').split(',') if d.strip()]
+    except ValueError:
+        raise ValueError('region y dentistas deben ser IDs numéricos.')
+    return desde, hasta, region, dentistas
+
+
+@require_GET
+def exportar_agenda(request, recurso, formato):
+    """Exportación en streaming: /agenda/export/reservas.csv|.jsonl y /agenda/export/slots.csv|.jsonl.
+    Query params: desde=YYYY-MM-DD, hasta=YYYY-MM-DD, region=<id> (opcionales).
+    Vista Django simple (sin negociación de DRF): el formato lo fija la extensión.
+    """
+    import datetime
+    if recurso not in RECURSOS_EXPORTACION or formato not in FORMATOS_EXPORTACION:
+        return JsonResponse({'detail': 'Use reservas|slots y csv|jsonl.'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        desde = request.GET.get('desde')
+        desde = datetime.datetime.strptime(desde, '%Y-%m-%d').date() if desde else None
+        hasta = request.GET.get('hasta')
+        hasta = datetime.datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else None
+    except ValueError:
+        return JsonResponse({'detail': 'Formato de fecha inválido. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        region = request.GET.get('region')
+        region = int(region) if region else None
+    except ValueError:
+        return JsonResponse({'detail': 'region debe ser un ID numérico.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Bajo ASGI el cuerpo debe ser un iterador async para no cargar la exportación en memoria
+    generar = aexportar if isinstance(request, ASGIRequest) else exportar
+    respuesta = StreamingHttpResponse(
+        generar(recurso, formato, desde=desde, hasta=hasta, region_id=region),
+        content_type=FORMATOS_EXPORTACION[formato],
+    )
+    respuesta['Content-Disposition'] = f'attachment; filename="{recurso}.{formato}"'
+    return respuesta
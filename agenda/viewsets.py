@@ -1,8 +1,27 @@
-from rest_framework import viewsets
+import datetime
+import io
+
+from django.db.models import Q
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import SAFE_METHODS, BasePermission, AllowAny
 from rest_framework.response import Response
-from .models import Dentista, Servicio, Paciente, Region, Reserva
-from .serializers import DentistaSerializer, ServicioSerializer, PacienteSerializer, RegionSerializer, ReservaCreateSerializer, ReservaReadSerializer
+from .models import Dentista, Servicio, Paciente, Region, Reserva, PlantillaHorario, ExcepcionAgenda
+from .serializers import DentistaSerializer, ServicioSerializer, PacienteSerializer, RegionSerializer, ReservaCreateSerializer, ReservaReadSerializer, ReservaBatchItemSerializer
+from .serializers import PlantillaHorarioSerializer, ExcepcionAgendaSerializer
+from .reservas import admitir_lote
+from .busqueda import buscar_pacientes
+from .importacion import FORMATOS, detectar_formato, es_utf8, importar_pacientes, leer_filas
+from .cache import get_cache
+from .pagination import ReservaKeysetPagination
+from .revisiones import DENTISTAS, REGIONES, SERVICIOS, estado, estado_dia, respuesta_condicional
+
+# Máximo de reservas aceptadas por llamada a /reservas/batch/
+RESERVAS_BATCH_MAX = 1000
+
+# Filas rechazadas incluidas en la respuesta de /pacientes/import/
+IMPORTACION_RECHAZOS_MAX = 100
 
 
 class IsStaffOrReadOnly(BasePermission):
@@ -12,29 +31,78 @@ class IsStaffOrReadOnly(BasePermission):
         return bool(request.user and request.user.is_staff)
 
 
-class RegionViewSet(viewsets.ModelViewSet):
+class RevisionMixin:
+    """`list`/`retrieve` condicionales: `ETag`/`Last-Modified` según los sellos de `recursos_revision`."""
+    recursos_revision = ()
+
+    def list(self, request, *args, **kwargs):
+        listar = super().list
+        return respuesta_condicional(
+            request, estado(self.recursos_revision), lambda: listar(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        obtener = super().retrieve
+        return respuesta_condicional(
+            request, estado(self.recursos_revision), lambda: obtener(request, *args, **kwargs),
+        )
+
+
+class RegionViewSet(RevisionMixin, viewsets.ModelViewSet):
     queryset = Region.objects.all()
     serializer_class = RegionSerializer
     permission_classes = [AllowAny]
+    recursos_revision = (REGIONES,)
 
 
-class DentistaViewSet(viewsets.ModelViewSet):
+class DentistaViewSet(RevisionMixin, viewsets.ModelViewSet):
     queryset = Dentista.objects.select_related('region').all()
     serializer_class = DentistaSerializer
     permission_classes = [AllowAny]
+    # Cada dentista incluye su región
+    recursos_revision = (DENTISTAS, REGIONES)
     
     def get_queryset(self):
-        queryset = self.queryset
+        queryset = super().get_queryset()
         region_id = self.request.query_params.get('region', None)
         if region_id is not None:
             queryset = queryset.filter(region=region_id)
         return queryset
 
 
-class ServicioViewSet(viewsets.ModelViewSet):
+class ServicioViewSet(RevisionMixin, viewsets.ModelViewSet):
     queryset = Servicio.objects.all()
     serializer_class = ServicioSerializer
     permission_classes = [AllowAny]
+    recursos_revision = (SERVICIOS,)
+
+
+class PlantillaHorarioViewSet(viewsets.ModelViewSet):
+    """Horarios semanales de los dentistas (`?dentista=<id>`); ver `agenda.plantillas`."""
+    queryset = PlantillaHorario.objects.all()
+    serializer_class = PlantillaHorarioSerializer
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        dentista_id = self.request.query_params.get('dentista', None)
+        if dentista_id is not None:
+            queryset = queryset.filter(dentista=dentista_id)
+        return queryset
+
+
+class ExcepcionAgendaViewSet(viewsets.ModelViewSet):
+    """Feriados y ausencias (`?dentista=<id>` incluye las de toda la clínica)."""
+    queryset = ExcepcionAgenda.objects.all()
+    serializer_class = ExcepcionAgendaSerializer
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        dentista_id = self.request.query_params.get('dentista', None)
+        if dentista_id is not None:
+            queryset = queryset.filter(Q(dentista=dentista_id) | Q(dentista__isnull=True))
+        return queryset
 
 
 class PacienteViewSet(viewsets.ModelViewSet):
@@ -42,10 +110,50 @@ class PacienteViewSet(viewsets.ModelViewSet):
     serializer_class = PacienteSerializer
     permission_classes = [AllowAny]
 
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def importar(self, request):
+        """Importa pacientes desde un CSV o JSONL subido en el campo `archivo` (multipart).
+
+        El formato se deduce de la extensión o del campo `formato`. La respuesta trae los
+        contadores, el throughput y las primeras filas rechazadas con su motivo.
+        """
+        archivo = request.FILES.get('archivo')
+        if archivo is None:
+            return Response({'detail': 'Se requiere el archivo en el campo "archivo".'}, status=status.HTTP_400_BAD_REQUEST)
+        formato = request.data.get('formato') or detectar_formato(archivo.name)
+        if formato not in FORMATOS:
+            return Response({'detail': 'Formato no soportado. Use csv o jsonl.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rechazos = []
+
+        def rechazar(linea, motivo, fila):
+            if len(rechazos) < IMPORTACION_RECHAZOS_MAX:
+                rechazos.append({'linea': linea, 'motivo': motivo})
+
+        # Se verifica antes de importar: los lotes se confirman a medida que se leen
+        if not es_utf8(archivo.file):
+            return Response({'detail': 'El archivo debe estar codificado en UTF-8.'}, status=status.HTTP_400_BAD_REQUEST)
+        texto = io.TextIOWrapper(archivo.file, encoding='utf-8-sig', newline='')
+        try:
+            resultado = importar_pacientes(leer_filas(texto, formato), rechazar=rechazar)
+        finally:
+            texto.detach()
+        resultado['rechazos'] = rechazos
+        return Response(resultado, status=status.HTTP_200_OK)
+
+    def get_queryset(self):
+        # ?q= busca por RUT (prefijo), nombre, apellido o email; ver `agenda.busqueda`
+        q = self.request.query_params.get('q')
+        if q is not None and self.action == 'list':
+            return buscar_pacientes(q)
+        return super().get_queryset()
+
 
 class ReservaViewSet(viewsets.ModelViewSet):
-    queryset = Reserva.objects.select_related('slot', 'slot__dentista', 'paciente', 'servicio').all()
+    queryset = Reserva.objects.select_related('slot', 'slot__dentista', 'slot__servicio', 'paciente', 'servicio').all()
     permission_classes = [AllowAny]
+    # El listado sin `fecha` se pagina por cursor; el de un día sale completo de la caché
+    pagination_class = ReservaKeysetPagination
     
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -67,6 +175,70 @@ class ReservaViewSet(viewsets.ModelViewSet):
             'created': True
         }, status=201)
     
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """Crea muchas reservas en una llamada (call-center, importaciones).
+
+        Body: lista de payloads como los de `create` (o {"reservas": [...]}). La respuesta
+        incluye un resultado por item, en el mismo orden; los fallos no afectan al resto.
+        """
+        items = request.data.get('reservas') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'Se requiere una lista de reservas.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > RESERVAS_BATCH_MAX:
+            return Response({'detail': f'Máximo {RESERVAS_BATCH_MAX} reservas por lote.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        resultados = [None] * len(items)
+        validos = []
+        for indice, item in enumerate(items):
+            serializer = ReservaBatchItemSerializer(data=item)
+            if serializer.is_valid():
+                validos.append((indice, serializer.validated_data))
+            else:
+                resultados[indice] = {'indice': indice, 'ok': False, 'errores': serializer.errors}
+
+        admitidos = admitir_lote([data for _, data in validos])
+        for (indice, _), (reserva, creada, error) in zip(validos, admitidos):
+            if reserva is None:
+                resultados[indice] = {'indice': indice, 'ok': False, 'errores': {'detail': error}}
+            else:
+                resultados[indice] = {
+                    'indice': indice,
+                    'ok': True,
+                    'id': reserva.id,
+                    'slot': reserva.slot_id,
+                    'sobrecupo': reserva.sobrecupo,
+                    'created': creada,
+                }
+
+        # Las reservas que el paciente ya tenía son ok pero no cuentan como creadas
+        creadas = sum(1 for r in resultados if r['ok'] and r['created'])
+        rechazadas = sum(1 for r in resultados if not r['ok'])
+        return Response({
+            'creadas': creadas,
+            'existentes': len(resultados) - creadas - rechazadas,
+            'rechazadas': rechazadas,
+            'resultados': resultados,
+        }, status=status.HTTP_200_OK)
+
+    def list(self, request, *args, **kwargs):
+        # Las reservas de un día (de un dentista o de todos) se sirven desde la caché de disponibilidad
+        try:
+            fecha = datetime.date.fromisoformat(request.query_params.get('fecha', ''))
+            dentista_id = request.query_params.get('dentista')
+            dentista_id = int(dentista_id) if dentista_id is not None else None
+        except ValueError:
+            return super().list(request, *args, **kwargs)
+
+        def cargar():
+            serializer = self.get_serializer(self.filter_queryset(self.get_queryset()), many=True)
+            return list(serializer.data)
+        estado = estado_dia(fecha, dentista_id)
+        return respuesta_condicional(
+            request, estado,
+            lambda: Response(get_cache().get_or_set('reservas', dentista_id, fecha, cargar, sello=estado[0])),
+        )
+
     def get_queryset(self):
         queryset = self.queryset
         
@@ -0,0 +1,144 @@
+"""Utilidades compartidas por los scripts de carga de tools/: cliente HTTP keep-alive y estadísticas.
+
+Solo biblioteca estándar, para poder correrlos contra cualquier despliegue sin instalar nada.
+"""
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+
+class Cliente:
+    """Conexión HTTP keep-alive contra `base_url` (usar una instancia por hilo)."""
+
+    def __init__(self, base_url, timeout=10):
+        partes = urlsplit(base_url)
+        self.https = partes.scheme == 'https'
+        self.host = partes.hostname
+        self.port = partes.port or (443 if self.https else 80)
+        self.prefijo = partes.path.rstrip('/')
+        self.timeout = timeout
+        self._conexion = None
+
+    def _conectar(self):
+        clase = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self._conexion = clase(self.host, self.port, timeout=self.timeout)
+        return self._conexion
+
+    def cerrar(self):
+        if self._conexion is not None:
+            self._conexion.close()
+            self._conexion = None
+
+    def request(self, metodo, ruta, params=None, datos=None, cabeceras=None):
+        """Devuelve (status, cuerpo en bytes, milisegundos). `datos` se envía como JSON."""
+        url = self.prefijo + ruta + (('?' + urlencode(params)) if params else '')
+        cuerpo = json.dumps(datos).encode() if datos is not None else None
+        cabeceras = dict(cabeceras or {})
+        if cuerpo is not None:
+            cabeceras['Content-Type'] = 'application/json'
+        for intento in range(2):
+            conexion = self._conexion or self._conectar()
+            t0 = time.perf_counter()
+            try:
+                conexion.request(metodo, url, body=cuerpo, headers=cabeceras)
+                respuesta = conexion.getresponse()
+                contenido = respuesta.read()
+                return respuesta.status, contenido, (time.perf_counter() - t0) * 1000
+            except (http.client.HTTPException, OSError):
+                # El servidor cerró la conexión keep-alive: reconectar una vez
+                self.cerrar()
+                if intento:
+                    raise
+
+    def get_json(self, ruta, params=None):
+        status, contenido, _ = self.request('GET', ruta, params)
+        if status != 200:
+            raise RuntimeError(f'GET {ruta}: HTTP {status}')
+        return json.loads(contenido)
+
+
+def percentil(ordenados, p):
+    """Percentil `p` (0-100) por rango más cercano de una lista ya ordenada."""
+    if not ordenados:
+        return 0.0
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))
+    return ordenados[indice]
+
+
+def resumen(latencias_ms, errores, segundos):
+    ordenadas = sorted(latencias_ms)
+    return {
+        'peticiones': len(ordenadas),
+        'errores': errores,
+        'rps': round(len(ordenadas) / segundos, 1) if segundos > 0 else 0.0,
+        'p50_ms': round(percentil(ordenadas, 50), 2),
+        'p95_ms': round(percentil(ordenadas, 95), 2),
+        'p99_ms': round(percentil(ordenadas, 99), 2),
+        'max_ms': round(ordenadas[-1], 2) if ordenadas else 0.0,
+    }
+
+
+def histograma(latencias_ms, limites=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)):
+    """Cuenta de latencias por cubeta '<= límite ms' (la última, '> último límite')."""
+    cubetas = {f'<={limite}ms': 0 for limite in limites}
+    cubetas[f'>{limites[-1]}ms'] = 0
+    for latencia in latencias_ms:
+        for limite in limites:
+            if latencia <= limite:
+                cubetas[f'<={limite}ms'] += 1
+                break
+        else:
+            cubetas[f'>{limites[-1]}ms'] += 1
+    return cubetas
+
+
+def martillar(base_url, peticion, concurrencia, duracion):
+    """Corre `peticion(cliente, hilo, n)` en `concurrencia` hilos durante `duracion` segundos.
+
+    `peticion` devuelve el status HTTP; cualquier status >= 400 o excepción cuenta como error.
+    Devuelve (latencias en ms, errores, segundos reales).
+    """
+    latencias, errores = [], [0]
+    candado = threading.Lock()
+    fin = time.perf_counter() + duracion
+
+    def trabajar(hilo):
+        cliente = Cliente(base_url)
+        propias, fallos, n = [], 0, 0
+        try:
+            while time.perf_counter() < fin:
+                t0 = time.perf_counter()
+                try:
+                    status = peticion(cliente, hilo, n)
+                except Exception:
+                    status = None
+                n += 1
+                if status is None or status >= 400:
+                    fallos += 1
+                else:
+                    propias.append((time.perf_counter() - t0) * 1000)
+        finally:
+            cliente.cerrar()
+        with candado:
+            latencias.extend(propias)
+            errores[0] += fallos
+
+    t0 = time.perf_counter()
+    hilos = [threading.Thread(target=trabajar, args=(i,)) for i in range(concurrencia)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return latencias, errores[0], time.perf_counter() - t0
+
+
+def tabla(filas, columnas):
+    """Texto con `filas` (dicts) alineadas en columnas."""
+    anchos = {c: max(len(c), *(len(str(f.get(c, ''))) for f in filas)) for c in columnas}
+    lineas = ['  '.join(c.ljust(anchos[c]) for c in columnas)]
+    lineas.append('  '.join('-' * anchos[c] for c in columnas))
+    for fila in filas:
+        lineas.append('  '.join(str(fila.get(c, '')).ljust(anchos[c]) for c in columnas))
+    return '\n'.join(lineas)
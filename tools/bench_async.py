@@ -0,0 +1,72 @@
+"""Compara requests/s y latencia de cola de los endpoints de lectura servidos por WSGI y por ASGI.
+
+Ambos servidores deben apuntar a la misma base de datos (mismos datos), p. ej.:
+
+    docker compose --profile bench up -d          # WSGI en :8000, ASGI en :8001
+    python tools/bench_async.py --wsgi http://localhost:8000 --asgi http://localhost:8001
+
+Contra WSGI se piden las vistas síncronas (DRF) y contra ASGI sus variantes async
+(/agenda/async/...), que devuelven el mismo JSON. Por cada endpoint se mide durante
+`--duracion` segundos con `--concurrencia` conexiones keep-alive.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _http import Cliente, martillar, resumen, tabla  # noqa: E402
+
+# nombre → (ruta WSGI, ruta ASGI)
+ENDPOINTS = {
+    'slots_por_fecha': ('/agenda/slots_por_fecha/', '/agenda/async/slots_por_fecha/'),
+    'disponibilidad': ('/agenda/disponibilidad/', '/agenda/async/disponibilidad/'),
+    'dentistas': ('/agenda/api/dentistas/', '/agenda/async/dentistas/'),
+    'servicios': ('/agenda/api/servicios/', '/agenda/async/servicios/'),
+}
+
+
+def parametros(nombre, fecha, dentistas, n):
+    if nombre == 'slots_por_fecha':
+        # Rota por dentista para no medir solo aciertos de caché sobre la misma clave
+        return {'fecha': fecha, 'dentista_id': dentistas[n % len(dentistas)]} if dentistas else {'fecha': fecha}
+    if nombre == 'disponibilidad':
+        return {'desde': fecha}
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wsgi', default='http://localhost:8001', help='URL base del servidor WSGI')
+    parser.add_argument('--asgi', default='http://localhost:8000', help='URL base del servidor ASGI')
+    parser.add_argument('--concurrencia', type=int, default=32, help='Conexiones simultáneas')
+    parser.add_argument('--duracion', type=float, default=15, help='Segundos por endpoint y servidor')
+    parser.add_argument('--fecha', default=datetime.date.today().isoformat(), help='Fecha YYYY-MM-DD de las consultas')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help='Endpoints a medir, separados por coma')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo JSON')
+    args = parser.parse_args()
+
+    dentistas = [d['id'] for d in Cliente(args.wsgi).get_json('/agenda/api/dentistas/')]
+    resultados = []
+    for nombre in args.endpoints.split(','):
+        ruta_wsgi, ruta_asgi = ENDPOINTS[nombre]
+        for servidor, base_url, ruta in (('wsgi', args.wsgi, ruta_wsgi), ('asgi', args.asgi, ruta_asgi)):
+            def peticion(cliente, hilo, n, ruta=ruta, nombre=nombre):
+                status, _, _ = cliente.request('GET', ruta, parametros(nombre, args.fecha, dentistas, hilo + n))
+                return status
+
+            latencias, errores, segundos = martillar(base_url, peticion, args.concurrencia, args.duracion)
+            fila = {'endpoint': nombre, 'servidor': servidor, **resumen(latencias, errores, segundos)}
+            resultados.append(fila)
+            print(f"{nombre:16} {servidor}: {fila['rps']} req/s, p99 {fila['p99_ms']} ms", file=sys.stderr)
+
+    print(tabla(resultados, ['endpoint', 'servidor', 'peticiones', 'errores', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'concurrencia': args.concurrencia, 'duracion': args.duracion, 'resultados': resultados}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""Generador de carga del camino de reservas.
+
+1. Siembra la clínica con `seed_data` (regiones, dentistas, pacientes y slots con sobrecupo)
+   en la base configurada, que debe ser la misma que usa el servidor (`DATABASE_URL` o db.sqlite3).
+2. Reproduce contra el servidor, a una tasa objetivo y en lazo abierto, una mezcla de:
+   - ``lectura``: GET /agenda/slots_por_fecha/ de un dentista y día al azar;
+   - ``reserva``: POST /agenda/reservas/ en un dentista, día y hora al azar;
+   - ``disputada``: POST /agenda/reservas/ sobre unos pocos slots "calientes", que se llenan
+     y pasan a sobrecupo (y luego a rechazo) compitiendo entre sí;
+   - ``generar``: POST /agenda/dentistas/<id>/generar_slots/ de un día al azar del horizonte.
+3. Informa por operación latencias (p50/p95/p99 e histograma), rechazos y errores. La latencia
+   se mide desde el instante programado, así que incluye la espera si el servidor no da abasto.
+4. Verifica en la base que ningún slot supera `capacidad + max_overbook`, que ningún dentista
+   supera `max_overbook_day` sobrecupos en un día y que los contadores coinciden con las reservas.
+
+Uso:
+
+    python manage.py runserver --noreload        # u otro servidor sobre la misma base
+    python tools/loadtest.py --url http://localhost:8000 --regiones 3 --dentistas 12 \\
+        --pacientes 2000 --dias 5 --rps 200 --duracion 30
+
+Sale con código 1 si se viola algún invariante o los errores superan `--max-errores` (%).
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _http import Cliente, histograma, resumen, tabla  # noqa: E402
+
+OPERACIONES = ('lectura', 'reserva', 'disputada', 'generar')
+MEZCLA_DEFECTO = 'lectura=60,reserva=25,disputada=10,generar=5'
+
+
+def parsear_mezcla(texto):
+    """'lectura=60,reserva=25' → {'lectura': 60.0, 'reserva': 25.0} (el resto en 0)."""
+    pesos = dict.fromkeys(OPERACIONES, 0.0)
+    for parte in texto.split(','):
+        nombre, _, peso = parte.partition('=')
+        nombre = nombre.strip()
+        if nombre not in pesos:
+            raise argparse.ArgumentTypeError(f'Operación desconocida: {nombre}')
+        pesos[nombre] = float(peso)
+    if not any(pesos.values()):
+        raise argparse.ArgumentTypeError('La mezcla no tiene ninguna operación con peso')
+    return pesos
+
+
+def sembrar(args):
+    from django.core.management import call_command
+
+    call_command(
+        'seed_data',
+        '--regiones', str(args.regiones),
+        '--dentistas', str(args.dentistas),
+        '--pacientes', str(args.pacientes),
+        '--generate-slots', str(args.dias),
+        '--desde', args.desde,
+        '--hasta', args.hasta,
+        '--capacidad', str(args.capacidad),
+        '--max-overbook', str(args.max_overbook),
+        '--max-overbook-dia', str(args.max_overbook_dia),
+        stdout=sys.stderr,
+    )
+
+
+class Escenario:
+    """Datos sembrados con los que se arman las peticiones (se leen una vez de la base)."""
+
+    def __init__(self, args):
+        from agenda.models import Dentista, Paciente, SlotAgenda
+        from agenda.slots_generator import validar_horario
+
+        hoy = datetime.date.today()
+        self.fechas = [hoy + datetime.timedelta(days=i) for i in range(args.dias)]
+        self.horas = [h.strftime('%H:%M') for h in validar_horario(args.desde, args.hasta)]
+        self.dentistas = list(Dentista.objects.order_by('pk').values_list('pk', flat=True))
+        self.pacientes = list(Paciente.objects.order_by('pk').values_list('pk', flat=True))
+        # Los primeros slots del primer día concentran las reservas disputadas
+        self.calientes = list(
+            SlotAgenda.objects.filter(fecha=hoy).order_by('dentista_id', 'hora').values_list('pk', flat=True)[:args.calientes]
+        )
+        self.desde, self.hasta = args.desde, args.hasta
+        if not (self.dentistas and self.pacientes and self.fechas):
+            raise SystemExit('No hay dentistas, pacientes o días para generar carga (¿falta sembrar?)')
+
+    def peticion(self, operacion, rnd):
+        """(método, ruta, params, datos) de una petición de `operacion`."""
+        fecha = rnd.choice(self.fechas).isoformat()
+        dentista = rnd.choice(self.dentistas)
+        if operacion == 'lectura':
+            return 'GET', '/agenda/slots_por_fecha/', {'fecha': fecha, 'dentista_id': dentista}, None
+        if operacion == 'reserva':
+            return 'POST', '/agenda/reservas/', None, {
+                'dentista': dentista, 'fecha': fecha, 'hora_inicio': rnd.choice(self.horas),
+                'paciente': rnd.choice(self.pacientes),
+            }
+        if operacion == 'disputada' and self.calientes:
+            return 'POST', '/agenda/reservas/', None, {
+                'slot': rnd.choice(self.calientes), 'paciente': rnd.choice(self.pacientes),
+            }
+        if operacion == 'disputada':
+            return self.peticion('reserva', rnd)
+        return 'POST', f'/agenda/dentistas/{dentista}/generar_slots/', None, {
+            'fecha': fecha, 'desde': self.desde, 'hasta': self.hasta,
+        }
+
+
+class Registro:
+    """Latencias y resultados por operación (seguro entre hilos)."""
+
+    def __init__(self):
+        self._candado = threading.Lock()
+        self.latencias = collections.defaultdict(list)
+        self.status = collections.defaultdict(collections.Counter)
+        self.errores = collections.Counter()
+        self.rechazos = collections.Counter()
+
+    def anotar(self, operacion, status, milisegundos):
+        with self._candado:
+            self.status[operacion][status] += 1
+            if status is None or status >= 500:
+                self.errores[operacion] += 1
+                return
+            self.latencias[operacion].append(milisegundos)
+            if status == 400 and operacion in ('reserva', 'disputada'):
+                # Slot lleno y sin sobrecupos: es una respuesta esperada, no un error
+                self.rechazos[operacion] += 1
+            elif status >= 400:
+                self.errores[operacion] += 1
+
+
+def generar_carga(args, escenario, pesos):
+    registro = Registro()
+    local = threading.local()
+    operaciones = [op for op in OPERACIONES if pesos[op]]
+    acumulados = [pesos[op] for op in operaciones]
+
+    def ejecutar(operacion, programado, semilla):
+        if not hasattr(local, 'cliente'):
+            local.cliente = Cliente(args.url, timeout=args.timeout)
+        metodo, ruta, params, datos = escenario.peticion(operacion, random.Random(semilla))
+        try:
+            status, _, _ = local.cliente.request(metodo, ruta, params, datos)
+        except Exception:
+            status = None
+        registro.anotar(operacion, status, (time.perf_counter() - programado) * 1000)
+
+    rnd = random.Random(args.semilla)
+    intervalo = 1.0 / args.rps
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        t0 = time.perf_counter()
+        n = 0
+        while True:
+            programado = t0 + n * intervalo
+            if programado - t0 >= args.duracion:
+                break
+            espera = programado - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            operacion = rnd.choices(operaciones, weights=acumulados)[0]
+            pool.submit(ejecutar, operacion, programado, rnd.random())
+            n += 1
+    return registro, time.perf_counter() - t0
+
+
+def verificar(desde):
+    """Lista de violaciones de los invariantes de capacidad y sobrecupo desde la fecha `desde`."""
+    from django.db.models import Count, F, Q
+
+    from agenda.models import Reserva, SlotAgenda
+
+    violaciones = []
+    slots = SlotAgenda.objects.filter(fecha__gte=desde).con_ocupacion_real()
+    excedidos = slots.filter(
+        Q(real_normales__gt=F('capacidad')) | Q(real_sobrecupo__gt=F('max_overbook'))
+    ).values('pk', 'capacidad', 'max_overbook', 'real_normales', 'real_sobrecupo')
+    for s in excedidos:
+        violaciones.append(
+            f"slot {s['pk']}: {s['real_normales']} normales / capacidad {s['capacidad']}, "
+            f"{s['real_sobrecupo']} sobrecupos / max_overbook {s['max_overbook']}"
+        )
+    descuadrados = slots.exclude(
+        reservas_normales=F('real_normales'), reservas_sobrecupo=F('real_sobrecupo'),
+    ).values('pk', 'reservas_normales', 'reservas_sobrecupo', 'real_normales', 'real_sobrecupo')
+    for s in descuadrados:
+        violaciones.append(
+            f"slot {s['pk']}: contadores {s['reservas_normales']}/{s['reservas_sobrecupo']}, "
+            f"reservas reales {s['real_normales']}/{s['real_sobrecupo']}"
+        )
+    dias = (
+        Reserva.objects.filter(sobrecupo=True, slot__fecha__gte=desde)
+        .values('slot__dentista_id', 'slot__fecha', 'slot__dentista__max_overbook_day')
+        .annotate(total=Count('id'))
+        .filter(total__gt=F('slot__dentista__max_overbook_day'))
+        .order_by()
+    )
+    for d in dias:
+        violaciones.append(
+            f"dentista {d['slot__dentista_id']} {d['slot__fecha']}: {d['total']} sobrecupos / "
+            f"max_overbook_day {d['slot__dentista__max_overbook_day']}"
+        )
+    return violaciones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8000', help='URL base del servidor')
+    parser.add_argument('--regiones', type=int, default=3)
+    parser.add_argument('--dentistas', type=int, default=12)
+    parser.add_argument('--pacientes', type=int, default=2000)
+    parser.add_argument('--dias', type=int, default=5, help='Días de slots sembrados (desde hoy)')
+    parser.add_argument('--desde', default='08:00', help='Hora desde de los slots')
+    parser.add_argument('--hasta', default='16:00', help='Hora hasta de los slots')
+    parser.add_argument('--capacidad', type=int, default=1, help='Capacidad de cada slot sembrado')
+    parser.add_argument('--max-overbook', type=int, default=1, help='Sobrecupos por slot sembrado')
+    parser.add_argument('--max-overbook-dia', type=int, default=2, help='Sobrecupos por día de cada dentista')
+    parser.add_argument('--sin-seed', action='store_true', help='No sembrar: usar los datos que ya hay')
+    parser.add_argument('--mezcla', type=parsear_mezcla, default=MEZCLA_DEFECTO,
+                        help=f'Pesos por operación (default {MEZCLA_DEFECTO})')
+    parser.add_argument('--calientes', type=int, default=4, help='Slots sobre los que compiten las reservas disputadas')
+    parser.add_argument('--rps', type=float, default=100, help='Peticiones por segundo objetivo')
+    parser.add_argument('--duracion', type=float, default=30, help='Segundos de carga')
+    parser.add_argument('--concurrencia', type=int, default=64, help='Peticiones en vuelo como máximo')
+    parser.add_argument('--timeout', type=float, default=30, help='Timeout por petición (s)')
+    parser.add_argument('--semilla', type=int, default=1, help='Semilla de la mezcla de tráfico')
+    parser.add_argument('--max-errores', type=float, default=1.0, help='Porcentaje de errores tolerado')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo JSON')
+    args = parser.parse_args()
+    pesos = args.mezcla
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backendClinica.settings')
+    import django
+    django.setup()
+
+    if not args.sin_seed:
+        sembrar(args)
+    escenario = Escenario(args)
+    print(f'Carga: {args.rps} req/s durante {args.duracion}s contra {args.url} '
+          f'({len(escenario.dentistas)} dentistas, {len(escenario.pacientes)} pacientes)', file=sys.stderr)
+    registro, segundos = generar_carga(args, escenario, pesos)
+
+    filas, total, errores = [], 0, 0
+    for operacion in OPERACIONES:
+        if not registro.status[operacion]:
+            continue
+        fila = {'operacion': operacion, **resumen(registro.latencias[operacion], registro.errores[operacion], segundos)}
+        fila['rechazos'] = registro.rechazos[operacion]
+        fila['status'] = dict(sorted(registro.status[operacion].items(), key=lambda kv: str(kv[0])))
+        fila['histograma'] = histograma(registro.latencias[operacion])
+        filas.append(fila)
+        total += sum(registro.status[operacion].values())
+        errores += registro.errores[operacion]
+
+    print(tabla(filas, ['operacion', 'peticiones', 'rechazos', 'errores', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']))
+    for fila in filas:
+        cubetas = ' '.join(f'{k}:{v}' for k, v in fila['histograma'].items() if v)
+        print(f"\n{fila['operacion']}: status {fila['status']}\n  {cubetas}")
+
+    violaciones = verificar(escenario.fechas[0])
+    porcentaje = 100.0 * errores / total if total else 0.0
+    print(f'\nErrores: {errores}/{total} ({porcentaje:.2f}%)')
+    if violaciones:
+        print(f'{len(violaciones)} violaciones de invariantes:')
+        for v in violaciones[:20]:
+            print(f'  {v}')
+    else:
+        print('Invariantes OK: capacidad + max_overbook por slot, max_overbook_day por dentista, contadores')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'rps_objetivo': args.rps, 'duracion': args.duracion, 'resultados': filas,
+                'errores_pct': round(porcentaje, 3), 'violaciones': violaciones,
+            }, f, indent=2, default=str)
+    sys.exit(1 if violaciones or porcentaje > args.max_errores else 0)
+
+
+if __name__ == '__main__':
+    main()